@@ -0,0 +1,279 @@
+"""Admission control: bounded in-flight work, priority lanes, request deadlines and load shedding."""
+import asyncio
+import contextvars
+import itertools
+import math
+import time
+from collections import namedtuple
+
+import orjson
+
+DEADLINE_HEADER = b"x-request-deadline-ms"
+LANE_HEADER = b"x-request-lane"
+
+# Absolute time.monotonic() deadline of the current request, if it sent one
+CURRENT_DEADLINE = contextvars.ContextVar("current_deadline", default=None)
+
+# priority: lower is served first and shed last; max_queue: how many
+# requests of the lane may wait for a slot (0 = admitted only when one is free)
+Lane = namedtuple("Lane", ["name", "priority", "max_queue"])
+
+
+class Rejected(Exception):
+    """The request was turned away or shed; retry after ``retry_after`` seconds."""
+
+    def __init__(self, retry_after, reason="busy"):
+        super().__init__(f"Server busy ({reason})")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before its work could run."""
+
+
+def current_deadline():
+    return CURRENT_DEADLINE.get()
+
+
+def deadline_expired(deadline=None):
+    """Whether ``deadline`` (the current request's when None) has passed."""
+    deadline = CURRENT_DEADLINE.get() if deadline is None else deadline
+    return deadline is not None and time.monotonic() >= deadline
+
+
+class Ticket:
+    """An admitted request's slot; released once the response is complete."""
+
+    def __init__(self, controller, lane):
+        self.lane = lane
+        self.started = time.monotonic()
+        self._controller = controller
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._controller._release(self)
+
+
+class _Waiter:
+    def __init__(self, lane, seq, future, deadline):
+        self.lane = lane
+        self.seq = seq
+        self.future = future
+        self.deadline = deadline
+
+
+class AdmissionController:
+    """
+    Bound the requests doing work at once and queue a limited number more.
+
+    Up to ``max_in_flight`` requests run at a time. Beyond that, a request
+    waits in its lane's queue, provided the lane has fewer than
+    ``lane.max_queue`` waiting and all lanes together fewer than
+    ``max_queue``. When the shared queue is full, a newcomer sheds the
+    newest waiter of a lower-priority lane instead of being rejected itself.
+    Freed slots go to the highest-priority, oldest waiter. Waiters whose
+    deadline passes are dropped without ever being admitted.
+
+    Rejections carry a Retry-After estimate from the moving average time a
+    request holds its slot and the queue ahead of it.
+    """
+
+    def __init__(self, max_in_flight, max_queue, lanes):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_queue = max(0, int(max_queue))
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.in_flight = 0
+        self.avg_service_s = None
+        self._waiters = []
+        self._seq = itertools.count()
+        self.counters = {
+            name: {"admitted": 0, "queued": 0, "rejected": 0, "shed": 0, "expired": 0}
+            for name in self.lanes
+        }
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """Seconds until a slot is likely free for a request joining the back of the queue."""
+        service_s = self.avg_service_s or 1.0
+        return max(1, math.ceil(service_s * (len(self._waiters) + 1) / self.max_in_flight))
+
+    async def acquire(self, lane_name, deadline=None):
+        """
+        Wait for a slot in ``lane_name``; returns a Ticket to release when done.
+
+        Raises Rejected when the request cannot queue or is shed while
+        waiting, and DeadlineExceeded when ``deadline`` passes first.
+        """
+        lane = self.lanes[lane_name]
+        counters = self.counters[lane_name]
+        if deadline_expired(deadline):
+            counters["expired"] += 1
+            raise DeadlineExceeded("Request deadline exceeded before admission")
+
+        if self.in_flight < self.max_in_flight:
+            return self._admit(lane)
+
+        lane_waiting = sum(1 for waiter in self._waiters if waiter.lane is lane)
+        if lane_waiting >= lane.max_queue:
+            counters["rejected"] += 1
+            raise Rejected(self.retry_after(), "lane queue full")
+        if len(self._waiters) >= self.max_queue and not self._shed_below(lane):
+            counters["rejected"] += 1
+            raise Rejected(self.retry_after(), "queue full")
+
+        waiter = _Waiter(lane, next(self._seq), asyncio.get_running_loop().create_future(), deadline)
+        self._waiters.append(waiter)
+        counters["queued"] += 1
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            self._hand_on(waiter)
+            counters["expired"] += 1
+            raise DeadlineExceeded("Request deadline exceeded while queued")
+        except asyncio.CancelledError:
+            self._hand_on(waiter)
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _hand_on(self, waiter):
+        """Release a slot granted to a waiter that gave up at the same moment."""
+        if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+            waiter.future.result().release()
+
+    def _admit(self, lane):
+        self.in_flight += 1
+        self.counters[lane.name]["admitted"] += 1
+        return Ticket(self, lane)
+
+    def _shed_below(self, lane):
+        """Reject the newest waiter of the lowest lane below ``lane``; True if one was shed."""
+        lower = [waiter for waiter in self._waiters if waiter.lane.priority > lane.priority]
+        if not lower:
+            return False
+        victim = max(lower, key=lambda waiter: (waiter.lane.priority, waiter.seq))
+        self._waiters.remove(victim)
+        self.counters[victim.lane.name]["shed"] += 1
+        if not victim.future.done():
+            victim.future.set_exception(Rejected(self.retry_after(), "shed for higher priority work"))
+        return True
+
+    def _release(self, ticket):
+        self.in_flight -= 1
+        held_s = time.monotonic() - ticket.started
+        self.avg_service_s = held_s if self.avg_service_s is None else 0.9 * self.avg_service_s + 0.1 * held_s
+
+        while self._waiters and self.in_flight < self.max_in_flight:
+            waiter = min(self._waiters, key=lambda waiter: (waiter.lane.priority, waiter.seq))
+            self._waiters.remove(waiter)
+            if waiter.future.done():
+                continue
+            if deadline_expired(waiter.deadline):
+                self.counters[waiter.lane.name]["expired"] += 1
+                waiter.future.set_exception(DeadlineExceeded("Request deadline exceeded while queued"))
+                continue
+            waiter.future.set_result(self._admit(waiter.lane))
+
+    def stats(self):
+        """Limits, occupancy, service time and per-lane counters."""
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "avg_service_ms": round(self.avg_service_s * 1000.0, 2) if self.avg_service_s is not None else None,
+            "lanes": {
+                name: {
+                    "priority": lane.priority,
+                    "max_queue": lane.max_queue,
+                    "waiting": sum(1 for waiter in self._waiters if waiter.lane is lane),
+                    **self.counters[name],
+                }
+                for name, lane in self.lanes.items()
+            },
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits requests to ``routes`` (path -> default lane) before their body is read.
+
+    Clients may move to a lane of equal or lower priority than the route's
+    with ``X-Request-Lane`` (never a higher one, so webcam frames cannot jump
+    ahead of uploads) and set a time budget with ``X-Request-Deadline-Ms``
+    (milliseconds from arrival, finite and not negative), which
+    is also published as ``CURRENT_DEADLINE`` for the handler. Turned-away
+    requests get a 429 with Retry-After, expired ones a 504, without the
+    upload ever being buffered.
+    """
+
+    def __init__(self, app, controller, routes):
+        self.app = app
+        self.controller = controller
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        lane = self.routes.get(scope.get("path")) if scope["type"] == "http" else None
+        if lane is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or ())
+        requested = headers.get(LANE_HEADER, b"").decode("latin-1").strip().lower()
+        if requested:
+            if requested not in self.controller.lanes:
+                await _respond(send, 400, {"detail": f"Unknown lane '{requested}'; "
+                                                     f"expected one of {sorted(self.controller.lanes)}"})
+                return
+            if self.controller.lanes[requested].priority < self.controller.lanes[lane].priority:
+                await _respond(send, 400, {"detail": f"Lane '{requested}' has a higher priority than this route's "
+                                                     f"'{lane}' lane"})
+                return
+            lane = requested
+
+        deadline = None
+        if DEADLINE_HEADER in headers:
+            try:
+                budget_ms = float(headers[DEADLINE_HEADER])
+            except ValueError:
+                budget_ms = math.nan
+            if not math.isfinite(budget_ms) or budget_ms < 0:
+                await _respond(send, 400, {"detail": "X-Request-Deadline-Ms must be a non-negative number of "
+                                                     "milliseconds"})
+                return
+            deadline = time.monotonic() + budget_ms / 1000.0
+
+        try:
+            ticket = await self.controller.acquire(lane, deadline)
+        except Rejected as e:
+            await _respond(send, 429, {"detail": str(e)}, [(b"retry-after", str(e.retry_after).encode())])
+            return
+        except DeadlineExceeded as e:
+            await _respond(send, 504, {"detail": str(e)})
+            return
+
+        token = CURRENT_DEADLINE.set(deadline)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            CURRENT_DEADLINE.reset(token)
+            ticket.release()
+
+
+async def _respond(send, status, body, headers=()):
+    content = orjson.dumps(body)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(content)).encode()),
+                    *headers],
+    })
+    await send({"type": "http.response.body", "body": content})
@@ -0,0 +1,79 @@
+"""Reading images out of uploaded zip and tar archives."""
+import posixpath
+import tarfile
+import zipfile
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".gif", ".tif", ".tiff"}
+
+
+class ArchiveError(Exception):
+    """An archive, or one of its members, that cannot be read."""
+
+
+def _is_image_name(name):
+    parts = name.split("/")
+    # Skip folders like __MACOSX/ and dotfiles such as AppleDouble ._ companions
+    if any(part.startswith((".", "__MACOSX")) for part in parts):
+        return False
+    return posixpath.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+class ImageArchive:
+    """
+    Lazily iterate the images of a zip or tar (optionally compressed) file.
+
+    Members are read one at a time, so memory use is bounded by the largest
+    image rather than by the archive. Members larger than
+    ``max_member_bytes`` are yielded as an ``ArchiveError`` instead of being
+    extracted; non-image members are skipped. The archive owns ``fileobj``
+    and closes it in ``close``.
+    """
+
+    def __init__(self, fileobj, max_member_bytes=20 * 1024 * 1024):
+        self.max_member_bytes = max_member_bytes
+        self._fileobj = fileobj
+        self._zip = self._tar = None
+        try:
+            fileobj.seek(0)
+            if zipfile.is_zipfile(fileobj):
+                fileobj.seek(0)
+                self._zip = zipfile.ZipFile(fileobj)
+            else:
+                fileobj.seek(0)
+                self._tar = tarfile.open(fileobj=fileobj, mode="r:*")
+        except (zipfile.BadZipFile, tarfile.TarError, OSError):
+            fileobj.close()
+            raise ArchiveError("Unsupported or corrupt archive (expected zip or tar)")
+
+    def __iter__(self):
+        """Yield (name, bytes) per image, or (name, ArchiveError) when it cannot be read."""
+        if self._zip is not None:
+            for info in self._zip.infolist():
+                if info.is_dir() or not _is_image_name(info.filename):
+                    continue
+                # file_size comes from the archive directory, so oversized
+                # (or zip bomb) members are refused before decompressing
+                if info.file_size > self.max_member_bytes:
+                    yield info.filename, ArchiveError(f"Image is larger than {self.max_member_bytes} bytes")
+                    continue
+                try:
+                    yield info.filename, self._zip.read(info)
+                except (zipfile.BadZipFile, OSError, RuntimeError) as e:
+                    yield info.filename, ArchiveError(f"Failed to extract image: {str(e)}")
+        else:
+            for member in self._tar:
+                if not member.isfile() or not _is_image_name(member.name):
+                    continue
+                if member.size > self.max_member_bytes:
+                    yield member.name, ArchiveError(f"Image is larger than {self.max_member_bytes} bytes")
+                    continue
+                try:
+                    yield member.name, self._tar.extractfile(member).read()
+                except (tarfile.TarError, OSError) as e:
+                    yield member.name, ArchiveError(f"Failed to extract image: {str(e)}")
+
+    def close(self):
+        for archive in (self._zip, self._tar):
+            if archive is not None:
+                archive.close()
+        self._fileobj.close()
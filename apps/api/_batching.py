@@ -0,0 +1,184 @@
+"""Dynamic micro-batching of inference requests."""
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+from _admission import DeadlineExceeded
+from _metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+WAIT_MS_BUCKETS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class MicroBatcher:
+    """
+    Collect tensors from concurrent requests and run them as one batch.
+
+    Each submitted tensor has a leading batch dimension of 1. Tensors are
+    queued per input shape, since only equally sized images can be stacked.
+    A batch is dispatched as soon as ``max_batch_size`` tensors of one shape
+    are queued or the oldest of them has waited ``max_wait_ms``, whichever
+    comes first. The
+    ``run_batch`` callable receives the stacked NCHW array and must return an
+    array whose first axis indexes the images of the batch.
+
+    Batches run on ``executor`` (the loop's default executor when None), with
+    at most ``max_concurrent_batches`` in flight. While every slot is busy new
+    requests keep queueing, so batches grow under load instead of piling up
+    in the executor.
+
+    A tensor submitted with a ``deadline`` (a ``time.monotonic()`` value) that
+    has passed by the time its batch is dispatched is dropped from the batch
+    and its caller gets DeadlineExceeded, so expired work never reaches the
+    model.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=2.0, executor=None,
+                 max_concurrent_batches=1):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.executor = executor
+        self.max_concurrent_batches = max(1, int(max_concurrent_batches))
+        self.batches_in_flight = 0
+
+        self.batch_size_histogram = Histogram(BATCH_SIZE_BUCKETS)
+        self.wait_ms_histogram = Histogram(WAIT_MS_BUCKETS)
+        self.queue_depth_histogram = Histogram(QUEUE_DEPTH_BUCKETS)
+        self.batches_run = 0
+        self.images_run = 0
+        self.expired = 0
+
+        self._loop = None
+        self._slots = None
+        self._queues = {}   # input shape -> asyncio.Queue
+        self._workers = {}  # input shape -> dispatch task
+        self._running = set()
+
+    def _get_queue(self, shape):
+        """Return the queue for ``shape``, starting its dispatch loop if needed."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # First use, or the event loop was replaced (e.g. between test clients)
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._queues, self._workers = {}, {}
+
+        worker = self._workers.get(shape)
+        if worker is None or worker.done():
+            self._queues[shape] = asyncio.Queue()
+            self._workers[shape] = loop.create_task(self._dispatch_loop(self._queues[shape]))
+        return self._queues[shape]
+
+    async def submit(self, tensor, deadline=None):
+        """Queue a (1, C, H, W) tensor and wait for its slice of the batch output."""
+        queue = self._get_queue(tensor.shape)
+        self.queue_depth_histogram.observe(queue.qsize())
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((tensor, future, time.perf_counter(), deadline))
+        return await future
+
+    async def _collect(self, queue, first):
+        """Gather more items after ``first`` until the batch is full or the window closes."""
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # Still take whatever is already queued without waiting
+                try:
+                    batch.append(queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _dispatch_loop(self, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await queue.get()
+
+            # Only open the batching window once an executor slot is free, so
+            # requests arriving while all slots are busy join this batch
+            await self._slots.acquire()
+            try:
+                batch = await self._collect(queue, first)
+            except BaseException:
+                self._slots.release()
+                raise
+
+            # Skip requests whose callers already went away or gave up waiting
+            batch = [item for item in batch if not item[1].cancelled() and not self._expire(item)]
+            if not batch:
+                self._slots.release()
+                continue
+
+            dispatched_at = time.perf_counter()
+            for _, _, enqueued_at, _ in batch:
+                self.wait_ms_histogram.observe((dispatched_at - enqueued_at) * 1000.0)
+            self.batch_size_histogram.observe(len(batch))
+
+            # Stack before yielding so callers may recycle their input buffers
+            stacked = np.concatenate([item[0] for item in batch], axis=0)
+            task = loop.create_task(self._run(loop, stacked, batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    def _expire(self, item):
+        """Fail ``item`` with DeadlineExceeded if its deadline has passed; True if it did."""
+        _, future, _, deadline = item
+        if deadline is None or time.monotonic() < deadline:
+            return False
+        self.expired += 1
+        future.set_exception(DeadlineExceeded("Request deadline exceeded before inference"))
+        return True
+
+    async def _run(self, loop, stacked, batch):
+        self.batches_in_flight += 1
+        try:
+            outputs = await loop.run_in_executor(self.executor, self.run_batch, stacked)
+        except Exception as e:
+            logger.error(f"Batched inference failed: {str(e)}")
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.batches_in_flight -= 1
+            self._slots.release()
+
+        self.batches_run += 1
+        self.images_run += len(batch)
+
+        for i, (_, future, _, _) in enumerate(batch):
+            if not future.done():
+                future.set_result(outputs[i:i + 1])
+
+    def stats(self):
+        """Configuration and histograms for tuning the batching window."""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "max_concurrent_batches": self.max_concurrent_batches,
+            "batches_in_flight": self.batches_in_flight,
+            "queue_depth": sum(queue.qsize() for queue in self._queues.values()),
+            "active_shapes": [list(shape[2:]) for shape in self._queues],
+            "batches_run": self.batches_run,
+            "images_run": self.images_run,
+            "expired": self.expired,
+            "avg_batch_size": self.images_run / self.batches_run if self.batches_run else 0.0,
+            "batch_size_histogram": self.batch_size_histogram.snapshot(),
+            "wait_ms_histogram": self.wait_ms_histogram.snapshot(),
+            "queue_depth_histogram": self.queue_depth_histogram.snapshot(),
+        }
@@ -0,0 +1,238 @@
+"""Content-addressed cache of detection results."""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(image_bytes, model_id, conf_thres, iou_thres, input_size, rect=False, classes=None,
+                   tiling=None):
+    """Hash the image bytes together with everything that changes the result."""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(f"|{model_id}|{conf_thres}|{iou_thres}|{input_size[0]}x{input_size[1]}|rect={rect}".encode())
+    if classes is not None:
+        digest.update(f"|classes={','.join(map(str, classes))}".encode())
+    if tiling is not None:
+        digest.update(f"|tiling={tiling}".encode())
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """
+    Two-tier result cache keyed by ``make_cache_key``.
+
+    The in-process tier is an LRU bounded by the approximate serialized size
+    of its payloads (``max_bytes``). The optional disk tier stores one JSON
+    file per key under ``disk_dir`` so several workers or pods sharing the
+    directory reuse each other's results. It is bounded by
+    ``disk_max_bytes``: once the files written since the last scan could
+    push the directory past it, the directory is scanned and the least
+    recently used files (by modification time, refreshed on every hit) are
+    removed until it is back under ``DISK_LOW_WATER`` of the budget. Entries
+    in both tiers expire after ``ttl_seconds``.
+    """
+
+    # Share of disk_max_bytes the disk tier is pruned down to
+    DISK_LOW_WATER = 0.9
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=3600.0, disk_dir=None,
+                 disk_max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+
+        self._entries = OrderedDict()  # key -> (expires_at, size, payload)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disk_size = None  # bytes under disk_dir as of the last scan plus writes since; None until scanned
+        self._disk_lock = threading.Lock()
+        self.counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "disk_evictions": 0,
+            "expirations": 0,
+            "disk_errors": 0,
+        }
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or self.disk_dir is not None
+
+    def _get_memory(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, size, payload = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._size -= size
+                self.counters["expirations"] += 1
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def _put_memory(self, key, payload, size, expires_at):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._entries[key] = (expires_at, size, payload)
+            self._size += size
+
+            # Evict least recently used entries until we fit the budget
+            while self._size > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.counters["evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _get_disk(self, key, now):
+        path = self._disk_path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable cache entry {path}: {str(e)}")
+            self.counters["disk_errors"] += 1
+            return None
+
+        if entry["expires_at"] <= now:
+            self.counters["expirations"] += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)  # recently used: evicted last
+        except OSError:
+            pass
+        return entry
+
+    def _put_disk(self, key, serialized, expires_at):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+            content = f'{{"expires_at": {expires_at}, "payload": {serialized}}}'
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+            os.replace(partial_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {path}: {str(e)}")
+            self.counters["disk_errors"] += 1
+            return
+
+        with self._disk_lock:
+            if self._disk_size is not None:
+                self._disk_size += len(content)
+            if self._disk_size is None or self._disk_size > self.disk_max_bytes:
+                self._prune_disk()
+
+    def _prune_disk(self):
+        """Scan ``disk_dir`` and remove least recently used files until it is under the low-water mark."""
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue  # removed by another process meanwhile
+                # Leftovers of writers that died mid-write are dropped outright
+                if name.endswith(".part") and time.time() - info.st_mtime > 60:
+                    self._remove_disk_file(path)
+                    continue
+                files.append((info.st_mtime, info.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        if total > self.disk_max_bytes:
+            target = self.disk_max_bytes * self.DISK_LOW_WATER
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                if self._remove_disk_file(path):
+                    total -= size
+                    self.counters["disk_evictions"] += 1
+        self._disk_size = total
+
+    @staticmethod
+    def _remove_disk_file(path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+
+    async def get(self, key):
+        """Return the cached payload for ``key`` or None."""
+        now = time.time()
+        if self.max_bytes > 0:
+            payload = self._get_memory(key, now)
+            if payload is not None:
+                self.counters["hits"] += 1
+                return payload
+
+        if self.disk_dir:
+            entry = await asyncio.to_thread(self._get_disk, key, now)
+            if entry is not None:
+                self.counters["disk_hits"] += 1
+                if self.max_bytes > 0:
+                    size = len(json.dumps(entry["payload"]))
+                    self._put_memory(key, entry["payload"], size, entry["expires_at"])
+                return entry["payload"]
+
+        self.counters["misses"] += 1
+        return None
+
+    async def put(self, key, payload):
+        """Store a JSON-serializable payload in every enabled tier."""
+        serialized = json.dumps(payload)
+        expires_at = time.time() + self.ttl_seconds
+        self.counters["stores"] += 1
+
+        if self.max_bytes > 0:
+            self._put_memory(key, payload, len(serialized), expires_at)
+        if self.disk_dir:
+            await asyncio.to_thread(self._put_disk, key, serialized, expires_at)
+
+    def stats(self):
+        """Tier configuration, occupancy and hit/miss/eviction counters."""
+        lookups = self.counters["hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        with self._lock:
+            entries, size = len(self._entries), self._size
+        return {
+            "enabled": self.enabled,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "disk_dir": self.disk_dir,
+            "disk_max_bytes": self.disk_max_bytes if self.disk_dir else None,
+            "disk_bytes": self._disk_size,
+            "entries": entries,
+            "bytes": size,
+            "hit_ratio": (self.counters["hits"] + self.counters["disk_hits"]) / lookups if lookups else 0.0,
+            **self.counters,
+        }
@@ -0,0 +1,91 @@
+"""Class allowlists: named class profiles and per-request class filters."""
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _read_json(data_dir, filename):
+    path = os.path.join(data_dir, filename)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.warning(f"Class data not found: {path}")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Failed to read class data {path}: {str(e)}")
+    return None
+
+
+def load_class_profiles(data_dir, class_names):
+    """
+    Build the named class profiles as sorted arrays of class indices.
+
+    - food: classes labelled Food in enhanced_class_labels.json, plus every
+      class with an entry in nutrition_database.json
+    - toys: classes labelled Toys in enhanced_class_labels.json
+    - safety: the safe, supervised and restricted objects of
+      child_safety_data.json
+
+    Profiles whose data files are missing are left out.
+    """
+    index = {name: i for i, name in enumerate(class_names)}
+    members = {}
+
+    labels = _read_json(data_dir, "enhanced_class_labels.json")
+    if labels:
+        for name, info in labels.items():
+            category = str(info.get("category", "")).lower()
+            if category in ("food", "toys"):
+                members.setdefault(category, set()).add(name)
+
+    nutrition = _read_json(data_dir, "nutrition_database.json")
+    if nutrition:
+        members.setdefault("food", set()).update(nutrition)
+
+    safety = _read_json(data_dir, "child_safety_data.json")
+    if safety:
+        members["safety"] = set(
+            safety.get("safe_objects", []) + safety.get("supervised_objects", []) + safety.get("restricted_objects", [])
+        )
+
+    return {
+        profile: np.array(sorted(index[name] for name in names if name in index), dtype=np.int64)
+        for profile, names in members.items()
+    }
+
+
+def resolve_class_filter(profiles, class_names, profile=None, classes=None):
+    """
+    Class indices a request keeps, or None to keep every class.
+
+    ``classes`` is a comma-separated list of class names or ids. Given
+    together with ``profile``, only classes in both are kept. Raises
+    ValueError for an unknown profile or class.
+    """
+    keep = None
+    if profile:
+        if profile not in profiles:
+            raise ValueError(f"Unknown class profile '{profile}'; available: {sorted(profiles)}")
+        keep = profiles[profile]
+
+    if classes:
+        index = {name: i for i, name in enumerate(class_names)}
+        wanted = set()
+        for item in classes.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            if item.isdigit() and int(item) < len(class_names):
+                wanted.add(int(item))
+            elif item in index:
+                wanted.add(index[item])
+            else:
+                raise ValueError(f"Unknown class '{item}'")
+        requested = np.array(sorted(wanted), dtype=np.int64)
+        keep = requested if keep is None else np.intersect1d(keep, requested)
+
+    return keep
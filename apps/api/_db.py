@@ -0,0 +1,396 @@
+"""Pooled Postgres access shared by the API modules: bounded, health-checked connections and prepared statements."""
+import asyncio
+import collections
+import contextlib
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+from _metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+WAIT_MS_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000, 5000)
+
+
+class DatabaseUnavailable(Exception):
+    """No database is configured, or no connection to it could be opened."""
+
+
+class PoolTimeout(Exception):
+    """Every pooled connection stayed busy for the whole acquire timeout."""
+
+
+class _PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers its prepared statements and when it was last known good."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = self.last_checked = time.monotonic()
+
+
+class Connection:
+    """
+    A connection checked out of a ``Database`` for the duration of an ``async with``.
+
+    The query methods run a registered prepared statement on one of the
+    pool's threads and return rows as dicts. ``run`` hands the raw psycopg2
+    connection to a blocking function instead, inside a transaction if
+    asked to (connections are in autocommit mode otherwise).
+    """
+
+    def __init__(self, db, raw):
+        self._db = db
+        self.raw = raw
+
+    async def fetch(self, statement, params=()):
+        """All rows of ``statement``."""
+        return await self._db._call(self._execute, statement, params, "all")
+
+    async def fetchone(self, statement, params=()):
+        """The first row of ``statement``, or None."""
+        return await self._db._call(self._execute, statement, params, "one")
+
+    async def execute(self, statement, params=()):
+        """Run ``statement``; returns the affected row count."""
+        return await self._db._call(self._execute, statement, params, None)
+
+    async def run(self, fn, *args, transaction=False):
+        """Call ``fn(raw_connection, *args)`` on a pool thread, committed as one transaction if ``transaction``."""
+        return await self._db._call(self._run, fn, args, transaction)
+
+    def _execute(self, statement, params, rows):
+        raw = self.raw
+        with raw.cursor() as cur:
+            if statement not in raw.prepared:
+                cur.execute(f"PREPARE {statement} AS {self._db.statements[statement]}")
+                raw.prepared.add(statement)
+            if params:
+                # Values are interpolated client-side, so cast each one to its declared type: an
+                # untyped literal such as ARRAY[NULL, NULL] would otherwise be text[]
+                types = self._db.param_types.get(statement) or ()
+                placeholders = [f"%s::{types[i]}" if i < len(types) else "%s" for i in range(len(params))]
+                cur.execute(f"EXECUTE {statement} ({', '.join(placeholders)})", tuple(params))
+            else:
+                cur.execute(f"EXECUTE {statement}")
+            if rows == "all":
+                return cur.fetchall()
+            if rows == "one":
+                return cur.fetchone()
+            return cur.rowcount
+
+    def _run(self, fn, args, transaction):
+        raw = self.raw
+        if not transaction:
+            return fn(raw, *args)
+        raw.autocommit = False
+        try:
+            with raw:  # commits, or rolls back when fn raises
+                return fn(raw, *args)
+        finally:
+            if not raw.closed:
+                raw.autocommit = True
+
+
+class Database:
+    """
+    Bounded pool of Postgres connections for async handlers.
+
+    At most ``max_size`` connections are open; a request waits up to
+    ``timeout_s`` for one to come free and then gets PoolTimeout.
+    Connections are opened on demand (``open`` pre-opens ``min_size``),
+    reused most recently used first, and closed once idle for
+    ``max_idle_s`` beyond ``min_size``. One idle for longer than
+    ``health_check_interval_s`` runs ``SELECT 1`` before it is handed out
+    and is replaced if that fails; one returned broken or mid-transaction
+    is closed.
+
+    Queries are registered once with ``prepare`` (``$1``-style parameters,
+    optionally with their SQL types) and prepared on each connection the
+    first time it runs them, so the server parses and plans them once per
+    connection instead of per call.
+    Blocking psycopg2 calls run on a dedicated thread per connection, never
+    on the event loop.
+
+    Without a ``dsn`` the database is disabled and acquiring a connection
+    raises DatabaseUnavailable, as does a failed connect.
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout_s=5.0, health_check_interval_s=30.0,
+                 max_idle_s=300.0):
+        self.dsn = dsn or None
+        self.max_size = max(1, int(max_size))
+        self.min_size = min(max(0, int(min_size)), self.max_size)
+        self.timeout_s = timeout_s
+        self.health_check_interval_s = health_check_interval_s
+        self.max_idle_s = max_idle_s
+        self.statements = {}
+        self.param_types = {}
+
+        self._idle = collections.deque()  # least recently used first
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._loop = None
+        self._slots = None
+        self._executor = ThreadPoolExecutor(max_workers=self.max_size, thread_name_prefix="db")
+
+        self.wait_ms_histogram = Histogram(WAIT_MS_BUCKETS)
+        self.counters = {
+            "acquired": 0,
+            "timeouts": 0,
+            "connects": 0,
+            "connect_errors": 0,
+            "health_check_failures": 0,
+            "discarded": 0,
+        }
+        self.last_error = None
+
+    @classmethod
+    def from_env(cls):
+        """Pool for DATABASE_URL sized by the DB_POOL_* settings."""
+        return cls(
+            os.getenv("DATABASE_URL"),
+            min_size=int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+            max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            timeout_s=float(os.getenv("DB_POOL_TIMEOUT_S", "5")),
+            health_check_interval_s=float(os.getenv("DB_HEALTH_CHECK_INTERVAL_S", "30")),
+            max_idle_s=float(os.getenv("DB_POOL_MAX_IDLE_S", "300")),
+        )
+
+    @property
+    def enabled(self):
+        return self.dsn is not None
+
+    def prepare(self, name, sql, param_types=()):
+        """
+        Register ``sql`` as the prepared statement ``name`` for every connection.
+
+        ``param_types`` lists the SQL type of each parameter in order; give
+        them for parameters whose Python value does not carry its type, such
+        as lists that may hold only None.
+        """
+        self.statements[name] = sql
+        self.param_types[name] = tuple(param_types)
+
+    async def open(self):
+        """Open ``min_size`` connections ahead of the first request; returns False if the database is unreachable."""
+        if not self.enabled:
+            return False
+        loop = asyncio.get_running_loop()
+        try:
+            while self._size < self.min_size:
+                self._idle.append(await loop.run_in_executor(self._executor, self._connect))
+                self._size += 1
+        except DatabaseUnavailable as e:
+            logger.error(f"Database connection error: {str(e)}")
+            return False
+        return True
+
+    async def close(self):
+        """Close the idle connections; ones still in use are closed as they are returned."""
+        while self._idle:
+            self._discard(self._idle.popleft())
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """Check out a Connection for the block; raises DatabaseUnavailable or PoolTimeout."""
+        raw = await self._acquire()
+        try:
+            yield Connection(self, raw)
+        finally:
+            self._release(raw)
+
+    async def fetch(self, statement, params=()):
+        async with self.connection() as conn:
+            return await conn.fetch(statement, params)
+
+    async def fetchone(self, statement, params=()):
+        async with self.connection() as conn:
+            return await conn.fetchone(statement, params)
+
+    async def execute(self, statement, params=()):
+        async with self.connection() as conn:
+            return await conn.execute(statement, params)
+
+    def _get_slots(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # First use, or the event loop was replaced (e.g. between test clients)
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_size - self._in_use)
+        return self._slots
+
+    async def _acquire(self):
+        if not self.enabled:
+            raise DatabaseUnavailable("DATABASE_URL is not set")
+        slots = self._get_slots()
+        started = time.perf_counter()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=self.timeout_s)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise PoolTimeout(f"No database connection came free within {self.timeout_s}s")
+        finally:
+            self._waiting -= 1
+        self.wait_ms_histogram.observe((time.perf_counter() - started) * 1000.0)
+
+        self._in_use += 1
+        try:
+            raw = await self._checkout()
+        except BaseException:
+            self._in_use -= 1
+            slots.release()
+            raise
+        self.counters["acquired"] += 1
+        return raw
+
+    async def _checkout(self):
+        """An idle connection that is still good, or a new one."""
+        loop = asyncio.get_running_loop()
+        while self._idle:
+            raw = self._idle.pop()
+            if raw.closed:
+                self._discard(raw)
+                continue
+            if time.monotonic() - raw.last_checked >= self.health_check_interval_s:
+                if not await loop.run_in_executor(self._executor, self._healthy, raw):
+                    self.counters["health_check_failures"] += 1
+                    self._discard(raw)
+                    continue
+            return raw
+
+        raw = await loop.run_in_executor(self._executor, self._connect)
+        self._size += 1
+        return raw
+
+    def _connect(self):
+        try:
+            raw = psycopg2.connect(self.dsn, connection_factory=_PooledConnection, cursor_factory=RealDictCursor)
+            raw.autocommit = True
+        except psycopg2.Error as e:
+            self.counters["connect_errors"] += 1
+            self.last_error = str(e)
+            raise DatabaseUnavailable(str(e)) from e
+        self.counters["connects"] += 1
+        return raw
+
+    @staticmethod
+    def _healthy(raw):
+        try:
+            with raw.cursor() as cur:
+                cur.execute("SELECT 1")
+            raw.last_checked = time.monotonic()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _release(self, raw):
+        self._in_use -= 1
+        if raw.closed or raw.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            self._discard(raw)
+        else:
+            raw.last_used = raw.last_checked = time.monotonic()
+            self._idle.append(raw)
+            self._close_idle()
+        if self._slots is not None:
+            self._slots.release()
+
+    def _close_idle(self):
+        """Close connections idle for over ``max_idle_s``, keeping ``min_size`` open."""
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0].last_used > self.max_idle_s:
+            self._discard(self._idle.popleft())
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        self._size -= 1
+        self.counters["discarded"] += 1
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def register_metrics(self, registry):
+        """Expose pool occupancy, wait time and connection counters on a ``_metrics.Registry``."""
+        registry.gauge("db_pool_connections", "Open database connections", lambda: self._size)
+        registry.gauge("db_pool_in_use", "Database connections checked out", lambda: self._in_use)
+        registry.gauge("db_pool_waiting", "Requests waiting for a database connection", lambda: self._waiting)
+        registry.gauge("db_pool_utilization", "Checked-out share of the maximum pool size",
+                       lambda: self._in_use / self.max_size)
+        registry.register("db_pool_wait_milliseconds", "histogram", "Time spent waiting for a database connection",
+                          self.wait_ms_histogram)
+        registry.counter("db_pool_timeouts_total", "Requests that gave up waiting for a connection",
+                         callback=lambda: self.counters["timeouts"])
+        registry.counter("db_pool_connects_total", "Database connections opened",
+                         callback=lambda: self.counters["connects"])
+        registry.counter("db_pool_health_check_failures_total", "Idle connections replaced after a failed check",
+                         callback=lambda: self.counters["health_check_failures"])
+
+    def stats(self):
+        """Pool size, occupancy, wait times and counters, for status endpoints."""
+        return {
+            "enabled": self.enabled,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "size": self._size,
+            "in_use": self._in_use,
+            "idle": len(self._idle),
+            "waiting": self._waiting,
+            "utilization": round(self._in_use / self.max_size, 3),
+            "prepared_statements": len(self.statements),
+            "last_error": self.last_error,
+            "wait_ms_histogram": self.wait_ms_histogram.snapshot(),
+            **self.counters,
+        }
+
+
+def create_detections_table(conn):
+    """Create the detections table and its indexes if missing; run by every app that writes to it."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS detections (
+                id SERIAL PRIMARY KEY,
+                class_name VARCHAR(100) NOT NULL,
+                confidence FLOAT NOT NULL,
+                source VARCHAR(20) DEFAULT 'upload',
+                user_mode VARCHAR(20) DEFAULT 'kid',
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                session_id VARCHAR(100),
+                bbox_x1 FLOAT,
+                bbox_y1 FLOAT,
+                bbox_x2 FLOAT,
+                bbox_y2 FLOAT
+            );
+        """)
+
+        # Create index for faster queries
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_detections_timestamp 
+            ON detections(timestamp);
+        """)
+
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_detections_class_name 
+            ON detections(class_name);
+        """)
+
+        # Idempotency keys of bulk-ingested rows; NULL keys never conflict
+        cur.execute("""
+            ALTER TABLE detections 
+            ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(100);
+        """)
+
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_detections_idempotency_key 
+            ON detections(idempotency_key);
+        """)
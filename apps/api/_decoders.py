@@ -0,0 +1,139 @@
+"""Decoders from raw detection-head outputs to scored candidate boxes, chosen per model."""
+import ast
+from collections import namedtuple
+
+import numpy as np
+
+# How to read a model's first output: ``decode`` turns one image's slice into
+# candidates, ``channels_last`` says the output is (batch, boxes, channels)
+# and gets a transposed view first, ``nms_in_graph`` says the model already
+# suppressed overlaps and only thresholding is left
+OutputHead = namedtuple("OutputHead", ["name", "decode", "channels_last", "nms_in_graph"])
+
+_EMPTY = (np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))
+
+
+def xywh2xyxy(xywh):
+    """Convert (n, 4) center/size boxes to corner coordinates."""
+    xyxy = np.empty_like(xywh)
+    half_wh = xywh[:, 2:4] / 2
+    xyxy[:, 0:2] = xywh[:, 0:2] - half_wh
+    xyxy[:, 2:4] = xywh[:, 0:2] + half_wh
+    return xyxy
+
+
+def decode_yolov8(image_pred, conf_thres, classes=None):
+    """
+    Anchor-free head, (4 + num_classes, num_boxes): xywh rows, then one score row per class.
+
+    There is no objectness row, so the per-box maximum over the class rows is
+    the confidence. Rows are reduced in place; only the boxes that pass the
+    threshold are gathered.
+    """
+    scores = image_pred[4:] if classes is None else image_pred[4 + classes]
+    conf = scores.max(axis=0)
+    mask = conf > conf_thres
+    if not mask.any():
+        return _EMPTY
+
+    class_pred = scores[:, mask].argmax(axis=0)
+    if classes is not None:
+        class_pred = classes[class_pred]
+    return xywh2xyxy(image_pred[:4, mask].T), conf[mask], class_pred
+
+
+def decode_yolov5(image_pred, conf_thres, classes=None):
+    """
+    Anchor-based head, (5 + num_classes, num_boxes): xywh rows, objectness, class scores.
+
+    Boxes are filtered by objectness before any class score is read;
+    confidence is objectness times the best class score.
+    """
+    candidates = image_pred[:, image_pred[4] > conf_thres]
+    if not candidates.shape[1]:
+        return _EMPTY
+
+    scores = candidates[5:] if classes is None else candidates[5 + classes]
+    class_conf = scores * candidates[4]
+    class_pred = class_conf.argmax(axis=0)
+    conf = class_conf[class_pred, np.arange(class_conf.shape[1])]
+    if classes is not None:
+        class_pred = classes[class_pred]
+
+    mask = conf > conf_thres
+    return xywh2xyxy(candidates[:4, mask].T), conf[mask], class_pred[mask]
+
+
+def decode_end2end(image_pred, conf_thres, classes=None):
+    """Model with NMS in the graph, (max_det, 6): x1, y1, x2, y2, score, class_id per row."""
+    class_pred = image_pred[:, 5].astype(np.int64)
+    mask = image_pred[:, 4] > conf_thres
+    if classes is not None:
+        mask &= np.isin(class_pred, classes)
+    return image_pred[mask, :4], image_pred[mask, 4], class_pred[mask]
+
+
+HEADS = {
+    "yolov8": OutputHead("yolov8", decode_yolov8, False, False),
+    "yolov5": OutputHead("yolov5", decode_yolov5, False, False),
+    "end2end": OutputHead("end2end", decode_end2end, False, True),
+}
+
+# Extra channels in front of the class scores, per head with a score row per class
+_BOX_CHANNELS = {"yolov8": 4, "yolov5": 5}
+
+
+def metadata_class_names(metadata):
+    """Class names from Ultralytics-style ``names`` metadata (a dict or list literal), or None."""
+    names = (metadata or {}).get("names")
+    if not names:
+        return None
+    try:
+        names = ast.literal_eval(names)
+    except (ValueError, SyntaxError, TypeError):
+        return None
+    if isinstance(names, dict):
+        try:
+            return [str(names[i]) for i in range(len(names))]
+        except KeyError:
+            return None
+    return [str(name) for name in names] if isinstance(names, (list, tuple)) else None
+
+
+def select_head(output_shape, metadata=None, num_classes=80, override="auto"):
+    """
+    Pick the decoder for a model from its first output's shape and metadata.
+
+    ``end2end`` metadata or a trailing dimension of 6 means NMS runs in the
+    graph. Otherwise the class count (from ``names`` metadata, else
+    ``num_classes``) tells a YOLOv8 head (4 + nc channels) from a YOLOv5 one
+    (5 + nc), and the axis the channels sit on gives the orientation.
+    ``override`` forces a head by name; the orientation is still read from
+    the shape.
+
+    Raises ValueError when the output does not fit, so a new model never
+    silently runs through the wrong decoder.
+    """
+    num_classes = len(metadata_class_names(metadata) or ()) or num_classes
+    dims = list(output_shape)[1:]
+    if override != "auto" and override not in HEADS:
+        raise ValueError(f"Unknown MODEL_HEAD '{override}'; expected auto or one of {sorted(HEADS)}")
+
+    end2end = str((metadata or {}).get("end2end", "")).lower() == "true"
+    if override == "end2end" or (override == "auto" and (end2end or (len(dims) == 2 and dims[-1] == 6))):
+        return HEADS["end2end"]
+
+    names = [override] if override != "auto" else list(_BOX_CHANNELS)
+    if len(dims) == 2:
+        for name in names:
+            channels = _BOX_CHANNELS[name] + num_classes
+            for channels_last in (False, True):
+                if dims[int(channels_last)] == channels:
+                    return HEADS[name]._replace(channels_last=channels_last)
+    if override != "auto":
+        return HEADS[override]
+
+    raise ValueError(
+        f"Cannot tell the output head of a model with output shape {list(output_shape)} and {num_classes} classes; "
+        f"set MODEL_HEAD to one of {sorted(HEADS)}"
+    )
@@ -0,0 +1,187 @@
+"""Write-behind logging of detections to the ``detections`` table."""
+import asyncio
+import collections
+import logging
+import time
+
+from psycopg2.extras import execute_values
+
+from _db import create_detections_table
+
+logger = logging.getLogger(__name__)
+
+INSERT_SQL = """
+    INSERT INTO detections
+    (class_name, confidence, source, user_mode, session_id, bbox_x1, bbox_y1, bbox_x2, bbox_y2)
+    VALUES %s
+"""
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest")
+
+
+class DetectionLog:
+    """
+    Bounded in-process buffer of detection rows, written to Postgres in the background.
+
+    ``record`` never blocks and never touches the database. Rows wait in a
+    queue of at most ``max_queue`` rows; when it is full, ``overflow`` drops
+    either the oldest queued rows or the incoming ones. A background task
+    writes up to ``batch_size`` rows per multi-row INSERT as soon as that
+    many are waiting, and whatever is queued every ``flush_interval_s``.
+    Each flush is one transaction on a connection checked out of ``db``, a
+    ``_db.Database`` pool, which replaces connections that broke. A failed
+    flush is retried ``max_retries`` times with exponential backoff before
+    its rows are dropped. ``close`` drains the queue. The first successful
+    flush also creates the table, so the API can run without the
+    leaderboard against an empty database.
+
+    With a disabled ``db`` (no DATABASE_URL) the log is disabled and
+    ``record`` is a no-op.
+    """
+
+    def __init__(self, db, max_queue=10000, batch_size=500, flush_interval_s=1.0,
+                 overflow="drop_oldest", max_retries=3, retry_backoff_s=0.5):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}")
+        self.db = db
+        self.max_queue = max(1, max_queue)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self.overflow = overflow
+        self.max_retries = max_retries
+        self.retry_backoff_s = retry_backoff_s
+
+        self._queue = collections.deque()
+        self._wakeup = None
+        self._task = None
+        self._closing = False
+        self._table_ready = False
+        self.counters = {
+            "recorded": 0,
+            "written": 0,
+            "flushes": 0,
+            "retries": 0,
+            "dropped_overflow": 0,
+            "dropped_failed": 0,
+        }
+        self.last_error = None
+        self.last_flush_ms = None
+
+    @property
+    def enabled(self):
+        return self.db.enabled
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    def start(self):
+        """Start the background flush task on the running event loop."""
+        if self.enabled and self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def record(self, rows):
+        """
+        Queue detection rows for writing; returns how many were accepted.
+
+        Each row is (class_name, confidence, source, user_mode, session_id,
+        x1, y1, x2, y2).
+        """
+        if self._task is None or self._closing:
+            return 0
+
+        rows = list(rows)
+        space = self.max_queue - len(self._queue)
+        if len(rows) > space:
+            if self.overflow == "drop_newest":
+                self.counters["dropped_overflow"] += len(rows) - space
+                rows = rows[:space]
+            else:
+                self.counters["dropped_overflow"] += len(rows) - space
+                rows = rows[-self.max_queue:]
+                for _ in range(len(rows) - space):
+                    self._queue.popleft()
+
+        self._queue.extend(rows)
+        self.counters["recorded"] += len(rows)
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+        return len(rows)
+
+    async def _run(self):
+        while True:
+            if not self._closing and len(self._queue) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_s)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+            if not self._queue:
+                if self._closing:
+                    return
+                continue
+
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            await self._flush_with_retry(batch)
+
+    async def _flush_with_retry(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                started = time.perf_counter()
+                async with self.db.connection() as conn:
+                    await conn.run(_insert, batch, not self._table_ready, transaction=True)
+                self._table_ready = True
+                self.last_flush_ms = round((time.perf_counter() - started) * 1000.0, 2)
+                self.counters["flushes"] += 1
+                self.counters["written"] += len(batch)
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                if attempt == self.max_retries:
+                    break
+                self.counters["retries"] += 1
+                logger.warning(f"Detection log flush failed (attempt {attempt + 1}): {str(e)}")
+                await asyncio.sleep(self.retry_backoff_s * 2 ** attempt)
+
+        self.counters["dropped_failed"] += len(batch)
+        logger.error(f"Dropped {len(batch)} detection log rows after {self.max_retries + 1} attempts: "
+                     f"{self.last_error}")
+
+    async def close(self, timeout=10.0):
+        """Stop accepting rows and write out what is queued within ``timeout``."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Detection log drain timed out; {len(self._queue)} rows not written")
+            self.counters["dropped_failed"] += len(self._queue)
+            self._queue.clear()
+        self._task = None
+
+    def stats(self):
+        """Queue occupancy, flush counters and the last error, for the status endpoint."""
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None,
+            "queued": len(self._queue),
+            "max_queue": self.max_queue,
+            "batch_size": self.batch_size,
+            "flush_interval_s": self.flush_interval_s,
+            "overflow": self.overflow,
+            "last_flush_ms": self.last_flush_ms,
+            "last_error": self.last_error,
+            **self.counters,
+        }
+
+
+def _insert(conn, batch, create_table):
+    """Insert ``batch`` with one multi-row INSERT; runs on a pool thread."""
+    if create_table:
+        create_detections_table(conn)
+    with conn.cursor() as cur:
+        execute_values(cur, INSERT_SQL, batch, page_size=len(batch))
@@ -0,0 +1,100 @@
+"""Response encodings for detection results: JSON and a packed columnar binary format."""
+import struct
+import zlib
+
+import numpy as np
+import orjson
+
+JSON_MEDIA_TYPE = "application/json"
+BINARY_MEDIA_TYPE = "application/x-detections"
+
+# Preferred first when the client accepts several equally
+MEDIA_TYPES = (JSON_MEDIA_TYPE, BINARY_MEDIA_TYPE)
+
+# Binary layout, little-endian:
+#   header   magic "DETS", uint16 version, uint16 flags, uint32 count,
+#            uint32 image width/height, uint32 input width/height (0 when
+#            unknown), uint32 class table id (see class_table_id)
+#   boxes    float32[count, 4]  x1, y1, x2, y2 in original image pixels
+#   scores   float32[count]
+#   classes  uint8[count]       index into the class table, 255 = unknown
+# Every array starts 4-byte aligned, so clients can map them without copying.
+BINARY_MAGIC = b"DETS"
+BINARY_VERSION = 1
+FLAG_CACHED = 1
+_HEADER = struct.Struct("<4sHHIIIIII")
+UNKNOWN_CLASS = 255
+
+
+def negotiate(accept):
+    """
+    Pick the response media type for an ``Accept`` header value.
+
+    The supported type with the highest q-value wins; JSON is returned when
+    the header is missing, only has wildcards or names nothing supported.
+    """
+    if not accept:
+        return JSON_MEDIA_TYPE
+
+    best, best_q = JSON_MEDIA_TYPE, 0.0
+    for entry in accept.split(","):
+        media_type, *params = [part.strip() for part in entry.split(";")]
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in MEDIA_TYPES and (q > best_q or (q == best_q and MEDIA_TYPES.index(media_type) <
+                                                          MEDIA_TYPES.index(best))):
+            best, best_q = media_type, q
+    return best
+
+
+def dumps_json(payload):
+    """Serialize ``payload`` to compact UTF-8 JSON bytes."""
+    return orjson.dumps(payload)
+
+
+def class_table_id(class_names):
+    """CRC-32 of the class table, sent in every binary response so clients can cache the table."""
+    return zlib.crc32("\n".join(class_names).encode())
+
+
+def pack_detections(results, image_size, input_size=None, cached=False, table_id=0):
+    """Encode result dicts (as returned by /api/infer) in the binary layout."""
+    count = len(results)
+    boxes = np.array([result["bbox"] for result in results], dtype="<f4").reshape(count, 4)
+    scores = np.array([result["confidence"] for result in results], dtype="<f4")
+    classes = np.array([result["class_id"] for result in results], dtype=np.int64)
+    classes = np.where((classes >= 0) & (classes < UNKNOWN_CLASS), classes, UNKNOWN_CLASS).astype(np.uint8)
+
+    input_width, input_height = input_size or (0, 0)
+    header = _HEADER.pack(BINARY_MAGIC, BINARY_VERSION, FLAG_CACHED if cached else 0, count,
+                          image_size[0], image_size[1], input_width, input_height, table_id)
+    return b"".join((header, boxes.tobytes(), scores.tobytes(), classes.tobytes()))
+
+
+def unpack_detections(data):
+    """Decode the binary layout into arrays; the inverse of ``pack_detections``."""
+    magic, version, flags, count, width, height, input_width, input_height, table_id = _HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("Not a version 1 detections payload")
+
+    offset = _HEADER.size
+    boxes = np.frombuffer(data, dtype="<f4", count=count * 4, offset=offset).reshape(count, 4)
+    offset += boxes.nbytes
+    scores = np.frombuffer(data, dtype="<f4", count=count, offset=offset)
+    offset += scores.nbytes
+    classes = np.frombuffer(data, dtype=np.uint8, count=count, offset=offset)
+    return {
+        "boxes": boxes,
+        "scores": scores,
+        "class_ids": classes,
+        "image_size": [width, height],
+        "input_size": [input_width, input_height] if input_width else None,
+        "cached": bool(flags & FLAG_CACHED),
+        "class_table_id": table_id,
+    }
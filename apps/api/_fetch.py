@@ -0,0 +1,183 @@
+"""Async, pooled and size-bounded image URL fetching."""
+import asyncio
+import collections
+import contextlib
+import logging
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Magic-byte prefixes of the image formats PIL can decode for us
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+)
+SNIFF_BYTES = 16
+
+
+class FetchError(Exception):
+    """Image download failure with the HTTP status the API should answer with."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def sniff_image_type(head):
+    """Return the image MIME type from the first bytes of a body, or None."""
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    return None
+
+
+class ImageFetcher:
+    """
+    Download images over a shared, pooled HTTP client.
+
+    Connections are reused across requests, at most ``max_per_host``
+    downloads run against one host at a time, and bodies are streamed so a
+    download is aborted as soon as it exceeds ``max_bytes`` or turns out not
+    to be an image. A host's limit is only tracked while downloads from it
+    are running, so hosts named in URLs never accumulate.
+    """
+
+    def __init__(self, max_bytes=20 * 1024 * 1024, timeout=10.0, max_connections=64,
+                 max_per_host=8, transport=None):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.transport = transport
+
+        self._client = None
+        self._host_slots = {}  # host -> [semaphore, downloads using it]
+
+    def _get_client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                follow_redirects=True,
+                transport=self.transport,
+            )
+        return self._client
+
+    @contextlib.asynccontextmanager
+    async def _host_slot(self, host):
+        entry = self._host_slots.get(host)
+        if entry is None:
+            entry = self._host_slots[host] = [asyncio.Semaphore(self.max_per_host), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._host_slots[host]
+
+    async def fetch(self, url):
+        """Download ``url`` and return the body bytes of a validated image."""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise FetchError(f"Unsupported image URL: {url}")
+
+        try:
+            async with self._host_slot(parts.hostname.lower()):
+                # Bound the whole download, not just each socket read, so a
+                # host that trickles bytes cannot hold the request forever
+                return await asyncio.wait_for(self._download(url), timeout=self.timeout)
+        except FetchError:
+            raise
+        except (httpx.TimeoutException, asyncio.TimeoutError):
+            raise FetchError(f"Timed out after {self.timeout}s downloading {url}", status_code=504)
+        except httpx.HTTPError as e:
+            raise FetchError(f"Failed to download image: {str(e)}", status_code=502)
+
+    async def _download(self, url):
+        async with self._get_client().stream("GET", url) as response:
+            if response.status_code >= 400:
+                raise FetchError(f"Image URL returned HTTP {response.status_code}", status_code=502)
+
+            # Reject on headers alone when the server is honest about them
+            content_length = response.headers.get("content-length")
+            if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+                raise FetchError(f"Image is larger than {self.max_bytes} bytes", status_code=413)
+
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            if content_type and not content_type.startswith("image/") and content_type != "application/octet-stream":
+                raise FetchError(f"URL does not point to an image (content-type {content_type})", status_code=415)
+
+            body = bytearray()
+            sniffed = False
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) > self.max_bytes:
+                    raise FetchError(f"Image is larger than {self.max_bytes} bytes", status_code=413)
+
+                # Check the magic bytes before downloading the rest
+                if not sniffed and len(body) >= SNIFF_BYTES:
+                    if sniff_image_type(bytes(body[:SNIFF_BYTES])) is None:
+                        raise FetchError("URL does not point to a supported image", status_code=415)
+                    sniffed = True
+
+            if not sniffed and sniff_image_type(bytes(body)) is None:
+                raise FetchError("URL does not point to a supported image", status_code=415)
+
+            return bytes(body)
+
+    async def fetch_many(self, urls, concurrency=8):
+        """
+        Download ``urls`` concurrently, yielding (url, body or FetchError) in order.
+
+        At most ``concurrency`` downloads run or wait to be consumed at a
+        time, so a long list never holds more than that many bodies.
+        Downloads still pending when the caller stops iterating are cancelled.
+        """
+        async def _fetch_or_error(url):
+            try:
+                return await self.fetch(url)
+            except FetchError as e:
+                return e
+
+        pending = collections.deque()
+        try:
+            for url in urls:
+                pending.append((url, asyncio.ensure_future(_fetch_or_error(url))))
+                if len(pending) >= max(1, concurrency):
+                    done_url, task = pending.popleft()
+                    yield done_url, await task
+            while pending:
+                done_url, task = pending.popleft()
+                yield done_url, await task
+        finally:
+            for _, task in pending:
+                task.cancel()
+            await asyncio.gather(*[task for _, task in pending], return_exceptions=True)
+
+    def stats(self):
+        """Fetcher limits for the status endpoint."""
+        return {
+            "max_bytes": self.max_bytes,
+            "timeout_s": self.timeout,
+            "max_connections": self.max_connections,
+            "max_per_host": self.max_per_host,
+            "active_hosts": len(self._host_slots),
+        }
+
+    async def aclose(self):
+        """Close pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
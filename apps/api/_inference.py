@@ -0,0 +1,190 @@
+"""
+ONNX Runtime session helpers shared by the API process and the inference workers.
+
+Nothing here reads the environment or keeps module state, so a worker process
+can import it without building the API app; callers pass in their settings.
+"""
+import logging
+
+import numpy as np
+import onnxruntime as ort
+
+from _decoders import select_head
+
+logger = logging.getLogger(__name__)
+
+# Per-class NMS offset; larger than any box coordinate in model input space
+MAX_WH = 7680
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def session_options(intra_op_threads=0, inter_op_threads=0, graph_optimization="all", execution_mode="sequential",
+                    enable_mem_arena=True):
+    """Build ONNX Runtime SessionOptions (0 threads lets ONNX Runtime choose)."""
+    if graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown ORT_GRAPH_OPTIMIZATION '{graph_optimization}', "
+                         f"expected one of {', '.join(GRAPH_OPTIMIZATION_LEVELS)}")
+    if execution_mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown ORT_EXECUTION_MODE '{execution_mode}', "
+                         f"expected one of {', '.join(EXECUTION_MODES)}")
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[graph_optimization]
+    options.execution_mode = EXECUTION_MODES[execution_mode]
+    options.enable_cpu_mem_arena = enable_mem_arena
+    return options
+
+
+def model_metadata(session):
+    """Custom metadata of the model, empty for sessions without any."""
+    try:
+        return session.get_modelmeta().custom_metadata_map
+    except AttributeError:
+        return {}
+
+
+def output_head(session, num_classes, override="auto"):
+    """Decoder for ``session``'s first output; see _decoders.select_head."""
+    output = session.get_outputs()[0]
+    return select_head(output.shape, model_metadata(session), num_classes, override)
+
+
+def model_batch_size(session):
+    """Return the fixed batch size of the model input, or None if it is dynamic."""
+    batch_dim = session.get_inputs()[0].shape[0]
+    return batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else None
+
+
+def model_fixed_input_shape(session):
+    """Return the (height, width) a fixed-shape model requires, or None if dynamic."""
+    height, width = session.get_inputs()[0].shape[2:4]
+    if isinstance(height, int) and isinstance(width, int) and height > 0 and width > 0:
+        return height, width
+    return None
+
+
+def run_session_batch(session, batch):
+    """Run ``session`` on a stacked NCHW batch and return the first output, one row per image."""
+    input_name = session.get_inputs()[0].name
+    count = batch.shape[0]
+
+    # Models exported with a fixed batch dimension need exactly that many images
+    fixed_size = model_batch_size(session)
+    if fixed_size is not None and count < fixed_size:
+        padding = np.zeros((fixed_size - count,) + batch.shape[1:], dtype=batch.dtype)
+        batch = np.concatenate([batch, padding], axis=0)
+
+    return session.run(None, {input_name: batch})[0][:count]
+
+
+def warm_up(session, input_sizes, batch_sizes, runs, run_batch=None):
+    """
+    Run throwaway inferences at every input size so first requests skip first-run allocations.
+
+    Fixed-shape models are only warmed up at their own input shape.
+    ``run_batch(batch)`` runs one inference; ``run_session_batch`` on
+    ``session`` by default.
+    """
+    run_batch = run_batch or (lambda batch: run_session_batch(session, batch))
+    fixed_shape = model_fixed_input_shape(session)
+    if fixed_shape is not None:
+        shapes = [fixed_shape]
+        logger.info(f"Model has a fixed input shape {fixed_shape}; imgsz and rect requests will use it")
+    else:
+        shapes = [(size, size) for size in input_sizes]
+
+    for height, width in shapes:
+        for batch_size in batch_sizes:
+            dummy = np.full((batch_size, 3, height, width), 114 / 255.0, dtype=np.float32)
+            for _ in range(runs):
+                run_batch(dummy)
+        logger.info(f"Warm-up finished for input {width}x{height}, batch sizes {batch_sizes}")
+
+
+def nms_numpy(boxes, scores, iou_thres, max_det=300):
+    """Greedy IoU suppression over (n, 4) xyxy boxes; returns kept indices by score."""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    order = np.argsort(-scores, kind="stable")
+
+    keep = []
+    while order.size and len(keep) < max_det:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+
+        inter_w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+
+        order = rest[iou <= iou_thres]
+
+    return np.asarray(keep, dtype=np.int64)
+
+
+def non_max_suppression(prediction, head, conf_thres=0.25, iou_thres=0.45, max_det=300,
+                        max_nms=3000, agnostic=False, classes=None):
+    """
+    Decode and run Non-Maximum Suppression on a batch of raw model outputs.
+
+    Args:
+        prediction: Raw first output of the model, in the layout of ``head``
+        head: _decoders.OutputHead to decode with
+        conf_thres: Minimum confidence
+        iou_thres: IoU above which overlapping boxes are suppressed
+        max_det: Maximum detections kept per image
+        max_nms: Only the top-k candidates by confidence are passed to NMS
+        agnostic: Suppress across classes instead of per class
+        classes: Sorted class indices to keep, or None for every class
+
+    Returns:
+        List with one (n, 6) float32 array per image: x1, y1, x2, y2, conf, class_id
+    """
+    if head.channels_last:
+        prediction = prediction.transpose(0, 2, 1)  # (batch, channels, boxes), a view
+
+    detections = []
+    for image_pred in prediction:
+        if classes is not None and not len(classes):
+            detections.append(np.zeros((0, 6), dtype=np.float32))
+            continue
+
+        # Decoders only consider the allowed classes, so boxes of other
+        # classes never reach thresholding or NMS
+        boxes, conf, class_pred = head.decode(image_pred, conf_thres, classes)
+        if not len(conf):
+            detections.append(np.zeros((0, 6), dtype=np.float32))
+            continue
+
+        if head.nms_in_graph:
+            keep = np.argsort(-conf, kind="stable")[:max_det]
+        else:
+            # Top-k pre-filter keeps NMS bounded on crowded scenes
+            if len(conf) > max_nms:
+                top = np.argpartition(-conf, max_nms)[:max_nms]
+                boxes, class_pred, conf = boxes[top], class_pred[top], conf[top]
+
+            # Offset boxes by class so a single NMS pass never suppresses across classes
+            nms_boxes = boxes if agnostic else boxes + (class_pred * MAX_WH)[:, None].astype(boxes.dtype)
+            keep = nms_numpy(nms_boxes, conf, iou_thres, max_det)
+
+        detections.append(np.concatenate([
+            boxes[keep],
+            conf[keep, None],
+            class_pred[keep, None].astype(np.float32),
+        ], axis=1).astype(np.float32, copy=False))
+
+    return detections
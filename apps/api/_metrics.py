@@ -0,0 +1,285 @@
+"""Lightweight in-process metrics shared by the API modules."""
+import bisect
+import contextvars
+import threading
+import time
+
+# Stage timings of the HTTP request being handled; None outside of requests
+# or when metrics are disabled, which turns ``stage`` into a no-op
+CURRENT_TIMINGS = contextvars.ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """Fixed-bucket histogram with cumulative (Prometheus-style) buckets."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record a single observation."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """Return cumulative bucket counts, total count and sum."""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative.append({"le": "+Inf" if bound == float("inf") else bound, "count": running})
+
+        return {
+            "buckets": cumulative,
+            "count": count,
+            "sum": total,
+            "mean": total / count if count else 0.0,
+        }
+
+    def _samples(self, name, labels):
+        snapshot = self.snapshot()
+        for bucket in snapshot["buckets"]:
+            yield f"{name}_bucket", {**labels, "le": bucket["le"]}, bucket["count"]
+        yield f"{name}_sum", labels, snapshot["sum"]
+        yield f"{name}_count", labels, snapshot["count"]
+
+
+class Counter:
+    """Monotonically increasing value, or one read from ``callback`` at scrape time."""
+
+    def __init__(self, callback=None):
+        self.value = 0
+        self.callback = callback
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def _samples(self, name, labels):
+        yield name, labels, self.callback() if self.callback is not None else self.value
+
+
+class Gauge:
+    """Value that goes up and down, or is read from ``callback`` at scrape time."""
+
+    def __init__(self, callback=None):
+        self.value = 0
+        self.callback = callback
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def _samples(self, name, labels):
+        yield name, labels, self.callback() if self.callback is not None else self.value
+
+
+class _Family:
+    """One metric per combination of label values."""
+
+    def __init__(self, factory, labelnames):
+        self.factory = factory
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self.factory())
+        return child
+
+    def _samples(self, name, labels):
+        for values, child in list(self._children.items()):
+            yield from child._samples(name, {**labels, **dict(zip(self.labelnames, values))})
+
+
+class Registry:
+    """
+    Named metrics rendered in the Prometheus text exposition format.
+
+    Metrics may also be registered as a zero-argument callable returning the
+    metric (or None while it does not exist yet), for objects such as the
+    micro-batcher that are created lazily.
+    """
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._metrics = {}  # name -> (type, help, metric or callable)
+
+    def register(self, name, kind, help_text, metric):
+        self._metrics[self.prefix + name] = (kind, help_text, metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=(), callback=None):
+        metric = _Family(Counter, labelnames) if labelnames else Counter(callback)
+        return self.register(name, "counter", help_text, metric)
+
+    def gauge(self, name, help_text, callback=None):
+        return self.register(name, "gauge", help_text, Gauge(callback))
+
+    def histogram(self, name, help_text, buckets, labelnames=()):
+        metric = _Family(lambda: Histogram(buckets), labelnames) if labelnames else Histogram(buckets)
+        return self.register(name, "histogram", help_text, metric)
+
+    def render(self):
+        """Return every metric in Prometheus text format (version 0.0.4)."""
+        lines = []
+        for name, (kind, help_text, metric) in self._metrics.items():
+            if not hasattr(metric, "_samples"):
+                metric = metric()
+                if metric is None:
+                    continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in metric._samples(name, {}):
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _StageTimer:
+    __slots__ = ("timings", "name", "started")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class RequestTimings:
+    """
+    Per-request stage durations.
+
+    Each finished stage is observed in ``histogram`` (a family labelled by
+    stage) and summed per stage for the ``Server-Timing`` response header.
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def stage(self, name):
+        return _StageTimer(self, name)
+
+    def record(self, name, seconds):
+        self.histogram.labels(name).observe(seconds)
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        """Server-Timing header value, in milliseconds, ending with the total."""
+        entries = [f"{name};dur={seconds * 1000.0:.2f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000.0:.2f}")
+        return ", ".join(entries)
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def stage(name):
+    """Time a ``with`` block as stage ``name`` of the current request, if any."""
+    timings = CURRENT_TIMINGS.get()
+    if timings is None:
+        return _NOOP_TIMER
+    return timings.stage(name)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that times HTTP requests.
+
+    It installs a ``RequestTimings`` for ``stage`` to record into, tracks
+    in-flight requests and adds a ``Server-Timing`` header to every response.
+    """
+
+    def __init__(self, app, stage_histogram, request_histogram, requests_total, in_flight,
+                 in_flight_histogram):
+        self.app = app
+        self.stage_histogram = stage_histogram
+        self.request_histogram = request_histogram
+        self.requests_total = requests_total
+        self.in_flight = in_flight
+        self.in_flight_histogram = in_flight_histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(self.stage_histogram)
+        token = CURRENT_TIMINGS.set(timings)
+        self.in_flight.inc()
+        self.in_flight_histogram.observe(self.in_flight.value)
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            self.in_flight.dec()
+            CURRENT_TIMINGS.reset(token)
+            # Label by route template rather than raw path to bound cardinality
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            self.request_histogram.labels(path, scope["method"]).observe(time.perf_counter() - timings.started)
+            self.requests_total.labels(path, scope["method"], str(status[0])).inc()
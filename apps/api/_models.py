@@ -0,0 +1,259 @@
+"""Registry of served models: lazy loading under a memory budget, LRU eviction and hot swap."""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def resident_set_bytes():
+    """Resident set size of this process, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ModelLease:
+    """
+    One request's use of a model version, from ``ModelRegistry.acquire`` until ``release``.
+
+    The lease holds the model object it was given, so a hot swap or an
+    eviction never pulls the session out from under a running request; the
+    old version is freed once its last lease is released.
+    """
+
+    def __init__(self, registry, entry, model, version):
+        self.model_id = entry.model_id
+        self.model = model
+        self.version = version
+        self._registry = registry
+        self._entry = entry
+        self.released = False
+
+    def release(self):
+        """Give the lease back; safe to call more than once."""
+        self._registry._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class _Entry:
+    """Registry state of one model id."""
+
+    def __init__(self, model_id, source, pinned=False):
+        self.model_id = model_id
+        self.source = source
+        self.pinned = pinned
+        self.model = None
+        self.version = 0
+        self.resident_bytes = 0
+        self.load_seconds = None
+        self.last_used = None
+        self.in_flight = 0
+        self.requests = 0
+        self.loads = 0
+        self.evictions = 0
+        self.swaps = 0
+        self.error = None
+        self.load_lock = threading.Lock()  # one load or swap of this model at a time
+
+
+class ModelRegistry:
+    """
+    Served models keyed by model id.
+
+    ``loader(source)`` builds a model object from a registered source; it
+    blocks, so callers acquire from an executor thread. Models load on
+    first use, one load at a time, and their resident size is the process
+    RSS growth during the load (at least the model file size). Whenever the
+    loaded models exceed ``memory_budget_bytes`` (0 = no limit), the least
+    recently used ones without requests in flight are evicted, right after
+    a load or as soon as a request releases them. Pinned models are loaded
+    by their owner and never evicted.
+
+    ``swap`` loads a new version next to the current one and replaces it in
+    a single step: new requests get the new version while requests already
+    holding a lease finish on the old one.
+    """
+
+    def __init__(self, loader, memory_budget_bytes=0):
+        self.loader = loader
+        self.memory_budget_bytes = max(0, int(memory_budget_bytes))
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def __contains__(self, model_id):
+        return model_id in self._entries
+
+    @property
+    def ids(self):
+        return list(self._entries)
+
+    @property
+    def resident_bytes(self):
+        return sum(entry.resident_bytes for entry in self._entries.values() if entry.model is not None)
+
+    @property
+    def evictions(self):
+        return sum(entry.evictions for entry in self._entries.values())
+
+    def register(self, model_id, source):
+        """Add ``model_id`` or change its source; a loaded version stays in use until swapped or evicted."""
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is None:
+                self._entries[model_id] = _Entry(model_id, source)
+            else:
+                entry.source = source
+
+    def pin(self, model_id, model, source=None, load_seconds=None, resident_bytes=0):
+        """Install a model loaded by the caller as the current, never evicted version of ``model_id``."""
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is None:
+                entry = self._entries[model_id] = _Entry(model_id, source, pinned=True)
+            entry.pinned = True
+            if source is not None:
+                entry.source = source
+            if entry.model is not None:
+                entry.swaps += 1
+            self._install(entry, model, load_seconds, resident_bytes)
+            return entry.version
+
+    def acquire(self, model_id):
+        """
+        Lease the current version of ``model_id``, loading it first if needed.
+
+        Raises KeyError for an unregistered id and whatever the loader raises
+        when the model cannot be loaded.
+        """
+        entry = self._entries[model_id]
+        with self._lock:
+            if entry.model is not None:
+                return self._lease(entry)
+
+        with entry.load_lock:
+            with self._lock:
+                if entry.model is not None:
+                    return self._lease(entry)
+            model, load_seconds, resident_bytes = self._build(entry)
+            with self._lock:
+                self._install(entry, model, load_seconds, resident_bytes)
+                lease = self._lease(entry)
+                self._evict_over_budget()
+            logger.info(f"Loaded model {model_id} v{entry.version} in {load_seconds}s "
+                        f"({resident_bytes / 1e6:.1f} MB resident)")
+            return lease
+
+    def swap(self, model_id, source=None):
+        """
+        Load a new version of ``model_id`` (from ``source`` if given) and make it current.
+
+        A model that is not loaded only gets its new source and loads on
+        next use. Returns the version now current, or None when not loaded.
+        """
+        entry = self._entries[model_id]
+        with entry.load_lock:
+            if source is not None:
+                entry.source = source
+            if entry.model is None:
+                return None
+            model, load_seconds, resident_bytes = self._build(entry)
+            with self._lock:
+                entry.swaps += 1
+                self._install(entry, model, load_seconds, resident_bytes)
+                self._evict_over_budget(keep=entry)
+            logger.info(f"Swapped model {model_id} to v{entry.version} in {load_seconds}s")
+            return entry.version
+
+    def _build(self, entry):
+        with self._build_lock:
+            before = resident_set_bytes()
+            started = time.perf_counter()
+            try:
+                model = self.loader(entry.source)
+            except Exception as e:
+                entry.error = str(e)
+                raise
+            load_seconds = round(time.perf_counter() - started, 3)
+            after = resident_set_bytes()
+
+        resident_bytes = after - before if before is not None and after is not None else 0
+        path = (entry.source or {}).get("path")
+        if path and os.path.exists(path):
+            resident_bytes = max(resident_bytes, os.path.getsize(path))
+        return model, load_seconds, resident_bytes
+
+    def _install(self, entry, model, load_seconds, resident_bytes):
+        entry.model = model
+        entry.version += 1
+        entry.loads += 1
+        entry.load_seconds = load_seconds
+        entry.resident_bytes = resident_bytes
+        entry.error = None
+
+    def _lease(self, entry):
+        entry.in_flight += 1
+        entry.requests += 1
+        entry.last_used = time.monotonic()
+        return ModelLease(self, entry, entry.model, entry.version)
+
+    def _release(self, lease):
+        with self._lock:
+            if not lease.released:
+                lease.released = True
+                lease._entry.in_flight -= 1
+                # Models that were busy during the last load may be evictable now
+                self._evict_over_budget()
+
+    def _evict_over_budget(self, keep=None):
+        """Drop least recently used idle models until the budget fits; call with the lock held."""
+        if not self.memory_budget_bytes:
+            return
+        while self.resident_bytes > self.memory_budget_bytes:
+            idle = [entry for entry in self._entries.values()
+                    if entry.model is not None and not entry.pinned and not entry.in_flight and entry is not keep]
+            if not idle:
+                logger.warning(f"Loaded models use {self.resident_bytes / 1e6:.1f} MB, over the "
+                               f"{self.memory_budget_bytes / 1e6:.1f} MB budget, and none can be evicted")
+                return
+            victim = min(idle, key=lambda entry: entry.last_used or 0.0)
+            victim.model = None
+            victim.evictions += 1
+            logger.info(f"Evicted model {victim.model_id} ({victim.resident_bytes / 1e6:.1f} MB)")
+
+    def stats(self):
+        """Budget, occupancy and per-model load and request counters."""
+        now = time.monotonic()
+        with self._lock:
+            models = [
+                {
+                    "id": entry.model_id,
+                    "loaded": entry.model is not None,
+                    "pinned": entry.pinned,
+                    "version": entry.version,
+                    "load_seconds": entry.load_seconds,
+                    "resident_bytes": entry.resident_bytes if entry.model is not None else 0,
+                    "requests": entry.requests,
+                    "in_flight": entry.in_flight,
+                    "loads": entry.loads,
+                    "evictions": entry.evictions,
+                    "swaps": entry.swaps,
+                    "idle_seconds": round(now - entry.last_used, 3) if entry.last_used is not None else None,
+                    "error": entry.error,
+                }
+                for entry in self._entries.values()
+            ]
+            return {
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "resident_bytes": self.resident_bytes,
+                "models": models,
+            }
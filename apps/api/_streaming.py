@@ -0,0 +1,96 @@
+"""Per-connection state for streaming (webcam) inference."""
+import asyncio
+import itertools
+import time
+from collections import deque
+
+FPS_WINDOW_SECONDS = 5.0
+
+
+class StreamSession:
+    """
+    Latest-frame-wins mailbox between a WebSocket receiver and its processor.
+
+    The receiver ``offer``s every frame it reads; the processor awaits
+    ``next_frame``. Only one frame is ever pending: a frame arriving while the
+    previous one is still waiting replaces it and counts as dropped, so a
+    client sending faster than the model can keep up sees fresh results
+    instead of an ever-growing backlog.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, imgsz, rect=False, client=None):
+        self.id = next(self._ids)
+        self.imgsz = imgsz
+        self.rect = rect
+        self.client = client
+        self.tracker = None  # TemporalTracker when temporal reuse is on
+        self.started_at = time.time()
+
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_latency_ms = None
+
+        self._pending = None  # (frame index, bytes, received at)
+        self._available = asyncio.Event()
+        self._closed = False
+        self._completed = deque()  # completion times inside the FPS window
+
+    def offer(self, frame):
+        """Make ``frame`` the next one to process, dropping any older pending frame."""
+        self.received += 1
+        if self._pending is not None:
+            self.dropped += 1
+        self._pending = (self.received, frame, time.perf_counter())
+        self._available.set()
+
+    def close(self):
+        """Wake the processor so it can exit once the client disconnects."""
+        self._closed = True
+        self._available.set()
+
+    async def next_frame(self):
+        """Wait for the newest pending frame; None once the session is closed."""
+        while self._pending is None:
+            if self._closed:
+                return None
+            self._available.clear()
+            await self._available.wait()
+        pending, self._pending = self._pending, None
+        return pending
+
+    def frame_done(self, received_at, ok=True):
+        """Record a finished frame for the FPS and latency counters."""
+        now = time.perf_counter()
+        self.last_latency_ms = (now - received_at) * 1000.0
+        if not ok:
+            self.errors += 1
+            return
+        self.processed += 1
+        self._completed.append(now)
+        while self._completed and now - self._completed[0] > FPS_WINDOW_SECONDS:
+            self._completed.popleft()
+
+    def stats(self):
+        """Frame counters and processing rates of this session."""
+        elapsed = time.time() - self.started_at
+        window = min(elapsed, FPS_WINDOW_SECONDS)
+        return {
+            "id": self.id,
+            "client": self.client,
+            "imgsz": self.imgsz,
+            "rect": self.rect,
+            "duration_s": round(elapsed, 3),
+            "frames_received": self.received,
+            "frames_processed": self.processed,
+            "frames_dropped": self.dropped,
+            "errors": self.errors,
+            "fps": round(len(self._completed) / window, 2) if window > 0 else 0.0,
+            "avg_fps": round(self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+            "drop_ratio": round(self.dropped / self.received, 4) if self.received else 0.0,
+            "last_latency_ms": round(self.last_latency_ms, 2) if self.last_latency_ms is not None else None,
+            "temporal": self.tracker.stats() if self.tracker is not None else None,
+        }
@@ -0,0 +1,185 @@
+"""Temporal reuse of detections across video frames."""
+import itertools
+import math
+
+import cv2
+import numpy as np
+
+
+def box_iou(a, b):
+    """Pairwise IoU between (n, 4) and (m, 4) xyxy boxes."""
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:4] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:4] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+class TemporalTracker:
+    """
+    Decide per frame whether a stream needs a full detection.
+
+    Frames are compared as small grayscale thumbnails. A frame is a keyframe,
+    and runs the model, when there is no previous detection, every
+    ``keyframe_interval`` frames, or when the scene changed. Otherwise the
+    frame either reuses the previous boxes unchanged, when its mean absolute
+    difference (0-1 scale) from the last frame is below ``static_threshold``,
+    or shifts them by the global camera motion found with phase correlation.
+    The scene counts as changed when that motion is ambiguous or the frames
+    still differ by more than ``scene_change_threshold`` once it is
+    compensated.
+
+    Detections of each keyframe are associated with the propagated boxes by
+    IoU, falling back to centroid distance, so objects keep their
+    ``track_id`` for as long as they stay in view.
+    """
+
+    def __init__(self, keyframe_interval=10, static_threshold=0.015, scene_change_threshold=0.05,
+                 min_shift_response=0.2, iou_threshold=0.3):
+        self.keyframe_interval = max(1, int(keyframe_interval))
+        self.static_threshold = static_threshold
+        self.scene_change_threshold = scene_change_threshold
+        self.min_shift_response = min_shift_response
+        self.iou_threshold = iou_threshold
+
+        self.tracks = []  # dicts with track_id, box (np.ndarray xyxy) and the result fields
+        self.counters = {"keyframes": 0, "tracked": 0, "reused": 0}
+
+        self._ids = itertools.count(1)
+        self._key_thumbnail = None
+        self._last_thumbnail = None
+        self._image_size = None
+        self._since_keyframe = 0
+        self._window = None
+
+    def step(self, thumbnail, image_size):
+        """
+        Advance to the next frame.
+
+        Returns ``("detect", None)`` when the caller must run the model and
+        pass its results to ``keyframe``, or ``("reuse" | "track", results)``
+        with the propagated results otherwise.
+        """
+        if (self._key_thumbnail is None or image_size != self._image_size
+                or thumbnail.shape != self._key_thumbnail.shape
+                or self._since_keyframe + 1 >= self.keyframe_interval):
+            return "detect", None
+
+        # Compare against the last frame that moved the boxes, so slow drift
+        # below the static threshold still accumulates into a shift
+        if _difference(thumbnail, self._last_thumbnail) <= self.static_threshold:
+            self._since_keyframe += 1
+            self.counters["reused"] += 1
+            return "reuse", self._results()
+
+        # Camera motion: a weak correlation peak, or a large difference left
+        # after compensating the shift, means the scene itself changed
+        # phaseCorrelate applies the window to its inputs in place, so pass copies
+        (dx, dy), response = cv2.phaseCorrelate(self._last_thumbnail.copy(), thumbnail.copy(),
+                                                self._get_window(thumbnail))
+        if response < self.min_shift_response:
+            return "detect", None
+        if _shifted_difference(self._last_thumbnail, thumbnail, dx, dy) > self.scene_change_threshold:
+            return "detect", None
+
+        scale_x = image_size[0] / thumbnail.shape[1]
+        scale_y = image_size[1] / thumbnail.shape[0]
+        self._shift(dx * scale_x, dy * scale_y)
+        self._last_thumbnail = thumbnail
+        self._since_keyframe += 1
+        self.counters["tracked"] += 1
+        return "track", self._results()
+
+    def keyframe(self, thumbnail, image_size, results):
+        """Replace the tracks with fresh ``results`` and return them with track ids."""
+        boxes = np.asarray([r["bbox"] for r in results], dtype=np.float32).reshape(-1, 4)
+        track_ids = self._associate(boxes, [r["class_id"] for r in results])
+
+        self.tracks = [{**result, "track_id": track_id, "box": box}
+                       for result, track_id, box in zip(results, track_ids, boxes)]
+        self._key_thumbnail = self._last_thumbnail = thumbnail
+        self._image_size = image_size
+        self._since_keyframe = 0
+        self.counters["keyframes"] += 1
+        return self._results()
+
+    def _associate(self, boxes, class_ids):
+        """Match new boxes to current tracks: IoU first, then nearest centroid."""
+        track_ids = [None] * len(boxes)
+        if not self.tracks or not len(boxes):
+            return [next(self._ids) for _ in track_ids]
+
+        previous = np.stack([track["box"] for track in self.tracks])
+        same_class = np.asarray(class_ids)[:, None] == np.asarray([t["class_id"] for t in self.tracks])[None, :]
+        ious = np.where(same_class, box_iou(boxes, previous), 0.0)
+
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        previous_centers = (previous[:, :2] + previous[:, 2:]) / 2
+        distance = np.linalg.norm(centers[:, None, :] - previous_centers[None, :, :], axis=2)
+        # A centroid match must stay within half the size of the tracked box
+        gate = np.max(previous[:, 2:] - previous[:, :2], axis=1)[None, :] / 2
+        distance = np.where(same_class & (distance <= gate), distance, np.inf)
+
+        used = np.zeros(len(previous), dtype=bool)
+        for i in np.argsort(-ious.max(axis=1)):
+            row = np.where(used, 0.0, ious[i])
+            j = int(np.argmax(row))
+            if row[j] >= self.iou_threshold:
+                used[j] = True
+                track_ids[i] = self.tracks[j]["track_id"]
+        for i in np.where([track_id is None for track_id in track_ids])[0]:
+            row = np.where(used, np.inf, distance[i])
+            j = int(np.argmin(row))
+            if np.isfinite(row[j]):
+                used[j] = True
+                track_ids[i] = self.tracks[j]["track_id"]
+
+        return [track_id if track_id is not None else next(self._ids) for track_id in track_ids]
+
+    def _shift(self, dx, dy):
+        """Move every track by (dx, dy) pixels, dropping boxes that left the image."""
+        width, height = self._image_size
+        kept = []
+        for track in self.tracks:
+            box = track["box"] + np.float32([dx, dy, dx, dy])
+            clipped = np.clip(box, 0, [width, height, width, height])
+            area = np.prod(box[2:] - box[:2])
+            if area > 0 and np.prod(clipped[2:] - clipped[:2]) >= 0.5 * area:
+                kept.append({**track, "box": clipped})
+        self.tracks = kept
+
+    def _results(self):
+        return [{key: value for key, value in track.items() if key != "box"} | {"bbox": track["box"].tolist()}
+                for track in self.tracks]
+
+    def _get_window(self, thumbnail):
+        if self._window is None or self._window.shape != thumbnail.shape:
+            self._window = cv2.createHanningWindow(thumbnail.shape[::-1], cv2.CV_32F)
+        return self._window
+
+    def stats(self):
+        """Keyframe, tracked and reused frame counts."""
+        frames = sum(self.counters.values())
+        return {
+            "keyframe_interval": self.keyframe_interval,
+            "active_tracks": len(self.tracks),
+            **self.counters,
+            "inference_ratio": round(self.counters["keyframes"] / frames, 4) if frames else 0.0,
+        }
+
+
+def _difference(a, b):
+    """Mean absolute difference of two 0-255 thumbnails, on a 0-1 scale."""
+    return float(cv2.absdiff(a, b).mean()) / 255.0
+
+
+def _shifted_difference(previous, current, dx, dy):
+    """``_difference`` after moving ``previous`` by (dx, dy), over the overlap only."""
+    height, width = current.shape
+    moved = cv2.warpAffine(previous, np.float32([[1, 0, dx], [0, 1, dy]]), (width, height))
+    x0, y0 = math.ceil(max(dx, 0)), math.ceil(max(dy, 0))
+    x1, y1 = width + math.floor(min(dx, 0)), height + math.floor(min(dy, 0))
+    if x1 - x0 < width // 2 or y1 - y0 < height // 2:
+        return 1.0
+    return _difference(moved[y0:y1, x0:x1], current[y0:y1, x0:x1])
@@ -0,0 +1,512 @@
+"""Multi-process inference workers fed through shared memory."""
+import asyncio
+import collections
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FLOAT32_BYTES = 4
+
+
+def process_memory(pid, mapped_path=None):
+    """
+    Resident and private bytes of process ``pid``, and of its mappings of ``mapped_path``.
+
+    Read from /proc/<pid>/smaps; empty where that is not available. Pages of
+    a file shared with other processes count as resident but not private.
+    """
+    if pid is None:
+        return {}
+    mapped_path = os.path.realpath(mapped_path) if mapped_path else None
+    totals = {"rss_bytes": 0, "private_bytes": 0, "weights_rss_bytes": 0, "weights_private_bytes": 0}
+    in_weights = False
+    try:
+        with open(f"/proc/{pid}/smaps") as f:
+            for line in f:
+                parts = line.split()
+                if not parts[0].endswith(":"):
+                    # Mapping header: address range, permissions, offset, device, inode and path
+                    in_weights = mapped_path is not None and parts[-1] == mapped_path
+                    continue
+                if parts[0] == "Rss:":
+                    key = "rss_bytes"
+                elif parts[0] in ("Private_Clean:", "Private_Dirty:"):
+                    key = "private_bytes"
+                else:
+                    continue
+                size = int(parts[1]) * 1024
+                totals[key] += size
+                if in_weights:
+                    totals[f"weights_{key}"] += size
+    except (OSError, ValueError, IndexError):
+        return {}
+    return totals
+
+
+class WorkerError(Exception):
+    """A worker process failed or is no longer running."""
+
+
+class _Slot:
+    """One shared-memory input tensor owned by a worker."""
+
+    def __init__(self, worker, index, shm):
+        self.worker = worker
+        self.index = index
+        self.shm = shm
+
+    def tensor(self, shape):
+        """(1, 3, height, width) float32 view of the slot for an input of ``shape``."""
+        return np.ndarray((1, 3) + tuple(shape), dtype=np.float32, buffer=self.shm.buf)
+
+
+class _Lease:
+    """
+    One use of a slot, from ``WorkerPool.acquire`` until it is submitted or released.
+
+    Leases are never reused, so releasing one after its result arrived
+    cannot free the slot out from under its next holder.
+    """
+
+    def __init__(self, slot):
+        self.slot = slot
+        self.worker = slot.worker
+        self.done = False
+
+    def tensor(self, shape):
+        return self.slot.tensor(shape)
+
+
+class _Worker:
+    """Front-process handle of one worker: its pipe, slots and pending requests."""
+
+    def __init__(self, index, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.slots = []
+        self.free = []
+        self.pending = {}  # request id -> (future, slot)
+        self.in_flight = 0
+        self.alive = True
+        self.info = {}
+        self.requests = 0
+        self.errors = 0
+        self.reader = None
+
+
+def _worker_main(index, model_path, settings, max_batch_size, conn):
+    """
+    Worker process: open a session on the shared model file, then serve slot requests.
+
+    Only the side-effect-free ``_inference`` helpers are imported here, never
+    the API module; ``settings`` carries what the worker needs of its config.
+    """
+    import onnxruntime as ort
+
+    from _inference import model_batch_size, non_max_suppression, output_head, run_session_batch, \
+        session_options, warm_up
+
+    started = time.perf_counter()
+
+    # The shared graph is already optimized by the front process. Its weights
+    # stay in the memory-mapped external data file only if ONNX Runtime does
+    # not prepack them into buffers of its own, which every worker would then
+    # hold a private copy of
+    options = session_options(**settings["session"])
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+    options.add_session_config_entry("session.disable_prepacking", "1")
+    session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+    head = output_head(session, settings["num_classes"], settings["head"])  # fails start-up for an unknown output
+    fixed_batch = model_batch_size(session)
+    warm_up(session, settings["input_sizes"], sorted({1, min(max_batch_size, fixed_batch or max_batch_size)}),
+            settings["warmup_runs"])
+
+    session_input = session.get_inputs()[0]
+    conn.send(("ready", {
+        "pid": os.getpid(),
+        "input_name": session_input.name,
+        "input_shape": list(session_input.shape),
+        "output_head": head.name,
+        "load_seconds": round(time.perf_counter() - started, 3),
+    }))
+
+    _, slot_names = conn.recv()
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+
+            # Take everything already queued so concurrent requests share a run
+            requests = [message]
+            while len(requests) < len(slots) and conn.poll():
+                message = conn.recv()
+                if message is None:
+                    return
+                requests.append(message)
+
+            groups = {}
+            for request in requests:
+                groups.setdefault(tuple(request[2]), []).append(request)
+            for shape, group in groups.items():
+                for start in range(0, len(group), fixed_batch or len(group)):
+                    chunk = group[start:start + (fixed_batch or len(group))]
+                    try:
+                        batch = np.concatenate([
+                            np.ndarray((1, 3) + shape, dtype=np.float32, buffer=slots[slot].buf)
+                            for _, slot, _, _ in chunk
+                        ], axis=0)
+                        outputs = run_session_batch(session, batch)
+                        # Requests may restrict different classes, so NMS runs per image
+                        for i, (request_id, _, _, classes) in enumerate(chunk):
+                            dets = non_max_suppression(
+                                outputs[i:i + 1], head, conf_thres=settings["conf_thres"],
+                                iou_thres=settings["iou_thres"], classes=classes)[0]
+                            conn.send((request_id, dets))
+                    except Exception as e:
+                        for request_id, _, _, _ in chunk:
+                            conn.send((request_id, WorkerError(f"Worker {index} inference failed: {str(e)}")))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        for slot in slots:
+            slot.close()
+
+
+class WorkerPool:
+    """
+    Pool of inference worker processes behind the API process.
+
+    The front process resolves and graph-optimizes the model once, saving
+    its weights to an external data file next to the graph (see
+    ``infer._start_worker_pool``). Every worker opens its session on that
+    file with weight prepacking disabled, so ONNX Runtime computes straight
+    from the memory-mapped weights and they are resident once in the page
+    cache however many workers run; ``stats`` reports each worker's resident
+    and private memory and how much of the weights file it maps, to check
+    that this holds. ``settings`` holds the session options (as
+    ``_inference.session_options`` arguments, minus the thread count),
+    output head override, class count, warm-up input sizes and runs, and
+    NMS thresholds the workers use. Each worker owns
+    ``slots_per_worker`` shared-memory input tensors. The front letterboxes
+    an image straight into a free slot of the least-loaded worker and sends
+    only the slot index and shape over the worker's pipe; the worker runs
+    every request already waiting on it as one batch, applies NMS and sends
+    back the small (n, 6) detection array.
+
+    A worker that exits fails its pending requests and loses its slots;
+    the pool then starts a replacement on fresh slots in the background.
+    Requests wait for a slot on a live worker meanwhile, and get WorkerError
+    only when no worker is running or starting.
+
+    Workers are started with the ``spawn`` method, so no ONNX Runtime state
+    is ever inherited across ``fork``.
+    """
+
+    def __init__(self, processes, settings, slots_per_worker=2, intra_op_threads=None, start_timeout=300.0):
+        self.processes = max(1, int(processes))
+        self.settings = settings
+        self.slots_per_worker = max(1, int(slots_per_worker))
+        self.intra_op_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // self.processes)
+        self.start_timeout = start_timeout
+
+        self.workers = []
+        self.input_shape = None
+        self.slot_bytes = 0
+        self.restarts = 0
+        self.model_path = None
+        self._context = multiprocessing.get_context("spawn")
+        self._ids = itertools.count()
+        self._loop = None
+        self._waiters = collections.deque()
+        self._restarting = set()
+        self._closed = False
+
+    def start(self, model_path, max_input_shape):
+        """Start the workers on ``model_path`` and wait until all are warmed up (blocking)."""
+        self.model_path = model_path
+        try:
+            self.workers = [self._spawn(index) for index in range(self.processes)]
+            for worker in self.workers:
+                self._wait_ready(worker)
+        except BaseException:
+            self.close()
+            raise
+
+        self.input_shape = self.workers[0].info["input_shape"]
+        height, width = max_input_shape
+        if all(isinstance(d, int) and d > 0 for d in self.input_shape[2:4]):
+            height, width = self.input_shape[2:4]
+        self.slot_bytes = 3 * height * width * FLOAT32_BYTES
+
+        for worker in self.workers:
+            self._attach_slots(worker)
+            worker.free = list(worker.slots)
+
+        logger.info(f"Started {self.processes} inference workers with {self.slots_per_worker} slots each "
+                    f"({self.intra_op_threads} intra-op threads per worker)")
+
+    def _spawn(self, index):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.model_path,
+                  {**self.settings, "session": {**self.settings["session"], "intra_op_threads": self.intra_op_threads}},
+                  self.slots_per_worker, child_conn),
+            name=f"infer-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(index, process, parent_conn)
+
+    def _wait_ready(self, worker):
+        if not worker.conn.poll(self.start_timeout):
+            raise WorkerError(f"Worker {worker.index} did not start within {self.start_timeout}s")
+        try:
+            _, worker.info = worker.conn.recv()
+        except EOFError:
+            raise WorkerError(f"Worker {worker.index} exited during start-up "
+                              f"(exit code {worker.process.exitcode})")
+
+    def _attach_slots(self, worker):
+        """Give a started worker its own new input slots and start reading its results."""
+        for index in range(self.slots_per_worker):
+            shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+            worker.slots.append(_Slot(worker, index, shm))
+        worker.conn.send(("slots", [slot.shm.name for slot in worker.slots]))
+        worker.reader = threading.Thread(target=self._read_results, args=(worker,),
+                                         name=f"infer-worker-{worker.index}-reader", daemon=True)
+        worker.reader.start()
+
+    @property
+    def output_head(self):
+        """Name of the decoder the workers picked for the model output."""
+        return self.workers[0].info["output_head"] if self.workers else None
+
+    def get_inputs(self):
+        """Model input metadata, mirroring ``InferenceSession.get_inputs``."""
+        return [SimpleNamespace(name=self.workers[0].info["input_name"], shape=self.input_shape)]
+
+    async def acquire(self):
+        """Wait for a free slot on the least-loaded live worker and lease it."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # First use, or the event loop was replaced (e.g. between test clients)
+            self._loop = loop
+            self._waiters.clear()
+
+        requeue = False
+        while True:
+            candidates = [worker for worker in self.workers if worker.alive and worker.free]
+            if candidates:
+                break
+            if not self._restarting and not any(worker.alive for worker in self.workers):
+                raise WorkerError("No inference worker is available")
+            # A waiter that was woken but lost the slot keeps its place at the front
+            waiter = loop.create_future()
+            if requeue:
+                self._waiters.appendleft(waiter)
+            else:
+                self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    self._wake()  # pass on the slot this waiter was woken for
+                raise
+            requeue = True
+
+        worker = min(candidates, key=lambda w: w.in_flight)
+        worker.in_flight += 1
+        return _Lease(worker.free.pop())
+
+    def _wake(self, all_waiters=False):
+        """Let the oldest waiter (or every waiter) look for a free slot again."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                if not all_waiters:
+                    return
+
+    def release(self, lease):
+        """Give back a leased slot unless it was submitted; safe to call in ``finally``."""
+        if not lease.done:
+            lease.done = True
+            self._free(lease.slot)
+
+    def _free(self, slot):
+        worker = slot.worker
+        worker.in_flight -= 1
+        if worker.alive:
+            worker.free.append(slot)
+            self._wake()
+
+    async def run(self, lease, shape, classes=None):
+        """Run the tensor written to the leased slot and return its (n, 6) detections of ``classes``."""
+        worker = lease.worker
+        if not worker.alive:
+            raise WorkerError(f"Worker {worker.index} is not running")
+
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        worker.pending[request_id] = (future, lease.slot)
+        lease.done = True
+        worker.requests += 1
+        # The worker owns the slot from here on; it is freed when the
+        # result arrives, even if the caller has gone away by then
+        worker.conn.send((request_id, lease.slot.index, tuple(shape), classes))
+        return await future
+
+    def _read_results(self, worker):
+        """Reader thread: hand results from one worker's pipe to the event loop."""
+        while True:
+            try:
+                request_id, result = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            self._call_in_loop(self._complete, worker, request_id, result)
+        self._call_in_loop(self._worker_died, worker)
+
+    def _call_in_loop(self, callback, *args):
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except (AttributeError, RuntimeError):
+            # No request has run yet, or the loop is already closed at shutdown
+            pass
+
+    def _complete(self, worker, request_id, result):
+        future, slot = worker.pending.pop(request_id, (None, None))
+        if future is None:
+            return
+        self._free(slot)
+        if isinstance(result, Exception):
+            worker.errors += 1
+            if not future.done():
+                future.set_exception(result)
+        elif not future.done():
+            future.set_result(result)
+
+    def _worker_died(self, worker):
+        if not worker.alive or self._closed:
+            return
+        worker.alive = False
+        worker.free = []
+        for future, _ in worker.pending.values():
+            if not future.done():
+                future.set_exception(WorkerError(f"Worker {worker.index} exited"))
+        worker.pending.clear()
+
+        # Requests may still hold leases on the old slots, so the replacement
+        # gets new ones; these go once their last view is dropped
+        for slot in worker.slots:
+            _unlink(slot.shm)
+        worker.conn.close()
+        self._restarting.add(worker.index)
+        self._loop.run_in_executor(None, self._restart, worker)
+        # Waiters re-check; with no worker left or starting they fail
+        self._wake(all_waiters=True)
+
+    def _restart(self, dead):
+        """Start a replacement for the ``dead`` worker (blocking, off the event loop)."""
+        dead.process.join(self.start_timeout)
+        logger.error(f"Inference worker {dead.index} (pid {dead.info.get('pid')}) exited "
+                     f"with code {dead.process.exitcode}; restarting it")
+        index = dead.index
+        worker = None
+        try:
+            worker = self._spawn(index)
+            self._wait_ready(worker)
+            self._attach_slots(worker)
+        except Exception as e:
+            logger.error(f"Could not restart inference worker {index}: {str(e)}")
+            if worker is not None:
+                worker.process.kill()
+                for slot in worker.slots:
+                    slot.shm.close()
+                    _unlink(slot.shm)
+            worker = None
+        self._call_in_loop(self._replace, index, worker)
+
+    def _replace(self, index, worker):
+        self._restarting.discard(index)
+        if worker is not None:
+            if self._closed:
+                self._stop([worker])
+                return
+            worker.free = list(worker.slots)
+            self.workers[index] = worker
+            self.restarts += 1
+            logger.info(f"Restarted inference worker {index} (pid {worker.info.get('pid')})")
+        self._wake(all_waiters=True)
+
+    def stats(self):
+        """Per-worker load and counters for the status endpoint."""
+        return {
+            "processes": self.processes,
+            "slots_per_worker": self.slots_per_worker,
+            "slot_bytes": self.slot_bytes,
+            "intra_op_threads": self.intra_op_threads,
+            "restarts": self.restarts,
+            "restarting": sorted(self._restarting),
+            "workers": [
+                {
+                    "index": worker.index,
+                    "pid": worker.info.get("pid"),
+                    "alive": worker.alive,
+                    "in_flight": worker.in_flight,
+                    "requests": worker.requests,
+                    "errors": worker.errors,
+                    "load_seconds": worker.info.get("load_seconds"),
+                    **process_memory(worker.info.get("pid"), f"{self.model_path}.data"),
+                }
+                for worker in self.workers
+            ],
+        }
+
+    def close(self, timeout=5.0):
+        """Stop the workers and free shared memory."""
+        self._closed = True
+        self._stop(self.workers, timeout)
+
+    def _stop(self, workers, timeout=5.0):
+        for worker in workers:
+            worker.alive = False
+            try:
+                worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
+            for slot in worker.slots:
+                try:
+                    slot.shm.close()
+                except BufferError:
+                    pass  # a request still holds a view of it
+                _unlink(slot.shm)
+            worker.slots = worker.free = []
+
+
+def _unlink(shm):
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
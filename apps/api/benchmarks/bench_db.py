@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Leaderboard query latency: a new connection per request vs the shared pool.
+
+Runs the leaderboard query against DATABASE_URL at each --concurrency
+level, first the way the API used to (psycopg2.connect, query, close, on
+a thread per request), then through leaderboard.DB (pooled connections
+and a prepared statement). Reports throughput, p50/p95/p99 latency and,
+for the pool, the connections it opened and the time requests waited for
+one. --seed inserts that many synthetic detections first.
+
+Needs a reachable Postgres, e.g. a local one:
+    DATABASE_URL=postgresql://postgres@localhost/postgres python benchmarks/bench_db.py --seed 10000
+    DATABASE_URL=... DB_POOL_MAX_SIZE=4 python benchmarks/bench_db.py --concurrency 1 8 32 --output db.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import leaderboard  # noqa: E402
+
+CLASS_NAMES = ["teddy bear", "book", "cup", "apple", "car", "cat", "dog", "sports ball", "bottle", "chair"]
+
+
+def summarize(samples):
+    """Latency statistics in milliseconds for a list of seconds."""
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "runs": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def seed(dsn, rows):
+    rng = random.Random(0)
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        execute_values(cur, "INSERT INTO detections (class_name, confidence, source, user_mode) VALUES %s", [
+            (rng.choice(CLASS_NAMES), rng.random(), rng.choice(("upload", "webcam")), "kid") for _ in range(rows)
+        ], page_size=1000)
+
+
+def connect_and_query(dsn, sql, limit):
+    """One request the old way: a fresh connection for a single query."""
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, (limit,))
+            return cur.fetchall()
+    finally:
+        conn.close()
+
+
+async def run_level(query, concurrency, requests):
+    latencies = []
+    counter = itertools.count()
+
+    async def worker():
+        while next(counter) < requests:
+            start = time.perf_counter()
+            await query()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {"concurrency": concurrency, "requests": requests, "elapsed_s": elapsed,
+            "throughput_rps": requests / elapsed, "latency": summarize(latencies)}
+
+
+async def run(args):
+    db = leaderboard.DB
+    if not db.enabled:
+        raise SystemExit("Set DATABASE_URL to a Postgres to benchmark against")
+    if not await db.open():
+        raise SystemExit(f"Cannot connect to DATABASE_URL: {db.last_error}")
+    await leaderboard.init_database()
+    if args.seed:
+        await asyncio.to_thread(seed, db.dsn, args.seed)
+
+    statement = f"leaderboard_{args.period}"
+    sql = db.statements[statement].replace("$1", "%s")
+
+    async def per_request():
+        await asyncio.to_thread(connect_and_query, db.dsn, sql, args.limit)
+
+    async def pooled():
+        await db.fetch(statement, (args.limit,))
+
+    results = []
+    for concurrency in args.concurrency:
+        for mode, query in (("connect", per_request), ("pool", pooled)):
+            await run_level(query, concurrency, min(args.warmup, args.requests))
+            connects_before = db.counters["connects"]
+            level = {"mode": mode, **await run_level(query, concurrency, args.requests)}
+            if mode == "pool":
+                level["pool_connects"] = db.counters["connects"] - connects_before
+                level["pool"] = db.stats()
+            results.append(level)
+            latency = level["latency"]
+            print(f"{mode:>7} concurrency {concurrency:>3}: {level['throughput_rps']:8.1f} req/s  "
+                  f"p50 {latency['p50_ms']:7.2f} ms  p95 {latency['p95_ms']:7.2f} ms  p99 {latency['p99_ms']:7.2f} ms")
+    await db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-request connections with the connection pool")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32], help="Concurrent clients per level")
+    parser.add_argument("--requests", type=int, default=500, help="Queries per level and mode")
+    parser.add_argument("--warmup", type=int, default=20, help="Untimed queries before each level")
+    parser.add_argument("--period", choices=sorted(leaderboard.PERIOD_FILTERS), default="week", help="Leaderboard period")
+    parser.add_argument("--limit", type=int, default=10, help="Leaderboard rows per query")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic detections to insert first")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": "db",
+                "environment": {"python": platform.python_version(), "psycopg2": psycopg2.__version__,
+                                "cpu_count": os.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+                "config": {key: value for key, value in vars(args).items() if key != "output"},
+                "levels": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
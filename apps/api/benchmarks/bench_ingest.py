@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Detection ingest throughput: /api/log-detection per row vs /api/log-detections.
+
+Drives the leaderboard app in-process (httpx ASGI transport) against
+DATABASE_URL and reports rows/sec and request latency for the single-row
+endpoint and for the bulk endpoint at each --batch-size (sizes from
+INGEST_COPY_MIN_ROWS up go through COPY). Every bulk request carries an
+Idempotency-Key; the last one of each level is sent again to check that
+the retry inserts nothing.
+
+Needs a reachable Postgres, e.g. a local one:
+    DATABASE_URL=postgresql://postgres@localhost/postgres python benchmarks/bench_ingest.py
+    DATABASE_URL=... python benchmarks/bench_ingest.py --rows 20000 --batch-size 15 100 1000 --concurrency 4 --output ingest.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+import uuid
+
+import httpx
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import leaderboard  # noqa: E402
+from bench_db import CLASS_NAMES, summarize  # noqa: E402
+
+
+def synthetic_detections(count, seed=0):
+    rng = random.Random(seed)
+    detections = []
+    for _ in range(count):
+        x1, y1 = rng.uniform(0, 600), rng.uniform(0, 400)
+        detections.append({
+            "class_name": rng.choice(CLASS_NAMES),
+            "confidence": round(rng.uniform(0.25, 1.0), 4),
+            "bbox": [x1, y1, x1 + rng.uniform(10, 200), y1 + rng.uniform(10, 200)],
+        })
+    return detections
+
+
+async def run_level(client, requests, concurrency, send):
+    """Send every item of ``requests`` with ``send`` from ``concurrency`` concurrent clients."""
+    latencies = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while (i := next(counter)) < len(requests):
+            start = time.perf_counter()
+            response = await send(client, requests[i])
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - start, latencies, errors
+
+
+async def send_single(client, detection):
+    # The single-row endpoint takes its fields as query parameters; bbox is left out
+    return await client.post("/api/log-detection", params={
+        "class_name": detection["class_name"], "confidence": detection["confidence"],
+        "source": "upload", "user_mode": "kid", "session_id": "bench"})
+
+
+async def send_bulk(client, request):
+    key, batch = request
+    return await client.post("/api/log-detections", params={"session_id": "bench"}, json=batch,
+                             headers={"Idempotency-Key": key})
+
+
+async def run(args):
+    db = leaderboard.DB
+    if not db.enabled:
+        raise SystemExit("Set DATABASE_URL to a Postgres to benchmark against")
+    if not await db.open():
+        raise SystemExit(f"Cannot connect to DATABASE_URL: {db.last_error}")
+    await leaderboard.init_database()
+
+    detections = synthetic_detections(args.rows)
+    transport = httpx.ASGITransport(app=leaderboard.app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        single_rows = detections[:args.single_rows]
+        elapsed, latencies, errors = await run_level(client, single_rows, args.concurrency, send_single)
+        results.append({"endpoint": "log-detection", "batch_size": 1, "rows": len(single_rows), "errors": errors,
+                        "rows_per_s": len(single_rows) / elapsed, "latency": summarize(latencies)})
+
+        for batch_size in args.batch_size:
+            run_id = uuid.uuid4().hex[:12]
+            requests = [(f"{run_id}-{i}", detections[i:i + batch_size]) for i in range(0, len(detections), batch_size)]
+            elapsed, latencies, errors = await run_level(client, requests, args.concurrency, send_bulk)
+            retry = (await send_bulk(client, requests[-1])).json()
+            results.append({"endpoint": "log-detections", "batch_size": batch_size, "rows": len(detections),
+                            "errors": errors, "rows_per_s": len(detections) / elapsed, "latency": summarize(latencies),
+                            "copy": batch_size >= leaderboard.INGEST_COPY_MIN_ROWS,
+                            "retry_inserted": retry.get("inserted"), "retry_duplicates": retry.get("duplicates")})
+
+    for level in results:
+        latency = level["latency"]
+        print(f"{level['endpoint']:>15} batch {level['batch_size']:>5}: {level['rows_per_s']:9.1f} rows/s  "
+              f"p50 {latency['p50_ms']:7.2f} ms  p95 {latency['p95_ms']:7.2f} ms  errors {level['errors']}"
+              + (f"  retry inserted {level['retry_inserted']}" if "retry_inserted" in level else ""))
+    await db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single-row and bulk detection ingest throughput")
+    parser.add_argument("--rows", type=int, default=10000, help="Detections per bulk level")
+    parser.add_argument("--single-rows", type=int, default=1000, help="Detections sent one per request")
+    parser.add_argument("--batch-size", nargs="+", type=int, default=[15, 100, 1000], help="Detections per bulk request")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent clients")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": "ingest",
+                "environment": {"python": platform.python_version(), "psycopg2": psycopg2.__version__,
+                                "cpu_count": os.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+                "config": {key: value for key, value in vars(args).items() if key != "output"},
+                "levels": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+In-process load generator for /api/infer.
+
+Drives the FastAPI app through httpx's ASGI transport (no sockets, no
+network) at each --concurrency level and reports throughput, p50/p95/p99
+latency, the server's mean Server-Timing per stage and the batch sizes the
+micro-batcher formed. Client and server share one event loop, so absolute
+numbers include client overhead; compare runs made the same way.
+
+Without --model the ONNX session is replaced by a synthetic one that
+returns raw outputs from bench_stages.synthetic_prediction after sleeping
+--synthetic-ms per image, which isolates the API's own overhead and runs
+without downloading anything.
+
+Usage:
+    python benchmarks/bench_load.py --concurrency 1 4 16 --requests 200 --output load.json
+    python benchmarks/bench_load.py --model /tmp/yolov8n.onnx --concurrency 1 8
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import infer  # noqa: E402
+from _cache import DetectionCache  # noqa: E402
+from bench_preprocess import parse_size  # noqa: E402
+from bench_stages import environment, jpeg_bytes, summarize, synthetic_prediction  # noqa: E402
+
+
+class SyntheticSession:
+    """Stand-in for onnxruntime.InferenceSession with a dynamic NCHW input."""
+
+    def __init__(self, density=0.01, run_ms=5.0, num_classes=80):
+        self.density = density
+        self.run_ms = run_ms
+        self.num_classes = num_classes
+        self._outputs = {}
+
+    def get_inputs(self):
+        return [SimpleNamespace(name="images", shape=["batch", 3, "height", "width"], type="tensor(float)")]
+
+    def get_outputs(self):
+        return [SimpleNamespace(name="output0", shape=["batch", 4 + self.num_classes, "anchors"], type="tensor(float)")]
+
+    def get_providers(self):
+        return ["SyntheticSession"]
+
+    def run(self, output_names, feeds):
+        batch = next(iter(feeds.values()))
+        key = (batch.shape[0],) + batch.shape[2:]
+        output = self._outputs.get(key)
+        if output is None:
+            output = self._outputs[key] = synthetic_prediction(
+                batch.shape[0], batch.shape[2:], self.density, self.num_classes)
+        if self.run_ms:
+            time.sleep(self.run_ms * batch.shape[0] / 1000.0)
+        return [output]
+
+
+def parse_server_timing(header):
+    """Map stage name to milliseconds from a Server-Timing header value."""
+    stages = {}
+    for entry in header.split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if duration:
+            stages[name] = float(duration)
+    return stages
+
+
+async def run_level(client, images, concurrency, requests, imgsz):
+    """Send ``requests`` requests from ``concurrency`` concurrent clients."""
+    latencies = []
+    errors = 0
+    stage_totals = {}
+    counter = itertools.count()
+    batcher = infer._get_batcher()
+    batches_before, images_before = batcher.batches_run, batcher.images_run
+
+    async def worker():
+        nonlocal errors
+        while (i := next(counter)) < requests:
+            start = time.perf_counter()
+            response = await client.post(
+                "/api/infer",
+                files={"image": ("bench.jpg", images[i % len(images)], "image/jpeg")},
+                data={"imgsz": str(imgsz)},
+            )
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+            for name, ms in parse_server_timing(response.headers.get("server-timing", "")).items():
+                stage_totals[name] = stage_totals.get(name, 0.0) + ms
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    batches = batcher.batches_run - batches_before
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput_rps": requests / elapsed,
+        "latency": summarize(latencies),
+        "server_timing_mean_ms": {name: total / requests for name, total in stage_totals.items()},
+        "avg_batch_size": (batcher.images_run - images_before) / batches if batches else 0.0,
+    }
+
+
+async def run(args):
+    if args.model:
+        infer.MODEL_PATH = args.model
+    else:
+        infer.SESSION = SyntheticSession(args.density, args.synthetic_ms)
+    if not args.cache:
+        infer.RESULT_CACHE = DetectionCache(max_bytes=0)
+
+    sizes = [parse_size(size) for size in args.sizes]
+    images = [jpeg_bytes(*sizes[i % len(sizes)], seed=i) for i in range(args.images)]
+
+    await infer._ensure_ready()
+    transport = httpx.ASGITransport(app=infer.app)
+    levels = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for concurrency in args.concurrency:
+            await run_level(client, images, concurrency, min(args.warmup, args.requests), args.imgsz)
+            level = await run_level(client, images, concurrency, args.requests, args.imgsz)
+            levels.append(level)
+            latency = level["latency"]
+            print(f"concurrency {concurrency:>3}: {level['throughput_rps']:7.1f} req/s  "
+                  f"p50 {latency['p50_ms']:7.2f} ms  p95 {latency['p95_ms']:7.2f} ms  "
+                  f"p99 {latency['p99_ms']:7.2f} ms  batch {level['avg_batch_size']:.2f}  errors {level['errors']}")
+    await infer.FETCHER.aclose()
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /api/infer in-process")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16], help="Concurrent clients per level")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per level")
+    parser.add_argument("--warmup", type=int, default=20, help="Untimed requests before each level")
+    parser.add_argument("--sizes", nargs="+", default=["640x480", "1920x1080"], help="Synthetic image sizes as WIDTHxHEIGHT")
+    parser.add_argument("--images", type=int, default=16, help="Distinct synthetic images to cycle through")
+    parser.add_argument("--imgsz", type=int, default=infer.MODEL_INPUT_SIZE, help="Model input size")
+    parser.add_argument("--model", help="ONNX model to serve (default: synthetic session)")
+    parser.add_argument("--synthetic-ms", type=float, default=5.0, help="Synthetic session time per image")
+    parser.add_argument("--density", type=float, default=0.01, help="Synthetic share of above-threshold boxes")
+    parser.add_argument("--cache", action="store_true", help="Keep the result cache enabled")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    levels = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": "load",
+                "environment": environment(),
+                "config": {key: value for key, value in vars(args).items() if key != "output"},
+                "batching": {"max_batch_size": infer.BATCHER.max_batch_size, "max_wait_ms": infer.BATCHER.max_wait_ms},
+                "levels": levels,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Preprocessing memory and latency benchmark.
+
+Compares the original copy-heavy preprocessing (PIL convert, np.array,
+cvtColor, copyMakeBorder, astype, transpose, expand_dims) with the pooled
+in-place pipeline in infer.py on synthetic images, and reports peak traced
+memory, peak RSS growth (Linux) and latency per image.
+
+Usage:
+    python benchmarks/bench_preprocess.py --sizes 640x480 4000x3000 --repeat 10
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import infer  # noqa: E402
+
+
+def legacy_preprocess(image, new_shape=(640, 640), color=(114, 114, 114)):
+    """Reference copy of the preprocessing pipeline before pooling."""
+    img_rgb = np.array(image.convert("RGB"))
+    img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+
+    shape = img_bgr.shape[:2]
+    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+    new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+    dw, dh = (new_shape[1] - new_unpad[0]) / 2, (new_shape[0] - new_unpad[1]) / 2
+
+    im = img_bgr
+    if shape[::-1] != new_unpad:
+        im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+
+    img_input = im.astype(np.float32) / 255.0
+    img_input = np.transpose(img_input, (2, 0, 1))
+    return np.expand_dims(img_input, axis=0)
+
+
+def pooled_preprocess(image):
+    """Current pipeline, including the acquire/release round trip."""
+    tensor = infer.TENSOR_POOL.acquire((1, 3, *infer.MODEL_INPUT))
+    try:
+        decoded = infer.DecodedImage(np.asarray(image), image.size, (1.0, 1.0))
+        infer._preprocess_image(decoded, tensor)
+        return tensor
+    finally:
+        infer.TENSOR_POOL.release(tensor)
+
+
+def synthetic_image(width, height, seed=0):
+    """Smooth gradient plus noise so resizing does representative work."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = (x + y) / 2
+    pixels = np.stack([base, np.flipud(base), base[:, ::-1]], axis=2)
+    pixels += rng.normal(0, 12, pixels.shape).astype(np.float32)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB")
+
+
+def _rss_status():
+    """Return (current, peak) resident set size in bytes, or None off Linux."""
+    try:
+        with open("/proc/self/status") as f:
+            fields = dict(line.split(":", 1) for line in f if line.startswith(("VmRSS", "VmHWM")))
+        return int(fields["VmRSS"].split()[0]) * 1024, int(fields["VmHWM"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def peak_rss_growth(fn, image):
+    """Peak RSS growth of one call; PIL and OpenCV buffers are not traced by tracemalloc."""
+    try:
+        # Writing 5 resets the VmHWM high-water mark to the current RSS
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return None
+
+    before = _rss_status()
+    fn(image)
+    after = _rss_status()
+    if before is None or after is None:
+        return None
+    return after[1] - before[0]
+
+
+def measure(fn, image, repeat):
+    """Return peak traced bytes, peak RSS growth and mean latency per call."""
+    fn(image)  # warm the buffer pool and OpenCV
+    rss = peak_rss_growth(fn, image)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    fn(image)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(image)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    return {
+        "peak_bytes": peak - before,
+        "peak_rss_bytes": rss,
+        "latency_ms": elapsed * 1000.0,
+    }
+
+
+def parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing memory and latency")
+    parser.add_argument("--sizes", nargs="+", default=["640x480", "1920x1080", "4000x3000"],
+                        help="Synthetic image sizes as WIDTHxHEIGHT")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed iterations per size")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        width, height = parse_size(size)
+        image = synthetic_image(width, height)
+
+        legacy = measure(legacy_preprocess, image, args.repeat)
+        pooled = measure(pooled_preprocess, image, args.repeat)
+        saved = legacy["peak_bytes"] - pooled["peak_bytes"]
+
+        results.append({
+            "size": f"{width}x{height}",
+            "legacy": legacy,
+            "pooled": pooled,
+            "peak_bytes_saved": saved,
+        })
+
+        print(f"{width}x{height}: peak {legacy['peak_bytes'] / 2**20:.1f} MiB -> "
+              f"{pooled['peak_bytes'] / 2**20:.1f} MiB (saved {saved / 2**20:.1f} MiB), "
+              f"latency {legacy['latency_ms']:.2f} ms -> {pooled['latency_ms']:.2f} ms")
+        if legacy["peak_rss_bytes"] is not None:
+            print(f"  peak RSS growth {legacy['peak_rss_bytes'] / 2**20:.1f} MiB -> "
+                  f"{pooled['peak_rss_bytes'] / 2**20:.1f} MiB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "preprocess", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
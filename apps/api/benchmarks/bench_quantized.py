@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Accuracy-vs-latency benchmark for reduced-precision models.
+
+Runs the FP32 baseline and one or more candidate models (for example the
+output of tools/quantize_model.py) over a local image set with the same
+preprocessing and post-processing as /api/infer, then reports per model:
+
+- single-image latency (mean, p50, p95) and batched throughput
+- agreement with the baseline: mAP@0.5 and mAP@0.5:0.95 treating the FP32
+  detections as ground truth, matched precision/recall and mean IoU
+
+Usage:
+    python benchmarks/bench_quantized.py --baseline /tmp/yolov8n.onnx \\
+        --candidates /tmp/yolov8n.int8.onnx --images ./images --output quant.json
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import infer  # noqa: E402
+from bench_preprocess import synthetic_image  # noqa: E402
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def load_inputs(image_dir, synthetic, imgsz):
+    """Preprocess every image once; all models see identical tensors."""
+    if image_dir:
+        blobs = [p.read_bytes() for p in sorted(Path(image_dir).rglob("*")) if p.suffix.lower() in IMAGE_EXTENSIONS]
+    else:
+        blobs = []
+        for i in range(synthetic):
+            buffer = io.BytesIO()
+            synthetic_image(640 + 64 * (i % 5), 480 + 48 * (i % 3), seed=i).save(buffer, "JPEG")
+            blobs.append(buffer.getvalue())
+    if not blobs:
+        raise SystemExit("No images to benchmark")
+
+    inputs = []
+    for data in blobs:
+        decoded = infer._decode_image(data, (imgsz, imgsz))
+        tensor, ratio, pad, shape = infer._preprocess_image(decoded, np.empty((1, 3, imgsz, imgsz), dtype=np.float32))
+        inputs.append((tensor, ratio, pad, shape))
+    return inputs
+
+
+def detect(outputs, inputs, head):
+    """Decode raw outputs with the API's NMS and map boxes to original images."""
+    detections = infer._non_max_suppression(outputs, conf_thres=infer.CONF_THRES, iou_thres=infer.IOU_THRES,
+                                            head=head)
+    _, ratios, pads, shapes = zip(*inputs)
+    return infer._postprocess_results(detections, list(ratios), list(pads), list(shapes))
+
+
+def box_iou(a, b):
+    """Pairwise IoU between (n, 4) and (m, 4) xyxy boxes."""
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:4] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:4] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def average_precision(predictions, references, iou_thres):
+    """Mean over reference classes of all-point interpolated AP at iou_thres."""
+    classes = sorted({int(c) for ref in references for c in ref[:, 5]})
+    aps = []
+    for cls in classes:
+        scored = []  # (score, image index, box)
+        total_refs = 0
+        for i, (pred, ref) in enumerate(zip(predictions, references)):
+            total_refs += int((ref[:, 5] == cls).sum())
+            for row in pred[pred[:, 5] == cls]:
+                scored.append((row[4], i, row[:4]))
+        scored.sort(key=lambda item: -item[0])
+
+        matched = [np.zeros(int((ref[:, 5] == cls).sum()), dtype=bool) for ref in references]
+        tp = np.zeros(len(scored))
+        for k, (_, i, box) in enumerate(scored):
+            refs = references[i][references[i][:, 5] == cls]
+            if not len(refs):
+                continue
+            ious = box_iou(box[None, :], refs[:, :4])[0]
+            ious[matched[i]] = 0
+            best = int(np.argmax(ious))
+            if ious[best] >= iou_thres:
+                matched[i][best] = True
+                tp[k] = 1
+
+        if not total_refs:
+            continue
+        cum_tp = np.cumsum(tp)
+        recall = cum_tp / total_refs
+        precision = cum_tp / np.arange(1, len(tp) + 1) if len(tp) else np.zeros(0)
+
+        # Precision envelope, integrated over recall
+        recall = np.concatenate([[0.0], recall, [1.0]])
+        precision = np.concatenate([[1.0], precision, [0.0]])
+        precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+        steps = np.where(recall[1:] != recall[:-1])[0]
+        aps.append(float(np.sum((recall[steps + 1] - recall[steps]) * precision[steps + 1])))
+
+    return float(np.mean(aps)) if aps else 1.0
+
+
+def agreement(predictions, references, iou_thres=0.5):
+    """Precision, recall and mean IoU of class-matched detections against the baseline."""
+    matches = 0
+    total_pred = sum(len(p) for p in predictions)
+    total_ref = sum(len(r) for r in references)
+    iou_sum = 0.0
+    for pred, ref in zip(predictions, references):
+        if not len(pred) or not len(ref):
+            continue
+        ious = box_iou(pred[:, :4], ref[:, :4])
+        ious[pred[:, 5][:, None] != ref[:, 5][None, :]] = 0
+        used = np.zeros(len(ref), dtype=bool)
+        for i in np.argsort(-pred[:, 4]):
+            row = np.where(used, 0, ious[i])
+            j = int(np.argmax(row))
+            if row[j] >= iou_thres:
+                used[j] = True
+                matches += 1
+                iou_sum += float(row[j])
+    return {
+        "precision": matches / total_pred if total_pred else 1.0,
+        "recall": matches / total_ref if total_ref else 1.0,
+        "mean_iou": iou_sum / matches if matches else 0.0,
+    }
+
+
+def benchmark_model(path, inputs, batch_size, repeat):
+    """Latency, throughput and detections of one model file."""
+    session = ort.InferenceSession(path, sess_options=infer._session_options(), providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+    batch_dim = session.get_inputs()[0].shape[0]
+    if isinstance(batch_dim, int):
+        batch_size = batch_dim
+
+    tensors = [item[0] for item in inputs]
+    batch_size = min(batch_size, len(tensors))
+    session.run(None, {input_name: tensors[0]})  # warm-up
+
+    # Single-image latency
+    latencies = []
+    outputs = []
+    for _ in range(repeat):
+        for tensor in tensors:
+            start = time.perf_counter()
+            output = session.run(None, {input_name: tensor})[0]
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            if len(outputs) < len(tensors):
+                outputs.append(output)
+
+    # Batched throughput
+    start = time.perf_counter()
+    images = 0
+    for _ in range(repeat):
+        for i in range(0, len(tensors) - batch_size + 1, batch_size):
+            session.run(None, {input_name: np.concatenate(tensors[i:i + batch_size], axis=0)})
+            images += batch_size
+    elapsed = time.perf_counter() - start
+
+    detections = detect(np.concatenate(outputs, axis=0), inputs, infer._output_head(session))
+    latencies = np.asarray(latencies)
+    return {
+        "model": path,
+        "size_bytes": os.path.getsize(path),
+        "latency_ms": {
+            "mean": float(latencies.mean()),
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+        },
+        "throughput_ips": images / elapsed if elapsed and images else None,
+        "batch_size": batch_size,
+        "detections": int(sum(len(d) for d in detections)),
+    }, detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare quantized models against the FP32 baseline")
+    parser.add_argument("--baseline", default=infer.MODEL_PATH, help="FP32 ONNX model")
+    parser.add_argument("--candidates", nargs="+", required=True, help="Reduced-precision ONNX models")
+    parser.add_argument("--images", help="Folder of evaluation images")
+    parser.add_argument("--synthetic", type=int, default=16, help="Synthetic images when --images is not given")
+    parser.add_argument("--imgsz", type=int, default=infer.MODEL_INPUT_SIZE, help="Model input size")
+    parser.add_argument("--batch-size", type=int, default=8, help="Batch size for the throughput run")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the image set")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    inputs = load_inputs(args.images, args.synthetic, args.imgsz)
+    baseline, references = benchmark_model(args.baseline, inputs, args.batch_size, args.repeat)
+    print(f"baseline {args.baseline}: {baseline['latency_ms']['mean']:.2f} ms/img, "
+          f"{baseline['throughput_ips'] or 0:.1f} img/s, {baseline['detections']} detections")
+
+    results = []
+    for path in args.candidates:
+        candidate, predictions = benchmark_model(path, inputs, args.batch_size, args.repeat)
+        candidate["map50_vs_baseline"] = average_precision(predictions, references, 0.5)
+        candidate["map50_95_vs_baseline"] = float(np.mean([
+            average_precision(predictions, references, t) for t in np.arange(0.5, 0.96, 0.05)
+        ]))
+        candidate["agreement"] = agreement(predictions, references)
+        candidate["speedup"] = baseline["latency_ms"]["mean"] / candidate["latency_ms"]["mean"]
+        results.append(candidate)
+
+        print(f"{path}: {candidate['latency_ms']['mean']:.2f} ms/img (x{candidate['speedup']:.2f}), "
+              f"{candidate['throughput_ips'] or 0:.1f} img/s, mAP50 vs FP32 {candidate['map50_vs_baseline']:.3f}, "
+              f"recall {candidate['agreement']['recall']:.3f}, precision {candidate['agreement']['precision']:.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "quantized", "images": len(inputs), "baseline": baseline,
+                       "candidates": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
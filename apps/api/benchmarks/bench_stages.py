@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Per-stage micro-benchmarks for the detection pipeline.
+
+Times each stage of /api/infer in isolation, fully offline:
+
+- decode: ``_decode_image`` on synthetic JPEGs of several sizes
+- preprocess: ``_preprocess_image`` (letterbox, normalize, layout) into pooled buffers
+- nms: ``_non_max_suppression`` on a synthetic raw YOLO output whose share
+  of above-threshold boxes is set with --densities, once per output head in
+  --heads (decode plus NMS), for every class and for each class profile in
+  --profiles
+- postprocess: ``_postprocess_results`` plus ``_detections_to_results``
+- serialize: response body encoding with the stdlib JSON encoder, orjson
+  (serialize_orjson) and the packed binary layout (serialize_binary)
+- session_load / session_run: only with --model
+
+Results go to --output as JSON so runs can be compared over time.
+
+Usage:
+    python benchmarks/bench_stages.py --sizes 640x480 1920x1080 --densities 0.001 0.01 0.05 --output stages.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import onnxruntime as ort
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import infer  # noqa: E402
+from _decoders import HEADS  # noqa: E402
+from _encoding import dumps_json, pack_detections  # noqa: E402
+from _inference import model_batch_size, model_fixed_input_shape  # noqa: E402
+from bench_preprocess import parse_size, synthetic_image  # noqa: E402
+
+STRIDES = (8, 16, 32)
+
+
+def num_anchors(height, width):
+    """Boxes a YOLOv8-style head predicts for an input of this size."""
+    return sum((height // stride) * (width // stride) for stride in STRIDES)
+
+
+def synthetic_prediction(batch, input_shape, density=0.01, num_classes=80, objects=20, seed=0, head="yolov8"):
+    """
+    Raw YOLO output in the layout of ``head``.
+
+    - yolov8: (batch, 4 + num_classes, num_boxes), no objectness row
+    - yolov5: (batch, 5 + num_classes, num_boxes) with an objectness row
+    - end2end: (batch, 300, 6) rows of x1, y1, x2, y2, score, class_id
+
+    A ``density`` share of the boxes clears the confidence threshold; they
+    are jittered copies of ``objects`` ground-truth boxes, so NMS has real
+    overlap to suppress. All other boxes score well below the threshold.
+    """
+    rng = np.random.default_rng(seed)
+    height, width = input_shape
+    count = num_anchors(height, width)
+    first_class = 5 if head == "yolov5" else 4
+    prediction = np.empty((batch, first_class + num_classes, count), dtype=np.float32)
+
+    prediction[:, 0, :] = rng.uniform(0, width, (batch, count))
+    prediction[:, 1, :] = rng.uniform(0, height, (batch, count))
+    prediction[:, 2:4, :] = rng.uniform(4, 64, (batch, 2, count))
+    prediction[:, 4:, :] = rng.uniform(0, 0.1, (batch, first_class - 4 + num_classes, count))
+
+    positives = int(round(count * density))
+    if positives:
+        centers = rng.uniform([0, 0], [width, height], (objects, 2))
+        sizes = rng.uniform(16, min(height, width) / 3, (objects, 2))
+        classes = rng.integers(0, num_classes, objects)
+        for b in range(batch):
+            index = rng.choice(count, positives, replace=False)
+            owner = rng.integers(0, objects, positives)
+            image = prediction[b]
+            image[0:2, index] = (centers[owner] + rng.normal(0, 3, (positives, 2))).T
+            image[2:4, index] = (sizes[owner] * rng.uniform(0.9, 1.1, (positives, 2))).T
+            if head == "yolov5":
+                image[4, index] = rng.uniform(0.5, 1.0, positives)
+            image[first_class + classes[owner], index] = rng.uniform(0.6, 1.0, positives)
+
+    if head != "end2end":
+        return prediction
+
+    # What an exported model with NMS in the graph would emit for the same scene
+    detections = infer._non_max_suppression(prediction, conf_thres=0.01, iou_thres=infer.IOU_THRES,
+                                            head=HEADS["yolov8"])
+    end2end = np.zeros((batch, 300, 6), dtype=np.float32)
+    for b, dets in enumerate(detections):
+        end2end[b, :len(dets)] = dets[:300]
+    return end2end
+
+
+def summarize(samples):
+    """Latency statistics in milliseconds for a list of seconds."""
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "runs": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "min_ms": float(ms.min()),
+    }
+
+
+def time_call(fn, repeat, warmup=2):
+    """Run ``fn`` ``warmup`` + ``repeat`` times and summarize the timed runs."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def jpeg_bytes(width, height, seed=0, quality=90):
+    buffer = io.BytesIO()
+    synthetic_image(width, height, seed).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def bench_image_stages(sizes, imgsz, repeat):
+    """decode and preprocess per image size."""
+    results = []
+    input_shape = (imgsz, imgsz)
+    for width, height in sizes:
+        data = jpeg_bytes(width, height)
+        params = {"size": f"{width}x{height}", "imgsz": imgsz}
+
+        results.append({"stage": "decode", **params,
+                        **time_call(lambda: infer._decode_image(data, input_shape), repeat)})
+
+        decoded = infer._decode_image(data, input_shape)
+
+        def preprocess():
+            tensor = infer.TENSOR_POOL.acquire((1, 3, *input_shape))
+            try:
+                infer._preprocess_image(decoded, tensor)
+            finally:
+                infer.TENSOR_POOL.release(tensor)
+
+        results.append({"stage": "preprocess", **params, **time_call(preprocess, repeat)})
+    return results
+
+
+def bench_output_stages(densities, imgsz, batch, repeat, profiles=(), heads=("yolov8",)):
+    """nms per output head, then postprocess and serialize, per box density."""
+    results = []
+    input_shape = (imgsz, imgsz)
+    for density in densities:
+        for name in heads:
+            head = HEADS[name]
+            prediction = synthetic_prediction(batch, input_shape, density, head=name)
+            params = {"density": density, "batch": batch, "imgsz": imgsz, "head": name,
+                      "boxes": int(prediction.shape[1 if head.nms_in_graph else 2])}
+
+            nms = lambda: infer._non_max_suppression(  # noqa: E731
+                prediction, conf_thres=infer.CONF_THRES, iou_thres=infer.IOU_THRES, head=head)
+            results.append({"stage": "nms", **params, **time_call(nms, repeat)})
+
+            for profile in profiles:
+                classes = infer.CLASS_PROFILES[profile]
+                nms_profile = lambda: infer._non_max_suppression(  # noqa: E731
+                    prediction, conf_thres=infer.CONF_THRES, iou_thres=infer.IOU_THRES, classes=classes, head=head)
+                results.append({"stage": "nms", **params, "profile": profile, **time_call(nms_profile, repeat)})
+
+        # Output stages do not depend on the head; time them on the default one
+        prediction = synthetic_prediction(batch, input_shape, density)
+        params = {"density": density, "batch": batch, "imgsz": imgsz, "boxes": int(prediction.shape[2])}
+        detections = infer._non_max_suppression(prediction, conf_thres=infer.CONF_THRES, iou_thres=infer.IOU_THRES,
+                                                head=HEADS["yolov8"])
+        ratios, pads, shapes = [(0.5, 0.5)] * batch, [(0.0, 80.0)] * batch, [(960, 1280)] * batch
+
+        def postprocess():
+            mapped = infer._postprocess_results([d.copy() for d in detections], ratios, pads, shapes)
+            return [infer._detections_to_results(d) for d in mapped]
+
+        results.append({"stage": "postprocess", **params, **time_call(postprocess, repeat)})
+
+        body = {"success": True, "results": postprocess()[0], "image_size": [1280, 960]}
+        encoders = {
+            "serialize": lambda: json.dumps(body),
+            "serialize_orjson": lambda: dumps_json(body),
+            "serialize_binary": lambda: pack_detections(body["results"], body["image_size"]),
+        }
+        for stage, encode in encoders.items():
+            results.append({"stage": stage, **params,
+                            "detections": len(body["results"]),
+                            "bytes": len(encode()),
+                            **time_call(encode, repeat)})
+    return results
+
+
+def bench_session(model_path, imgsz, batch_sizes, repeat):
+    """Cold session creation and session.run per batch size for a real model."""
+    results = []
+    options = infer._session_options()
+    samples = []
+    for _ in range(max(1, repeat // 5)):
+        start = time.perf_counter()
+        session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        samples.append(time.perf_counter() - start)
+    results.append({"stage": "session_load", "model": model_path, **summarize(samples)})
+
+    input_name = session.get_inputs()[0].name
+    fixed = model_fixed_input_shape(session) or (imgsz, imgsz)
+    fixed_batch = model_batch_size(session)
+    for batch in ([fixed_batch] if fixed_batch else batch_sizes):
+        tensor = np.random.default_rng(0).random((batch, 3) + tuple(fixed), dtype=np.float32)
+        results.append({"stage": "session_run", "model": model_path, "batch": batch,
+                        "input": list(fixed),
+                        **time_call(lambda: session.run(None, {input_name: tensor}), repeat)})
+    return results
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "onnxruntime": ort.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark each stage of the detection pipeline")
+    parser.add_argument("--sizes", nargs="+", default=["640x480", "1920x1080", "4000x3000"],
+                        help="Synthetic image sizes as WIDTHxHEIGHT")
+    parser.add_argument("--densities", nargs="+", type=float, default=[0.0, 0.001, 0.01, 0.05],
+                        help="Share of raw boxes above the confidence threshold")
+    parser.add_argument("--imgsz", type=int, default=infer.MODEL_INPUT_SIZE, help="Model input size")
+    parser.add_argument("--batch", type=int, default=1, help="Images per raw output for nms/postprocess")
+    parser.add_argument("--heads", nargs="+", default=sorted(HEADS), choices=sorted(HEADS),
+                        help="Output heads to time decode plus nms for")
+    parser.add_argument("--profiles", nargs="*", default=sorted(infer.CLASS_PROFILES),
+                        help="Class profiles to time nms with")
+    parser.add_argument("--model", help="ONNX model for session_load/session_run (skipped when omitted)")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8], help="session_run batch sizes")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed iterations per case")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = bench_image_stages([parse_size(size) for size in args.sizes], args.imgsz, args.repeat)
+    results += bench_output_stages(args.densities, args.imgsz, args.batch, args.repeat, args.profiles,
+                                   args.heads)
+    if args.model:
+        results += bench_session(args.model, args.imgsz, args.batch_sizes, args.repeat)
+
+    for result in results:
+        keys = ("size", "density", "head", "profile", "batch", "detections")
+        params = ", ".join(f"{key}={result[key]}" for key in keys if key in result)
+        print(f"{result['stage']:<16} {params:<52} mean {result['mean_ms']:8.3f} ms  "
+              f"p95 {result['p95_ms']:8.3f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "stages", "environment": environment(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
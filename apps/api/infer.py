@@ -1,5 +1,5 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, WebSocket
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import numpy as np
 import onnxruntime as ort
@@ -9,7 +9,36 @@ import urllib.request
 import io
 from PIL import Image
 import tempfile
+import threading
+import math
+from collections import namedtuple
+import hashlib
+import hmac
+import json
+import time
+import asyncio
+import functools
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from _admission import AdmissionController, AdmissionMiddleware, DeadlineExceeded, Lane, Rejected, \
+    current_deadline, deadline_expired
+from _archive import ArchiveError, ImageArchive
+from _batching import MicroBatcher
+from _cache import DetectionCache, make_cache_key
+from _classes import load_class_profiles, resolve_class_filter
+from _db import Database
+from _decoders import metadata_class_names
+from _detection_log import DetectionLog
+from _encoding import BINARY_MEDIA_TYPE, class_table_id, dumps_json, negotiate, pack_detections
+from _fetch import FetchError, ImageFetcher
+from _inference import model_batch_size, model_fixed_input_shape, model_metadata, non_max_suppression, output_head, \
+    run_session_batch, session_options, warm_up
+from _metrics import MetricsMiddleware, Registry, stage
+from _models import ModelRegistry, resident_set_bytes
+from _streaming import StreamSession
+from _tracking import TemporalTracker
+from _workers import WorkerError, WorkerPool
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,6 +46,25 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Kids B-Care Object Detection API", version="1.0.0")
 
+# Admission control for the inference routes: at most INFER_MAX_IN_FLIGHT
+# requests run at once (0 = unlimited) and at most INFER_MAX_QUEUE more wait;
+# beyond that requests get a fast 429 with Retry-After. Each route has a
+# priority lane (clients may move down to a lower one with X-Request-Lane,
+# never up): webcam frames are shed first, then batches, single-photo uploads
+# last. X-Request-Deadline-Ms sets a budget after which queued work is
+# dropped with a 504. Added before CORS so rejections still carry CORS
+# headers.
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("INFER_MAX_IN_FLIGHT", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("INFER_MAX_QUEUE", "64"))
+ADMISSION = AdmissionController(ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, (
+    Lane("upload", 0, ADMISSION_MAX_QUEUE),
+    Lane("batch", 1, int(os.getenv("INFER_BATCH_MAX_QUEUE", "8"))),
+    Lane("webcam", 2, int(os.getenv("INFER_WEBCAM_MAX_QUEUE", "4"))),
+))
+if ADMISSION_MAX_IN_FLIGHT > 0:
+    app.add_middleware(AdmissionMiddleware, controller=ADMISSION,
+                       routes={"/api/infer": "upload", "/api/infer/batch": "batch"})
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -26,9 +74,81 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus metrics on /metrics and a Server-Timing header on every response;
+# with METRICS_ENABLED=0 stage timers are no-ops and /metrics is not served
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS = Registry()
+STAGE_SECONDS = METRICS.histogram(
+    "infer_stage_seconds", "Time spent per request stage", LATENCY_BUCKETS, ("stage",))
+REQUEST_SECONDS = METRICS.histogram(
+    "http_request_duration_seconds", "HTTP request latency", LATENCY_BUCKETS, ("route", "method"))
+REQUESTS_TOTAL = METRICS.counter(
+    "http_requests_total", "HTTP requests by route and status", ("route", "method", "status"))
+IN_FLIGHT = METRICS.gauge("http_requests_in_flight", "HTTP requests being handled")
+IN_FLIGHT_HISTOGRAM = METRICS.histogram(
+    "http_requests_in_flight_observed", "Requests in flight seen by each arriving request", (1, 2, 4, 8, 16, 32, 64, 128, 256))
+SESSION_RUN_SECONDS = METRICS.histogram(
+    "infer_session_run_seconds", "session.run latency per batch", LATENCY_BUCKETS)
+MODEL_LOAD_SECONDS = METRICS.histogram(
+    "model_load_seconds", "Model load and warm-up time", (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120), ("phase",))
+DETECTIONS_PER_IMAGE = METRICS.histogram(
+    "infer_detections_per_image", "Detections returned per image", (0, 1, 2, 5, 10, 20, 50, 100, 300))
+TILES_PER_IMAGE = METRICS.histogram(
+    "infer_tiles_per_image", "Tiles run per tiled-mode image, excluding the full view", (1, 2, 4, 6, 9, 12, 16, 25, 36))
+TILED_SECONDS_PER_MEGAPIXEL = METRICS.histogram(
+    "infer_tiled_seconds_per_megapixel", "Tiled-mode decode-to-merge time per megapixel of the original image",
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+MODEL_REQUESTS = METRICS.counter("infer_model_requests_total", "Detection requests per model", ("model",))
+METRICS.gauge("model_registry_resident_bytes", "Approximate memory held by loaded models",
+              lambda: MODELS.resident_bytes)
+METRICS.counter("model_registry_evictions_total", "Models evicted to stay within the memory budget",
+                callback=lambda: MODELS.evictions)
+METRICS.register("infer_batch_size", "histogram", "Images per inference batch",
+                 lambda: BATCHER.batch_size_histogram if BATCHER is not None else None)
+METRICS.register("infer_batch_wait_milliseconds", "histogram", "Time requests waited for their batch",
+                 lambda: BATCHER.wait_ms_histogram if BATCHER is not None else None)
+METRICS.register("infer_queue_depth", "histogram", "Requests already queued when a request is submitted",
+                 lambda: BATCHER.queue_depth_histogram if BATCHER is not None else None)
+METRICS.gauge("infer_queue_depth_current", "Requests waiting for a batch",
+              lambda: BATCHER.stats()["queue_depth"] if BATCHER is not None else 0)
+METRICS.gauge("infer_batches_in_flight", "Batches running on the executor",
+              lambda: BATCHER.batches_in_flight if BATCHER is not None else 0)
+METRICS.gauge("infer_stream_sessions", "Open webcam streams", lambda: len(STREAM_SESSIONS))
+METRICS.gauge("model_ready", "1 once the model is loaded and warmed up",
+              lambda: 1 if MODEL_STATE["status"] == "ready" else 0)
+METRICS.counter("result_cache_hits_total", "Result cache hits (memory and disk)",
+                callback=lambda: RESULT_CACHE.counters["hits"] + RESULT_CACHE.counters["disk_hits"])
+METRICS.counter("result_cache_misses_total", "Result cache misses",
+                callback=lambda: RESULT_CACHE.counters["misses"])
+METRICS.gauge("detection_log_queued", "Detection rows waiting to be written", lambda: DETECTION_LOG.queued)
+METRICS.counter("detection_log_written_total", "Detection rows written to the database",
+                callback=lambda: DETECTION_LOG.counters["written"])
+METRICS.counter("detection_log_dropped_total", "Detection rows dropped on overflow or after failed flushes",
+                callback=lambda: DETECTION_LOG.counters["dropped_overflow"] + DETECTION_LOG.counters["dropped_failed"])
+METRICS.counter("detection_log_retries_total", "Retried detection log flushes",
+                callback=lambda: DETECTION_LOG.counters["retries"])
+METRICS.gauge("admission_in_flight", "Admitted inference requests being handled", lambda: ADMISSION.in_flight)
+METRICS.gauge("admission_queued", "Inference requests waiting for admission", lambda: ADMISSION.queued)
+ADMISSION_OUTCOMES = METRICS.counter(
+    "admission_requests_total", "Inference requests by lane and admission outcome", ("lane", "outcome"))
+for _lane in ADMISSION.lanes:
+    for _outcome in ("admitted", "rejected", "shed", "expired"):
+        ADMISSION_OUTCOMES.labels(_lane, _outcome).callback = \
+            lambda lane=_lane, outcome=_outcome: ADMISSION.counters[lane][outcome]
+
+if METRICS_ENABLED:
+    app.add_middleware(
+        MetricsMiddleware,
+        stage_histogram=STAGE_SECONDS,
+        request_histogram=REQUEST_SECONDS,
+        requests_total=REQUESTS_TOTAL,
+        in_flight=IN_FLIGHT,
+        in_flight_histogram=IN_FLIGHT_HISTOGRAM,
+    )
+
 # Global variables for model caching
 SESSION = None
-MODEL_INPUT = (640, 640)
 CLASS_NAMES = [
     "person", "bicycle", "car", "motorcycle", "airplane", "bus", "train", "truck", "boat",
     "traffic light", "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat",
@@ -41,40 +161,628 @@ CLASS_NAMES = [
     "mouse", "remote", "keyboard", "cell phone", "microwave", "oven", "toaster", "sink",
     "refrigerator", "book", "clock", "vase", "scissors", "teddy bear", "hair drier", "toothbrush"
 ]
+CLASS_NAMES_ARRAY = np.array(CLASS_NAMES)
+
+# Identifies CLASS_NAMES in binary responses, whose class ids index into it
+CLASS_TABLE_ID = class_table_id(CLASS_NAMES)
+
+# Named class subsets ("food", "safety", "toys") a request can restrict
+# detection to, built once from the label data in the repo's models/ folder
+CLASS_DATA_DIR = os.getenv("CLASS_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "models")
+CLASS_PROFILES = load_class_profiles(CLASS_DATA_DIR, CLASS_NAMES)
+
+# Detection thresholds
+CONF_THRES = 0.25
+IOU_THRES = 0.45
 
 # Environment variables
 MODEL_URL = os.getenv("MODEL_ONNX_URL", "https://huggingface.co/SpotLab/YOLOv8Detection/resolve/main/yolov8n.onnx")
 
+# Model lifecycle: local model file (downloaded from MODEL_URL when missing),
+# optional SHA-256 pin, persisted ORT-optimized graph and warm-up runs
+MODEL_PATH = os.getenv("MODEL_PATH", "/tmp/yolov8n.onnx")
+MODEL_SHA256 = os.getenv("MODEL_SHA256", "").lower()
+ORT_OPTIMIZED_MODEL_DIR = os.getenv("ORT_OPTIMIZED_MODEL_DIR", os.path.dirname(MODEL_PATH) or ".")
+MODEL_EAGER_LOAD = os.getenv("MODEL_EAGER_LOAD", "1") == "1"
+
+# Reduced-precision serving: fp32 (MODEL_PATH), or an int8/fp16 model built
+# by tools/quantize_model.py (default location <MODEL_PATH stem>.<precision>.onnx)
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "fp32").lower()
+MODEL_QUANTIZED_PATH = os.getenv("MODEL_QUANTIZED_PATH", "")
+MODEL_QUANTIZED_SHA256 = os.getenv("MODEL_QUANTIZED_SHA256", "").lower()
+MODEL_WARMUP_RUNS = int(os.getenv("MODEL_WARMUP_RUNS", "2"))
+
+# Output decoder: auto picks yolov8, yolov5 or end2end (NMS in the graph)
+# from the model's output shape and metadata; set it when that is ambiguous
+MODEL_HEAD = os.getenv("MODEL_HEAD", "auto").lower()
+OUTPUT_HEAD = None
+
+# Further models requests can pick with ``model``: a JSON object, or the path
+# of a JSON file, mapping model id to {"path", "url", "sha256", "head"}. They
+# load on first use and the least recently used ones are evicted once all
+# loaded models exceed MODEL_MEMORY_BUDGET_MB (0 = no limit). The model above
+# is always loaded and served as MODEL_ID.
+DEFAULT_MODEL_ID = os.getenv("MODEL_ID", "default")
+MODEL_REGISTRY = os.getenv("MODEL_REGISTRY", "")
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+# Enables POST /api/models/{id}/reload for callers sending it as X-Admin-Token
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN", "")
+
+SESSION_LOCK = threading.Lock()
+MODEL_STATE = {"status": "cold", "error": None, "load_seconds": None, "warmup_seconds": None,
+               "precision": MODEL_PRECISION, "model_path": None, "optimized_model_path": None, "sha256": None,
+               "output_head": None}
+READY_TASK = None
+
+# Result cache keyed by image bytes, model and detection settings
+# (RESULT_CACHE_MAX_MB=0 disables the in-process tier; the disk tier under
+# RESULT_CACHE_DIR is capped at RESULT_CACHE_DISK_MAX_MB)
+RESULT_CACHE = DetectionCache(
+    max_bytes=int(float(os.getenv("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    ttl_seconds=float(os.getenv("RESULT_CACHE_TTL_S", "3600")),
+    disk_dir=os.getenv("RESULT_CACHE_DIR") or None,
+    disk_max_bytes=int(float(os.getenv("RESULT_CACHE_DISK_MAX_MB", "256")) * 1024 * 1024),
+)
+
+# image_url downloads: pooled client, per-host limit, timeout and size cap,
+# and the downloads one /api/infer/batch request runs ahead concurrently
+FETCHER = ImageFetcher(
+    max_bytes=int(os.getenv("IMAGE_FETCH_MAX_BYTES", str(20 * 1024 * 1024))),
+    timeout=float(os.getenv("IMAGE_FETCH_TIMEOUT_S", "10")),
+    max_connections=int(os.getenv("IMAGE_FETCH_MAX_CONNECTIONS", "64")),
+    max_per_host=int(os.getenv("IMAGE_FETCH_MAX_PER_HOST", "8")),
+)
+FETCH_BATCH_CONCURRENCY = max(1, int(os.getenv("IMAGE_FETCH_BATCH_CONCURRENCY", "8")))
+
+# Input resolutions clients may pick with imgsz, and the default one. In
+# rectangular mode images are padded only up to a multiple of MODEL_STRIDE.
+MODEL_INPUT_SIZES = sorted({int(size) for size in os.getenv("MODEL_INPUT_SIZES", "320,416,512,640").split(",") if size.strip()})
+MODEL_INPUT_SIZE = int(os.getenv("MODEL_INPUT_SIZE", "640"))
+MODEL_INPUT = (MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)
+MODEL_STRIDE = 32
+if MODEL_INPUT_SIZE not in MODEL_INPUT_SIZES:
+    MODEL_INPUT_SIZES = sorted(MODEL_INPUT_SIZES + [MODEL_INPUT_SIZE])
+
+# Channel order the model expects; images are decoded as RGB
+MODEL_CHANNEL_ORDER = os.getenv("MODEL_CHANNEL_ORDER", "BGR").upper()
+
+# Webcam streams: temporal reuse skips the model on frames that barely changed
+# and shifts the previous boxes instead; every STREAM_KEYFRAME_INTERVAL-th
+# frame still runs a full detection. Clients may override both per stream.
+STREAM_TEMPORAL_REUSE = os.getenv("STREAM_TEMPORAL_REUSE", "0") == "1"
+STREAM_KEYFRAME_INTERVAL = int(os.getenv("STREAM_KEYFRAME_INTERVAL", "10"))
+STREAM_THUMBNAIL_WIDTH = int(os.getenv("STREAM_THUMBNAIL_WIDTH", "128"))
+
+# Micro-batching window: a batch is dispatched when it holds BATCH_MAX_SIZE
+# images or its oldest image has waited BATCH_MAX_WAIT_MS, whichever is first
+BATCH_MAX_SIZE = int(os.getenv("INFER_BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("INFER_BATCH_MAX_WAIT_MS", "2"))
+BATCHER = None
+
+# Serve inference from INFER_WORKER_PROCESSES worker processes instead of a
+# session in this process (0); each worker owns INFER_WORKER_SLOTS
+# shared-memory input tensors, so at most that many requests queue on it
+WORKER_PROCESSES = int(os.getenv("INFER_WORKER_PROCESSES", "0"))
+WORKER_SLOTS = int(os.getenv("INFER_WORKER_SLOTS", "2"))
+WORKER_POOL = None
+
+# Dedicated executor for session.run; each worker runs one batch at a time
+EXECUTOR_WORKERS = max(1, int(os.getenv("INFER_EXECUTOR_WORKERS", "1")))
+EXECUTOR = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="onnx-infer")
+
+# /api/infer/batch: images per request and per-image size limit. The decode
+# threads run the CPU-bound image work of every request off the event loop
+# (decode, letterbox, NMS, postprocess); batches decode the next images on
+# them while the current ones run through the session
+BATCH_UPLOAD_MAX_IMAGES = int(os.getenv("BATCH_UPLOAD_MAX_IMAGES", "1000"))
+BATCH_UPLOAD_MAX_IMAGE_BYTES = int(os.getenv("BATCH_UPLOAD_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+DECODE_WORKERS = max(1, int(os.getenv("BATCH_DECODE_WORKERS") or min(4, os.cpu_count() or 1)))
+DECODE_EXECUTOR = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+
+# Tiled mode (tiled=true): overlapping tiles of the model input size plus one
+# full view, merged with cross-tile box fusion. Images that would need more
+# than TILE_MAX_COUNT tiles are downscaled until they fit, which bounds latency.
+TILE_OVERLAP = min(max(float(os.getenv("TILE_OVERLAP", "0.2")), 0.0), 0.5)
+TILE_MAX_COUNT = max(1, int(os.getenv("TILE_MAX_COUNT", "12")))
+TILE_MATCH_THRES = float(os.getenv("TILE_MATCH_THRES", "0.5"))
+
+# Server-side detection logging (log=true): rows are queued in-process and
+# written to the leaderboard's detections table in multi-row batches over
+# the same pooled database layer the leaderboard uses (DB_POOL_* settings)
+DB = Database.from_env()
+DB.register_metrics(METRICS)
+DETECTION_LOG = DetectionLog(
+    DB,
+    max_queue=int(os.getenv("DETECTION_LOG_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("DETECTION_LOG_BATCH_SIZE", "500")),
+    flush_interval_s=float(os.getenv("DETECTION_LOG_FLUSH_INTERVAL_S", "1.0")),
+    overflow=os.getenv("DETECTION_LOG_OVERFLOW", "drop_oldest").lower(),
+    max_retries=int(os.getenv("DETECTION_LOG_MAX_RETRIES", "3")),
+)
+
+# ONNX Runtime session options (0 threads lets ONNX Runtime choose)
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+ORT_GRAPH_OPTIMIZATION = os.getenv("ORT_GRAPH_OPTIMIZATION", "all").lower()
+ORT_EXECUTION_MODE = os.getenv("ORT_EXECUTION_MODE", "sequential").lower()
+ORT_ENABLE_MEM_ARENA = os.getenv("ORT_ENABLE_MEM_ARENA", "1") == "1"
+
+def _session_settings():
+    """The ORT_* environment settings as ``_inference.session_options`` arguments."""
+    return {
+        "intra_op_threads": ORT_INTRA_OP_THREADS,
+        "inter_op_threads": ORT_INTER_OP_THREADS,
+        "graph_optimization": ORT_GRAPH_OPTIMIZATION,
+        "execution_mode": ORT_EXECUTION_MODE,
+        "enable_mem_arena": ORT_ENABLE_MEM_ARENA,
+    }
+
+def _session_options():
+    """Build ONNX Runtime SessionOptions from the ORT_* environment settings."""
+    return session_options(**_session_settings())
+
+def _file_sha256(path):
+    """Return the hex SHA-256 digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _resolve_quantized_model_path():
+    """Return the reduced-precision model file and its verified checksum."""
+    if MODEL_PRECISION not in ("int8", "fp16"):
+        raise ValueError(f"Unknown MODEL_PRECISION '{MODEL_PRECISION}', expected fp32, int8 or fp16")
+
+    model_path = MODEL_QUANTIZED_PATH or f"{os.path.splitext(MODEL_PATH)[0]}.{MODEL_PRECISION}.onnx"
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"No {MODEL_PRECISION} model at {model_path}; "
+                                f"create it with tools/quantize_model.py")
+
+    sha256 = _file_sha256(model_path)
+    if MODEL_QUANTIZED_SHA256 and sha256 != MODEL_QUANTIZED_SHA256:
+        raise ValueError(f"Checksum mismatch for {model_path}: expected {MODEL_QUANTIZED_SHA256}, got {sha256}")
+
+    return model_path, sha256
+
+def _resolve_model_path(source=None):
+    """
+    Make sure a model file exists locally and matches its pinned checksum.
+
+    ``source`` is a MODEL_REGISTRY entry; without one this is the default
+    model, MODEL_PATH (or its reduced-precision build) pinned by MODEL_SHA256.
+    """
+    if source is None:
+        if MODEL_PRECISION != "fp32":
+            return _resolve_quantized_model_path()
+        source = {"path": MODEL_PATH, "url": MODEL_URL, "sha256": MODEL_SHA256}
+
+    model_path, model_url = source["path"], source.get("url")
+    expected_sha256 = (source.get("sha256") or "").lower()
+
+    # Download model if not exists; write to a temporary name so a partial
+    # download is never mistaken for a complete model
+    if not os.path.exists(model_path):
+        if not model_url:
+            raise FileNotFoundError(f"No model at {model_path} and no url to download it from")
+        logger.info(f"Downloading model from {model_url}")
+        os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+        fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(model_path) or ".", suffix=".part")
+        os.close(fd)
+        try:
+            urllib.request.urlretrieve(model_url, partial_path)
+            os.replace(partial_path, model_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        logger.info("Model downloaded successfully")
+
+    sha256 = _file_sha256(model_path)
+    if expected_sha256 and sha256 != expected_sha256:
+        raise ValueError(f"Checksum mismatch for {model_path}: expected {expected_sha256}, got {sha256}")
+
+    return model_path, sha256
+
+def _optimized_model_path(model_path, sha256):
+    """Location of the persisted ORT-optimized graph for this exact model and level."""
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(ORT_OPTIMIZED_MODEL_DIR, f"{stem}.{sha256[:16]}.{ORT_GRAPH_OPTIMIZATION}.ort.onnx")
+
+def _shared_model_path(model_path, sha256):
+    """Location of the optimized graph the worker processes load, with its weights in ``<path>.data``."""
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(ORT_OPTIMIZED_MODEL_DIR, f"{stem}.{sha256[:16]}.{ORT_GRAPH_OPTIMIZATION}.shared.onnx")
+
+def _create_session(model_path, sha256):
+    """Create a CPU session for a verified model file, persisting or reusing its optimized graph."""
+    options = _session_options()
+    optimized_path = _optimized_model_path(model_path, sha256)
+
+    # Reuse the graph optimized on a previous boot; otherwise ask
+    # ONNX Runtime to save the one it builds now
+    if os.path.exists(optimized_path):
+        load_path = optimized_path
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        logger.info(f"Loading pre-optimized model from {optimized_path}")
+    else:
+        load_path = model_path
+        if ORT_GRAPH_OPTIMIZATION != "disable":
+            options.optimized_model_filepath = optimized_path
+
+    providers = ["CPUExecutionProvider"]
+    return ort.InferenceSession(load_path, sess_options=options, providers=providers)
+
 def _load_session():
     """Load ONNX model session with caching."""
     global SESSION
     if SESSION is None:
+        with SESSION_LOCK:
+            if SESSION is not None:
+                return SESSION
+            try:
+                started = time.perf_counter()
+                model_path, sha256 = _resolve_model_path()
+                optimized_path = _optimized_model_path(model_path, sha256)
+                SESSION = _create_session(model_path, sha256)
+
+                MODEL_STATE.update({
+                    "load_seconds": round(time.perf_counter() - started, 3),
+                    "model_path": model_path,
+                    "optimized_model_path": optimized_path if os.path.exists(optimized_path) else None,
+                    "sha256": sha256,
+                })
+                logger.info(f"ONNX session created successfully in {MODEL_STATE['load_seconds']}s")
+
+            except Exception as e:
+                logger.error(f"Error loading model: {str(e)}")
+                raise HTTPException(status_code=500, detail=f"Failed to load model: {str(e)}")
+
+    return SESSION
+
+def _output_head(session, override=None):
+    """Decoder for ``session``'s first output; see _decoders.select_head."""
+    return output_head(session, len(CLASS_NAMES), override or MODEL_HEAD)
+
+def _get_output_head():
+    """Pick the output decoder for the loaded model once."""
+    global OUTPUT_HEAD
+    if OUTPUT_HEAD is None:
+        OUTPUT_HEAD = _output_head(_load_session())
+        MODEL_STATE["output_head"] = OUTPUT_HEAD.name
+        logger.info(f"Decoding model output as {OUTPUT_HEAD.name}"
+                    f"{' (channels last)' if OUTPUT_HEAD.channels_last else ''}")
+    return OUTPUT_HEAD
+
+def _resolve_input_shape(image_size, imgsz=None, rect=False, session=None):
+    """
+    Pick the (height, width) model input for an image of ``image_size`` (w, h).
+
+    Square mode letterboxes to imgsz x imgsz. Rectangular mode scales the long
+    side to imgsz and pads the short side only up to the stride multiple.
+    Fixed-shape models always get their native input shape. ``session`` is a
+    registered model's session; the default model is used without one.
+    """
+    fixed_shape = model_fixed_input_shape(session or _serving_model())
+    if fixed_shape is not None:
+        return fixed_shape
+
+    imgsz = imgsz or MODEL_INPUT_SIZE
+    if not rect:
+        return imgsz, imgsz
+
+    width, height = image_size
+    r = min(imgsz / height, imgsz / width)
+    return (
+        min(imgsz, math.ceil(height * r / MODEL_STRIDE) * MODEL_STRIDE),
+        min(imgsz, math.ceil(width * r / MODEL_STRIDE) * MODEL_STRIDE),
+    )
+
+def _run_session_batch(batch, session=None):
+    """Run the ONNX session (the default model's unless given) on a stacked NCHW batch and return the first output."""
+    session = session or _load_session()
+    started = time.perf_counter()
+    outputs = run_session_batch(session, batch)
+    if METRICS_ENABLED:
+        SESSION_RUN_SECONDS.observe(time.perf_counter() - started)
+    return outputs
+
+def _get_batcher():
+    """Create the micro-batcher once the model input shape is known."""
+    global BATCHER
+    if BATCHER is None:
+        session = _load_session()
+        max_batch_size = BATCH_MAX_SIZE
+        fixed_size = model_batch_size(session)
+        if fixed_size is not None:
+            max_batch_size = min(max_batch_size, fixed_size)
+            logger.info(f"Model has a fixed batch size of {fixed_size}")
+
+        BATCHER = MicroBatcher(
+            _run_session_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=BATCH_MAX_WAIT_MS,
+            executor=EXECUTOR,
+            max_concurrent_batches=EXECUTOR_WORKERS,
+        )
+        logger.info(f"Micro-batching enabled: max_batch_size={max_batch_size}, max_wait_ms={BATCH_MAX_WAIT_MS}")
+
+    return BATCHER
+
+def _warm_up(session=None, batch_sizes=None):
+    """Run throwaway inferences at every input size so first requests skip first-run allocations."""
+    session = session or _load_session()
+    batch_sizes = batch_sizes or sorted({1, _get_batcher().max_batch_size})
+    warm_up(session, MODEL_INPUT_SIZES, batch_sizes, MODEL_WARMUP_RUNS, lambda batch: _run_session_batch(batch, session))
+    return session
+
+def _serving_model():
+    """The in-process session, or the worker pool standing in for it."""
+    return WORKER_POOL if WORKER_POOL is not None else _load_session()
+
+def _start_worker_pool():
+    """Resolve and graph-optimize the model once, then start the worker processes on it."""
+    global WORKER_POOL
+    started = time.perf_counter()
+    model_path, sha256 = _resolve_model_path()
+    shared_path = _shared_model_path(model_path, sha256)
+
+    # Workers load the shared graph with optimization disabled, so build it
+    # here when no earlier boot left one behind. Its initializers go to an
+    # external data file that the workers memory-map with prepacking turned
+    # off, so the weights can stay shared pages; the per-worker
+    # weights_private_bytes in /api/status shows whether they do
+    if not (os.path.exists(shared_path) and os.path.exists(f"{shared_path}.data")):
+        options = _session_options()
+        options.optimized_model_filepath = shared_path
+        options.add_session_config_entry("session.optimized_model_external_initializers_file_name",
+                                         f"{os.path.basename(shared_path)}.data")
+        options.add_session_config_entry("session.optimized_model_external_initializers_min_size_in_bytes", "1024")
+        ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+    pool = WorkerPool(WORKER_PROCESSES, {
+        "session": {key: value for key, value in _session_settings().items() if key != "intra_op_threads"},
+        "head": MODEL_HEAD,
+        "num_classes": len(CLASS_NAMES),
+        "input_sizes": MODEL_INPUT_SIZES,
+        "warmup_runs": MODEL_WARMUP_RUNS,
+        "conf_thres": CONF_THRES,
+        "iou_thres": IOU_THRES,
+    }, WORKER_SLOTS, ORT_INTRA_OP_THREADS or None)
+    pool.start(shared_path, (max(MODEL_INPUT_SIZES), max(MODEL_INPUT_SIZES)))
+    WORKER_POOL = pool
+
+    MODEL_STATE.update({
+        "load_seconds": round(time.perf_counter() - started, 3),
+        "model_path": model_path,
+        "optimized_model_path": shared_path,
+        "sha256": sha256,
+        "output_head": pool.output_head,
+    })
+
+def _default_serving_model(session):
+    """Registry entry of the default model, served through the batcher or the worker pool."""
+    return ServingModel(session, OUTPUT_HEAD, CLASS_NAMES, CLASS_NAMES_ARRAY, CLASS_PROFILES, CLASS_TABLE_ID,
+                        MODEL_STATE["sha256"])
+
+def _prepare_model():
+    """Load, optimize and warm up the model; runs on the inference executor."""
+    MODEL_STATE["status"] = "loading"
+    rss_before = resident_set_bytes()
+    try:
+        if WORKER_PROCESSES > 0:
+            # Workers warm up their own sessions before reporting ready
+            _start_worker_pool()
+            MODELS.pin(DEFAULT_MODEL_ID, _default_serving_model(None), load_seconds=MODEL_STATE["load_seconds"])
+            MODEL_STATE["status"] = "ready"
+            MODEL_LOAD_SECONDS.labels("load").observe(MODEL_STATE["load_seconds"])
+            return
+        session = _load_session()
+        _get_output_head()
+        rss_after = resident_set_bytes()
+        MODELS.pin(DEFAULT_MODEL_ID, _default_serving_model(session), load_seconds=MODEL_STATE["load_seconds"],
+                   resident_bytes=rss_after - rss_before if rss_before is not None and rss_after is not None else 0)
+        started = time.perf_counter()
+        _warm_up()
+        MODEL_STATE["warmup_seconds"] = round(time.perf_counter() - started, 3)
+        MODEL_STATE["status"] = "ready"
+        if MODEL_STATE["load_seconds"] is not None:
+            MODEL_LOAD_SECONDS.labels("load").observe(MODEL_STATE["load_seconds"])
+        MODEL_LOAD_SECONDS.labels("warmup").observe(MODEL_STATE["warmup_seconds"])
+    except Exception as e:
+        MODEL_STATE["status"] = "failed"
+        MODEL_STATE["error"] = getattr(e, "detail", str(e))
+        raise
+
+def _reload_default_model():
+    """
+    Hot-swap the default model to the current contents of its model file.
+
+    The new session is created and warmed up next to the old one, then
+    replaces it in one step; batches already running finish on the old
+    session. The new model must keep the input signature and output head the
+    batcher was set up for. Returns the new registry version.
+    """
+    global SESSION, OUTPUT_HEAD
+    if WORKER_POOL is not None:
+        raise HTTPException(status_code=409, detail="Restart the server to swap the model of the worker processes")
+    current = _load_session()
+
+    started = time.perf_counter()
+    rss_before = resident_set_bytes()
+    model_path, sha256 = _resolve_model_path()
+    session = _create_session(model_path, sha256)
+    rss_after = resident_set_bytes()
+    head = _output_head(session)
+    if (model_batch_size(session) != model_batch_size(current)
+            or model_fixed_input_shape(session) != model_fixed_input_shape(current)
+            or head != _get_output_head()):
+        raise HTTPException(status_code=409,
+                            detail="The new model changes the input shape or output head; restart the server instead")
+    load_seconds = round(time.perf_counter() - started, 3)
+    _warm_up(session, sorted({1, _get_batcher().max_batch_size}))
+
+    with SESSION_LOCK:
+        SESSION, OUTPUT_HEAD = session, head
+        optimized_path = _optimized_model_path(model_path, sha256)
+        MODEL_STATE.update({
+            "load_seconds": load_seconds,
+            "model_path": model_path,
+            "optimized_model_path": optimized_path if os.path.exists(optimized_path) else None,
+            "sha256": sha256,
+        })
+    resident_bytes = rss_after - rss_before if rss_before is not None and rss_after is not None else 0
+    version = MODELS.pin(DEFAULT_MODEL_ID, _default_serving_model(session), load_seconds=load_seconds,
+                         resident_bytes=max(resident_bytes, os.path.getsize(model_path)))
+    logger.info(f"Swapped default model to {sha256[:16]} (v{version})")
+    return version
+
+async def _ensure_ready():
+    """Start model preparation if needed and wait until it has finished."""
+    global READY_TASK
+    if MODEL_STATE["status"] == "ready":
+        return
+    if READY_TASK is None or (READY_TASK.done() and MODEL_STATE["status"] == "failed"):
+        READY_TASK = asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(EXECUTOR, _prepare_model))
+    await asyncio.shield(READY_TASK)
+
+# A model ready to serve: its session, output decoder and class table, plus
+# the profiles and class table id derived from it, and its checksum
+ServingModel = namedtuple("ServingModel", ["session", "head", "class_names", "class_array", "profiles", "table_id",
+                                           "sha256"])
+
+def _read_model_registry():
+    """Registered models by id from MODEL_REGISTRY (JSON, or the path of a JSON file)."""
+    if not MODEL_REGISTRY:
+        return {}
+    text = MODEL_REGISTRY
+    if not text.lstrip().startswith("{"):
+        with open(text) as f:
+            text = f.read()
+
+    models = json.loads(text)
+    for model_id, source in models.items():
+        if model_id == DEFAULT_MODEL_ID:
+            raise ValueError(f"Model id '{model_id}' is reserved for the default model")
+        if not isinstance(source, dict) or not source.get("path"):
+            raise ValueError(f"Model '{model_id}' needs a \"path\"")
+    return models
+
+def _load_registered_model(source):
+    """Registry loader: verify, load and warm up one registered model."""
+    model_path, sha256 = _resolve_model_path(source)
+    session = _create_session(model_path, sha256)
+    head = _output_head(session, source.get("head"))
+
+    # Specialised models bring their own class table; profiles follow it
+    class_names = metadata_class_names(model_metadata(session)) or CLASS_NAMES
+    _warm_up(session, [1])
+    return ServingModel(session, head, class_names, np.array(class_names), load_class_profiles(CLASS_DATA_DIR, class_names),
+                        class_table_id(class_names), sha256)
+
+MODELS = ModelRegistry(_load_registered_model, MODEL_MEMORY_BUDGET_MB * 1024 * 1024)
+try:
+    for _model_id, _source in _read_model_registry().items():
+        MODELS.register(_model_id, _source)
+except (OSError, ValueError) as e:
+    logger.error(f"Ignoring MODEL_REGISTRY: {str(e)}")
+
+async def _acquire_model(model_id=None):
+    """
+    Lease ``model_id`` (the default model when None) for one request.
+
+    Registered models load on first use, off the event loop. Unknown ids
+    are a 404 and models that fail to load a 503.
+    """
+    model_id = model_id or DEFAULT_MODEL_ID
+    if model_id == DEFAULT_MODEL_ID:
+        await _ensure_ready()
+        lease = MODELS.acquire(model_id)
+    else:
+        if model_id not in MODELS:
+            raise HTTPException(status_code=404, detail=f"Unknown model '{model_id}'; available: {MODELS.ids}")
         try:
-            # Create temporary file for model
-            model_path = "/tmp/yolov8n.onnx"
-            
-            # Download model if not exists
-            if not os.path.exists(model_path):
-                logger.info(f"Downloading model from {MODEL_URL}")
-                urllib.request.urlretrieve(MODEL_URL, model_path)
-                logger.info("Model downloaded successfully")
-            
-            # Create ONNX session
-            providers = ["CPUExecutionProvider"]
-            SESSION = ort.InferenceSession(model_path, providers=providers)
-            logger.info("ONNX session created successfully")
-            
+            lease = await asyncio.to_thread(MODELS.acquire, model_id)
         except Exception as e:
-            logger.error(f"Error loading model: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Failed to load model: {str(e)}")
-    
-    return SESSION
+            logger.error(f"Error loading model {model_id}: {str(e)}")
+            raise HTTPException(status_code=503, detail=f"Failed to load model {model_id}: {str(e)}")
+    if METRICS_ENABLED:
+        MODEL_REQUESTS.labels(model_id).inc()
+    return lease
+
+def _lease_model(lease):
+    """The registered model a lease serves, or None for the default model's pipeline."""
+    return None if lease.model_id == DEFAULT_MODEL_ID else lease.model
+
+async def _admit(lane):
+    """Admission ticket for work the HTTP middleware does not see, or None with admission control off."""
+    if ADMISSION_MAX_IN_FLIGHT <= 0:
+        return None
+    return await ADMISSION.acquire(lane)
+
+def _check_deadline():
+    """Give up on the request with a 504 once its X-Request-Deadline-Ms budget is spent."""
+    if deadline_expired():
+        raise HTTPException(status_code=504, detail="Request deadline exceeded before inference")
+
+async def _off_loop(fn, *args, **kwargs):
+    """Run CPU-bound image work on DECODE_EXECUTOR, keeping the event loop free for other requests."""
+    return await asyncio.get_running_loop().run_in_executor(DECODE_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+async def _run_model(tensor, model=None):
+    """Raw output for one preprocessed image: micro-batched on the default model, unbatched otherwise."""
+    if model is None:
+        try:
+            return await _get_batcher().submit(tensor, current_deadline())
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+    _check_deadline()
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, _run_session_batch, tensor, model.session)
+
+class _BufferPool:
+    """
+    Lock-protected pool of preallocated ``dtype`` arrays, keyed by shape.
+
+    ``acquire`` hands out an array with undefined contents and ``release``
+    gives it back once it has been consumed; at most ``max_idle`` arrays per
+    shape are retained. One pool serves the event loop and every decode
+    thread alike.
+    """
+
+    def __init__(self, dtype, max_idle):
+        self.dtype = dtype
+        self.max_idle = max_idle
+        self._free = {}  # shape -> idle arrays
+        self._lock = threading.Lock()
+
+    def acquire(self, shape):
+        with self._lock:
+            free = self._free.get(shape)
+            if free:
+                return free.pop()
+        return np.empty(shape, dtype=self.dtype)
+
+    def release(self, array):
+        with self._lock:
+            free = self._free.setdefault(array.shape, [])
+            if len(free) < self.max_idle:
+                free.append(array)
+
+# Letterbox canvases are only used within one preprocess call on a decode
+# thread, so one per decode thread covers every request. Input tensors stay
+# out until the micro-batcher has copied them into its stacked batch, so
+# up to one per admitted request is kept.
+CANVAS_POOL = _BufferPool(np.uint8, DECODE_WORKERS)
+TENSOR_POOL = _BufferPool(np.float32, max(DECODE_WORKERS, ADMISSION_MAX_IN_FLIGHT))
 
-def _letterbox(im, new_shape=(640, 640), color=(114, 114, 114)):
-    """Resize and pad image to new_shape with minimal ratio change."""
+def _letterbox(im, canvas, color=114):
+    """
+    Resize ``im`` with unchanged aspect ratio directly into the padded ``canvas``.
+
+    Only the padding bands are repainted, so a reused canvas never needs a
+    full clear. Returns the scale ratio and the (dw, dh) padding.
+    """
     shape = im.shape[:2]  # current shape [height, width]
-    if isinstance(new_shape, int):
-        new_shape = (new_shape, new_shape)
+    new_shape = canvas.shape[:2]
 
     # Scale ratio (new / old)
     r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
@@ -83,141 +791,1049 @@ def _letterbox(im, new_shape=(640, 640), color=(114, 114, 114)):
     ratio = r, r  # width, height ratios
     new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
     dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]  # wh padding
-    
+
     dw /= 2  # divide padding into 2 sides
     dh /= 2
 
-    if shape[::-1] != new_unpad:  # resize
-        im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
-    
-    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
-    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
-    im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
-    
-    return im, ratio, (dw, dh)
+    top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+    bottom, right = top + new_unpad[1], left + new_unpad[0]
 
-def _non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, max_det=300):
-    """Non-Maximum Suppression (NMS) on inference results."""
-    
-    # Transpose and squeeze
-    prediction = prediction[0]  # Remove batch dimension
-    prediction = prediction.T   # Transpose to (num_boxes, 85)
-    
-    # Filter by confidence
-    conf_mask = prediction[:, 4] > conf_thres
-    prediction = prediction[conf_mask]
-    
-    if not len(prediction):
-        return []
-    
-    # Compute class confidence
-    class_conf = prediction[:, 5:] * prediction[:, 4:5]
-    class_pred = np.argmax(class_conf, axis=1)
-    conf = np.max(class_conf, axis=1)
+    # Repaint the padding bands left over from the previous image
+    canvas[:top] = color
+    canvas[bottom:] = color
+    canvas[top:bottom, :left] = color
+    canvas[top:bottom, right:] = color
+
+    roi = canvas[top:bottom, left:right]
+    if shape[::-1] != new_unpad:  # resize straight into the canvas
+        cv2.resize(im, new_unpad, dst=roi, interpolation=cv2.INTER_LINEAR)
+    else:
+        roi[...] = im
+
+    return ratio, (dw, dh)
+
+def _non_max_suppression(prediction, head=None, **kwargs):
+    """_inference.non_max_suppression, decoding with the loaded model's output head unless ``head`` is given."""
+    return non_max_suppression(prediction, head or _get_output_head(), **kwargs)
+
+# Decoded RGB pixels, original (width, height) after EXIF orientation, and
+# how many original pixels one decoded pixel spans along each axis
+DecodedImage = namedtuple("DecodedImage", ["pixels", "size", "scale"])
+
+EXIF_ORIENTATION_TAG = 0x0112
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+def _decode_image(image_data, target_shape=None):
+    """
+    Decode image bytes at the smallest scale that still covers ``target_shape``.
+
+    JPEGs are decoded with DCT-domain downscaling (PIL ``draft``) by 1/2, 1/4
+    or 1/8 whenever the letterboxed model input would be smaller anyway;
+    other formats fall back to a full decode. EXIF orientation is applied to
+    the already reduced pixels.
+    """
+    target_shape = target_shape or MODEL_INPUT
+    image = Image.open(io.BytesIO(image_data))
+    orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    width, height = image.size
+    swap_axes = orientation in (5, 6, 7, 8)
+    scale = 1.0
+
+    if image.format == "JPEG":
+        oriented_w, oriented_h = (height, width) if swap_axes else (width, height)
+        r = min(target_shape[0] / oriented_h, target_shape[1] / oriented_w)
+        if r < 1:
+            # draft picks the largest reduction whose output is still at least this big
+            drafted = image.draft("RGB", (math.ceil(width * r), math.ceil(height * r)))
+            if drafted is not None:
+                _, box = drafted
+                scale = width / box[2]
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    transpose = EXIF_TRANSPOSE.get(orientation)
+    if transpose is not None:
+        image = image.transpose(transpose)
+
+    if swap_axes:
+        width, height = height, width
+    return DecodedImage(np.asarray(image), (width, height), (scale, scale))
+
+def _frame_thumbnail(image_data, width=None):
+    """
+    Decode a small grayscale thumbnail for frame differencing.
+
+    Returns the float32 thumbnail, ``width`` pixels wide, and the oriented
+    (width, height) of the full image. JPEGs are decoded at 1/8 scale, which
+    costs a fraction of the full decode.
+    """
+    width = width or STREAM_THUMBNAIL_WIDTH
+    image = Image.open(io.BytesIO(image_data))
+    orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    full_width, full_height = image.size
+    image.draft("L", (width, width))
+
+    image = image.convert("L")
+    transpose = EXIF_TRANSPOSE.get(orientation)
+    if transpose is not None:
+        image = image.transpose(transpose)
+        if orientation in (5, 6, 7, 8):
+            full_width, full_height = full_height, full_width
+
+    height = max(1, round(width * full_height / full_width))
+    thumbnail = image.resize((width, height), Image.Resampling.BILINEAR)
+    return np.asarray(thumbnail, dtype=np.float32), (full_width, full_height)
+
+def _preprocess_image(decoded, tensor):
+    """
+    Preprocess a decoded image for YOLO inference into the (1, 3, H, W) ``tensor``.
+
+    The decoded RGB pixels are resized straight into a pooled padded canvas,
+    then normalization, channel reordering and the HWC to CHW layout change
+    happen in a single pass that writes into the input tensor. The returned
+    ratio maps model input coordinates back to the original, full-size image.
+    Runs on a decode thread.
+    """
+    canvas = CANVAS_POOL.acquire((*tensor.shape[2:], 3))
+    try:
+        # Apply letterbox
+        (rx, ry), (dw, dh) = _letterbox(decoded.pixels, canvas)
+
+        # Normalize, reorder channels and transpose in one pass; reversing the
+        # channel axis is only a strided view, so BGR models cost nothing extra
+        pixels = canvas if MODEL_CHANNEL_ORDER == "RGB" else canvas[:, :, ::-1]
+        np.multiply(pixels.transpose(2, 0, 1), np.float32(1.0 / 255.0), out=tensor[0], casting="unsafe")
+    finally:
+        CANVAS_POOL.release(canvas)
+
+    # Fold the reduced-decode scale into the ratio so boxes land on the original
+    ratio = rx / decoded.scale[0], ry / decoded.scale[1]
+    original_shape = decoded.size[1], decoded.size[0]
+    return tensor, ratio, (dw, dh), original_shape
+
+def _postprocess_results(detections, ratios, pads, original_shapes):
+    """
+    Map a batch of detections back to original image coordinates.
+
+    All boxes of the batch are un-letterboxed and clipped in one array
+    operation; ``ratios``, ``pads`` and ``original_shapes`` hold one
+    (x, y), (dw, dh) and (height, width) entry per image.
+    """
+    counts = [len(dets) for dets in detections]
+    if not sum(counts):
+        return detections
+
+    merged = np.concatenate(detections, axis=0)
+    image_index = np.repeat(np.arange(len(detections)), counts)
+
+    gain = np.asarray(ratios, dtype=np.float32)[image_index]          # (n, 2) x, y
+    offset = np.asarray(pads, dtype=np.float32)[image_index]          # (n, 2) dw, dh
+    limit = np.asarray(original_shapes, dtype=np.float32)[image_index][:, ::-1]  # (n, 2) w, h
+
+    # Undo letterbox padding and scaling, then clip to the original image bounds
+    corners = merged[:, :4].reshape(-1, 2, 2)
+    corners -= offset[:, None, :]
+    corners /= gain[:, None, :]
+    np.clip(corners, 0, limit[:, None, :], out=corners)
+    merged[:, :4] = corners.reshape(-1, 4)
+
+    return np.split(merged, np.cumsum(counts)[:-1])
+
+def _detections_to_results(detections, class_names=None):
+    """Convert an (n, 6) detection array into the JSON result dicts, naming classes from ``class_names``."""
+    class_names = CLASS_NAMES_ARRAY if class_names is None else class_names
+    class_ids = detections[:, 5].astype(np.int64)
+    names = np.where(class_ids < len(class_names), class_names[np.minimum(class_ids, len(class_names) - 1)], "unknown")
+
+    return [
+        {"bbox": bbox, "confidence": confidence, "class_id": class_id, "class_name": class_name}
+        for bbox, confidence, class_id, class_name in zip(
+            detections[:, :4].tolist(), detections[:, 4].tolist(), class_ids.tolist(), names.tolist()
+        )
+    ]
+
+def _oriented_size(image_data):
+    """(width, height) of encoded image bytes after EXIF orientation, from the header only."""
+    image = Image.open(io.BytesIO(image_data))
+    width, height = image.size
+    if image.getexif().get(EXIF_ORIENTATION_TAG, 1) in (5, 6, 7, 8):
+        width, height = height, width
+    return width, height
+
+def _tile_starts(length, tile, overlap):
+    """Start offsets of tiles covering ``length`` pixels with at least ``overlap`` shared."""
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - tile) / (tile * (1 - overlap))) + 1
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+def _tile_layout(size, tile_shape):
+    """
+    Working size and tile boxes for an image of ``size`` (w, h).
+
+    The image is downscaled (never upscaled) until its tile grid fits in
+    TILE_MAX_COUNT tiles. Boxes are (x0, y0, x1, y1) in working pixels.
+    """
+    width, height = size
+    tile_h, tile_w = tile_shape
+    scale = 1.0
+    while True:
+        working_w, working_h = max(1, round(width * scale)), max(1, round(height * scale))
+        xs = _tile_starts(working_w, tile_w, TILE_OVERLAP)
+        ys = _tile_starts(working_h, tile_h, TILE_OVERLAP)
+        if len(xs) * len(ys) <= TILE_MAX_COUNT:
+            break
+        scale *= 0.9
+
+    boxes = [(x, y, min(x + tile_w, working_w), min(y + tile_h, working_h)) for y in ys for x in xs]
+    return (working_w, working_h), boxes
+
+def _decode_working_image(image_data, working_size):
+    """Decode ``image_data`` at exactly ``working_size`` (w, h), with the scale back to the original."""
+    working_w, working_h = working_size
+    decoded = _decode_image(image_data, (working_h, working_w))
+    pixels = decoded.pixels
+    if pixels.shape[:2] != (working_h, working_w):
+        pixels = cv2.resize(pixels, (working_w, working_h), interpolation=cv2.INTER_AREA)
+    return DecodedImage(pixels, decoded.size, (decoded.size[0] / working_w, decoded.size[1] / working_h))
+
+def _merge_tile_detections(detections, match_thres=0.5, max_det=300):
+    """
+    Fuse (n, 6) detections gathered from overlapping tiles.
+
+    Boxes are taken by confidence; each absorbs the remaining same-class boxes
+    that cover more than ``match_thres`` of the smaller box and grows to
+    their union. Intersection over the smaller box (rather than IoU) also
+    joins the partial box of an object cut at a tile border with its full
+    box from the neighbouring tile or the full view.
+    """
+    detections = detections[np.argsort(-detections[:, 4], kind="stable")]
+    x1, y1, x2, y2 = detections[:, 0], detections[:, 1], detections[:, 2], detections[:, 3]
+    areas = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    alive = np.ones(len(detections), dtype=bool)
+    merged = []
+
+    for i in range(len(detections)):
+        if not alive[i]:
+            continue
+        alive[i] = False
+        inter = (np.clip(np.minimum(x2[i], x2) - np.maximum(x1[i], x1), 0, None) *
+                 np.clip(np.minimum(y2[i], y2) - np.maximum(y1[i], y1), 0, None))
+        overlap = inter / np.maximum(np.minimum(areas[i], areas), 1e-6)
+        absorbed = alive & (detections[:, 5] == detections[i, 5]) & (overlap > match_thres)
+
+        box = detections[i].copy()
+        if absorbed.any():
+            box[:2] = np.minimum(box[:2], detections[absorbed, :2].min(axis=0))
+            box[2:4] = np.maximum(box[2:4], detections[absorbed, 2:4].max(axis=0))
+            alive &= ~absorbed
+        merged.append(box)
+        if len(merged) >= max_det:
+            break
+
+    return np.stack(merged) if merged else np.zeros((0, 6), dtype=np.float32)
+
+async def _detect_tile(view, input_shape, classes=None, model=None):
+    """Letterbox and run one tile; returns its detections in tile coordinates."""
+    if WORKER_POOL is not None and model is None:
+        lease = await WORKER_POOL.acquire()
+        try:
+            _, ratio, pad, shape = await _off_loop(_preprocess_image, view, lease.tensor(input_shape))
+            _check_deadline()
+            detections = await WORKER_POOL.run(lease, input_shape, classes)
+        finally:
+            WORKER_POOL.release(lease)
+    else:
+        tensor = TENSOR_POOL.acquire((1, 3, *input_shape))
+        try:
+            _, ratio, pad, shape = await _off_loop(_preprocess_image, view, tensor)
+            prediction = await _run_model(tensor, model)
+        finally:
+            TENSOR_POOL.release(tensor)
+        detections = (await _off_loop(_non_max_suppression, prediction, conf_thres=CONF_THRES,
+                                      iou_thres=IOU_THRES, classes=classes,
+                                      head=None if model is None else model.head))[0]
+    return (await _off_loop(_postprocess_results, [detections], [ratio], [pad], [shape]))[0]
+
+async def _detect_tiled(image_data, imgsz, classes=None, model=None):
+    """
+    Tiled detection for large photos whose small objects vanish in a single letterbox.
+
+    The image is cut into overlapping tiles of the model input size. The
+    tiles run concurrently, sharing micro-batches or spread over the worker
+    processes, together with one letterboxed full view for objects larger
+    than a tile. Their boxes are mapped to original coordinates and fused
+    across tiles. Returns the ``_detect`` payload plus the tile count.
+    """
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    input_shape = _resolve_input_shape(None, imgsz, session=None if model is None else model.session)
+    try:
+        with stage("decode"):
+            original_size = _oriented_size(image_data)
+            working_size, boxes = _tile_layout(original_size, input_shape)
+            decoded = await loop.run_in_executor(DECODE_EXECUTOR, _decode_working_image, image_data, working_size)
+        logger.info(f"Image loaded successfully: {original_size}, {len(boxes)} tiles at {working_size}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image format: {str(e)}")
+
+    # A single tile already is the full view
+    sx, sy = decoded.scale
+    views, offsets = ([decoded], [(0.0, 0.0)]) if len(boxes) > 1 else ([], [])
+    for x0, y0, x1, y1 in boxes:
+        views.append(DecodedImage(decoded.pixels[y0:y1, x0:x1], ((x1 - x0) * sx, (y1 - y0) * sy), decoded.scale))
+        offsets.append((x0 * sx, y0 * sy))
+
+    try:
+        with stage("tiles"):
+            detections = await asyncio.gather(*[_detect_tile(view, input_shape, classes, model) for view in views])
+    except WorkerError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    with stage("merge"):
+        for dets, (ox, oy) in zip(detections, offsets):
+            dets[:, [0, 2]] += ox
+            dets[:, [1, 3]] += oy
+        merged = await _off_loop(_merge_tile_detections, np.concatenate(detections), TILE_MATCH_THRES)
+        final_results = await _off_loop(_detections_to_results, merged, None if model is None else model.class_array)
+
+    if METRICS_ENABLED:
+        DETECTIONS_PER_IMAGE.observe(len(final_results))
+        TILES_PER_IMAGE.observe(len(boxes))
+        megapixels = original_size[0] * original_size[1] / 1e6
+        TILED_SECONDS_PER_MEGAPIXEL.observe((time.perf_counter() - started) / max(megapixels, 1e-6))
+
+    logger.info(f"Tiled detection completed: {len(final_results)} objects found in {len(boxes)} tiles")
+    return {
+        "results": final_results,
+        "image_size": list(original_size),
+        "input_size": [input_shape[1], input_shape[0]],
+        "tiles": len(boxes),
+    }
+
+async def _detect(image_data, imgsz, rect=False, use_cache=True, classes=None, tiled=False, model=None):
+    """
+    Run the detection pipeline on encoded image bytes.
+
+    Only the class indices in ``classes`` are detected when it is given;
+    ``tiled`` switches to ``_detect_tiled`` (``rect`` does not apply there).
+    ``model`` is a registered model leased by the caller; without one the
+    default model runs, batched or on the worker pool.
+    Returns a dict with ``results``, ``image_size`` and ``input_size`` (both
+    [width, height]) and ``cached``. Undecodable images raise a 400
+    HTTPException.
+    """
+    # Wait for the model if this request arrived before warm-up finished
+    await _ensure_ready()
+
+    # Identical bytes with identical settings skip decode and inference
+    cache_key = None
+    if use_cache and RESULT_CACHE.enabled:
+        with stage("cache"):
+            model_sha256 = MODEL_STATE["sha256"] if model is None else model.sha256
+            cache_key = await _off_loop(make_cache_key, image_data, model_sha256, CONF_THRES, IOU_THRES,
+                                        (imgsz, imgsz), rect, classes,
+                                        (TILE_OVERLAP, TILE_MAX_COUNT, TILE_MATCH_THRES) if tiled else None)
+            cached = await RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            logger.info(f"Detection served from cache: {len(cached['results'])} objects")
+            return {
+                "results": cached["results"],
+                "image_size": cached["image_size"],
+                "input_size": cached.get("input_size"),
+                **({"tiles": cached["tiles"]} if "tiles" in cached else {}),
+                "cached": True
+            }
+
+    # Queued past its deadline: the client has given up, skip the work
+    _check_deadline()
+
+    if tiled:
+        payload = await _detect_tiled(image_data, imgsz, classes, model)
+        if cache_key is not None:
+            await RESULT_CACHE.put(cache_key, payload)
+        return {**payload, "cached": False}
+
+    # Decode at reduced resolution where the format allows it; this and the
+    # other image stages run on the decode threads, not the event loop
+    try:
+        with stage("decode"):
+            decoded = await _off_loop(_decode_image, image_data, (imgsz, imgsz))
+        original_size = decoded.size  # (width, height)
+        logger.info(f"Image loaded successfully: {original_size}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image format: {str(e)}")
+
+    # Preprocess image into a pooled input tensor
+    input_shape = _resolve_input_shape(original_size, imgsz, rect, None if model is None else model.session)
+    if WORKER_POOL is not None and model is None:
+        # Letterbox straight into a worker's shared-memory slot; the worker
+        # runs the session and NMS and returns only the detections
+        try:
+            lease = await WORKER_POOL.acquire()
+        except WorkerError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        try:
+            with stage("preprocess"):
+                _, ratio, pad, original_shape = await _off_loop(_preprocess_image, decoded, lease.tensor(input_shape))
+            with stage("inference"):
+                _check_deadline()
+                detections = [await WORKER_POOL.run(lease, input_shape, classes)]
+        except WorkerError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        finally:
+            WORKER_POOL.release(lease)
+    else:
+        img_input = TENSOR_POOL.acquire((1, 3, *input_shape))
+        try:
+            with stage("preprocess"):
+                _, ratio, pad, original_shape = await _off_loop(_preprocess_image, decoded, img_input)
+
+            # Run inference, batched together with concurrent requests; includes
+            # the time spent waiting for the batch to fill and for an executor slot
+            with stage("inference"):
+                prediction = await _run_model(img_input, model)
+        finally:
+            TENSOR_POOL.release(img_input)
+
+        with stage("nms"):
+            detections = await _off_loop(_non_max_suppression, prediction, conf_thres=CONF_THRES,
+                                         iou_thres=IOU_THRES, classes=classes,
+                                         head=None if model is None else model.head)
+
+    # Post-process results
+    with stage("postprocess"):
+        detections = await _off_loop(_postprocess_results, detections, [ratio], [pad], [original_shape])
+        final_results = await _off_loop(_detections_to_results, detections[0],
+                                        None if model is None else model.class_array)
+    if METRICS_ENABLED:
+        DETECTIONS_PER_IMAGE.observe(len(final_results))
+
+    logger.info(f"Detection completed: {len(final_results)} objects found")
+
+    payload = {
+        "results": final_results,
+        "image_size": list(original_size),
+        "input_size": [input_shape[1], input_shape[0]],
+    }
+    if cache_key is not None:
+        await RESULT_CACHE.put(cache_key, payload)
+
+    return {**payload, "cached": False}
+
+def _log_detections(results, source, user_mode="kid", session_id=None):
+    """Queue ``results`` for the detections table; a no-op without a database."""
+    DETECTION_LOG.record(
+        (result["class_name"], result["confidence"], source, user_mode, session_id, *result["bbox"])
+        for result in results
+    )
+
+def _class_filter(profile=None, classes=None, model=None):
+    """Class indices of ``model`` selected by the ``profile``/``classes`` request fields; 400 when invalid."""
+    profiles, class_names = (CLASS_PROFILES, CLASS_NAMES) if model is None else (model.profiles, model.class_names)
+    try:
+        return resolve_class_filter(profiles, class_names, profile, classes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _prepare_batch_item(image_data, input_shape, tensor):
+    """Decode and letterbox one image straight into its slot of a batch tensor."""
+    decoded = _decode_image(image_data, input_shape)
+    _, ratio, pad, original_shape = _preprocess_image(decoded, tensor)
+    return ratio, pad, original_shape
+
+def _detach_upload(upload):
+    """
+    Take ownership of an UploadFile's spooled file.
+
+    FastAPI closes request files as soon as the endpoint returns, before a
+    streaming response body runs; swapping in an empty file keeps ours open
+    until the stream has consumed it.
+    """
+    file, upload.file = upload.file, io.BytesIO()
+    return upload.filename, file
+
+async def _iter_batch_uploads(files, archive, urls=()):
+    """Yield (filename, bytes or error) for every uploaded file, every archive member, then every URL."""
+    for filename, file in files:
+        yield filename, await asyncio.to_thread(file.read)
+        file.close()
+
+    if archive is not None:
+        members = iter(archive)
+        while True:
+            entry = await asyncio.to_thread(next, members, None)
+            if entry is None:
+                break
+            yield entry
+
+    # Downloads run ahead of the batches, a bounded number at a time
+    async for url, data in FETCHER.fetch_many(urls, FETCH_BATCH_CONCURRENCY):
+        yield url, data
+
+async def _detect_batch(batch, rows, classes=None, model=None):
+    """NMS-decoded detections for ``rows`` of a preprocessed batch tensor, from ``model`` or the default model."""
+    _check_deadline()
+    if WORKER_POOL is None or model is not None:
+        session, head = (None, None) if model is None else (model.session, model.head)
+        outputs = await asyncio.get_running_loop().run_in_executor(EXECUTOR, _run_session_batch, batch, session)
+        return await _off_loop(_non_max_suppression, outputs[rows], conf_thres=CONF_THRES, iou_thres=IOU_THRES,
+                               classes=classes, head=head)
+
+    # Spread the images over the worker slots; each worker batches what it receives
+    input_shape = batch.shape[2:]
+
+    async def run(row):
+        lease = await WORKER_POOL.acquire()
+        try:
+            lease.tensor(input_shape)[...] = batch[row:row + 1]
+            return await WORKER_POOL.run(lease, input_shape, classes)
+        finally:
+            WORKER_POOL.release(lease)
+
+    return await asyncio.gather(*[run(row) for row in rows])
+
+async def _stream_batch(uploads, imgsz, files=(), archive=None, classes=None, lease=None):
+    """
+    Run uploaded images through the session in fixed-size batches, yielding NDJSON lines.
+
+    Images are decoded on DECODE_EXECUTOR directly into one of two
+    preallocated batch tensors, so the next batch is decoded while the
+    current one runs. At most two batches of images are held at any time,
+    however many images the request contains. ``lease`` is the request's
+    model lease, released once the stream ends.
+    """
+    model = _lease_model(lease) if lease is not None else None
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    summary = {"images": 0, "succeeded": 0, "failed": 0, "batches": 0}
+
+    def line(payload):
+        return dumps_json(payload) + b"\n"
+
+    try:
+        if model is not None:
+            batch_size = model_batch_size(model.session) or BATCH_MAX_SIZE
+        else:
+            await _ensure_ready()
+            batch_size = _get_batcher().max_batch_size if WORKER_POOL is None else BATCH_MAX_SIZE
+        input_shape = _resolve_input_shape(None, imgsz, session=None if model is None else model.session)
+        tensors = [np.empty((batch_size, 3) + input_shape, dtype=np.float32) for _ in range(2)]
+
+        async def decode_batch(entries, tensor):
+            async def decode(slot, data):
+                if isinstance(data, Exception):
+                    return data
+                try:
+                    return await loop.run_in_executor(
+                        DECODE_EXECUTOR, _prepare_batch_item, data, input_shape, tensor[slot:slot + 1])
+                except Exception as e:
+                    return ArchiveError(f"Invalid image format: {str(e)}")
+
+            return await asyncio.gather(*[decode(slot, data) for slot, (_, _, data) in enumerate(entries)])
+
+        def finish_batch(entries, prepared, detections):
+            ok = [slot for slot, item in enumerate(prepared) if not isinstance(item, Exception)]
+            detections = _postprocess_results(detections, *zip(*[prepared[slot] for slot in ok]))
+            for slot, dets in zip(ok, detections):
+                index, filename, _ = entries[slot]
+                ratio, pad, (height, width) = prepared[slot]
+                results = _detections_to_results(dets, None if model is None else model.class_array)
+                if METRICS_ENABLED:
+                    DETECTIONS_PER_IMAGE.observe(len(results))
+                summary["succeeded"] += 1
+                yield line({
+                    "index": index,
+                    "filename": filename,
+                    "success": True,
+                    "results": results,
+                    "image_size": [width, height],
+                    "detections_count": len(results),
+                    "input_size": [input_shape[1], input_shape[0]]
+                })
+
+        uploads = uploads.__aiter__()
+        pending = None  # (entries, prepared, inference task) of the batch in flight
+        exhausted = False
+        while True:
+            entries = []
+            while not exhausted and len(entries) < batch_size:
+                try:
+                    filename, data = await uploads.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                if summary["images"] >= BATCH_UPLOAD_MAX_IMAGES:
+                    yield line({"success": False, "error": f"Only the first {BATCH_UPLOAD_MAX_IMAGES} images are processed"})
+                    exhausted = True
+                    break
+                if not isinstance(data, Exception) and len(data) > BATCH_UPLOAD_MAX_IMAGE_BYTES:
+                    data = ArchiveError(f"Image is larger than {BATCH_UPLOAD_MAX_IMAGE_BYTES} bytes")
+                entries.append((summary["images"], filename, data))
+                summary["images"] += 1
+
+            tensor = tensors[summary["batches"] % 2]
+            decoding = loop.create_task(decode_batch(entries, tensor)) if entries else None
+
+            # Report the batch in flight while this one decodes
+            if pending is not None:
+                done_entries, done_prepared, task = pending
+                pending = None
+                try:
+                    detections = await task
+                except Exception as e:
+                    logger.error(f"Batch inference failed: {str(e)}")
+                    for slot, item in enumerate(done_prepared):
+                        if not isinstance(item, Exception):
+                            done_prepared[slot] = e
+                            summary["failed"] += 1
+                            index, filename, _ = done_entries[slot]
+                            yield line({"index": index, "filename": filename, "success": False,
+                                        "error": f"Inference failed: {str(e)}"})
+                else:
+                    for output in finish_batch(done_entries, done_prepared, detections):
+                        yield output
+
+            if decoding is None:
+                break
+
+            prepared = await decoding
+            for (index, filename, _), item in zip(entries, prepared):
+                if isinstance(item, Exception):
+                    summary["failed"] += 1
+                    yield line({"index": index, "filename": filename, "success": False, "error": str(item)})
+
+            ok = [slot for slot, item in enumerate(prepared) if not isinstance(item, Exception)]
+            if ok:
+                task = loop.create_task(_detect_batch(tensor[:len(entries)], ok, classes, model))
+                pending = (entries, prepared, task)
+                summary["batches"] += 1
+
+        summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000.0, 2)
+        logger.info(f"Batch upload completed: {summary}")
+        yield line({"summary": summary})
+    finally:
+        # Cancels downloads still running ahead when the stream stops early
+        await uploads.aclose()
+        for _, file in files:
+            file.close()
+        if archive is not None:
+            archive.close()
+        if lease is not None:
+            lease.release()
+
+@app.on_event("startup")
+async def startup():
+    """Load and warm up the model in the background so health checks stay responsive."""
+    if MODEL_EAGER_LOAD:
+        asyncio.get_running_loop().create_task(_prepare_in_background())
+    DETECTION_LOG.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Write out queued detection logs, close pooled HTTP connections and stop inference workers."""
+    await DETECTION_LOG.close()
+    await DB.close()
+    await FETCHER.aclose()
+    if WORKER_POOL is not None:
+        await asyncio.get_running_loop().run_in_executor(None, WORKER_POOL.close)
+
+async def _prepare_in_background():
+    try:
+        await _ensure_ready()
+    except Exception:
+        # Already logged; /api/ready reports the failure and requests retry
+        pass
+
+# Open webcam streams by session id, for /api/infer/streams
+STREAM_SESSIONS = {}
+
+@app.get("/")
+async def root():
+    """Health check endpoint."""
+    return {"message": "Kids B-Care Object Detection API", "status": "healthy"}
+
+@app.get("/api/ready")
+async def ready():
+    """Readiness probe: 200 only once the model is loaded and warmed up."""
+    status_code = 200 if MODEL_STATE["status"] == "ready" else 503
+    return JSONResponse({"ready": status_code == 200, "model": MODEL_STATE}, status_code=status_code)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/status")
+async def status():
+    """Report concurrency, thread and session settings for sizing pods."""
+    model = WORKER_POOL if WORKER_POOL is not None else SESSION
+    return {
+        "success": True,
+        "model_loaded": model is not None,
+        "model": MODEL_STATE,
+        "cpu_count": os.cpu_count(),
+        "executor": {
+            "workers": EXECUTOR_WORKERS,
+            "batches_in_flight": BATCHER.batches_in_flight if BATCHER is not None else 0,
+            "decode_workers": DECODE_WORKERS,
+        },
+        "session_options": {
+            "intra_op_num_threads": ORT_INTRA_OP_THREADS,
+            "inter_op_num_threads": ORT_INTER_OP_THREADS,
+            "graph_optimization_level": ORT_GRAPH_OPTIMIZATION,
+            "execution_mode": ORT_EXECUTION_MODE,
+            "enable_cpu_mem_arena": ORT_ENABLE_MEM_ARENA,
+            "providers": SESSION.get_providers() if SESSION is not None else [],
+            "worker_processes": WORKER_PROCESSES,
+        },
+        "image_fetch": FETCHER.stats(),
+        "result_cache": RESULT_CACHE.stats(),
+        "batching": {"max_batch_size": BATCHER.max_batch_size if BATCHER is not None else BATCH_MAX_SIZE,
+                     "max_wait_ms": BATCH_MAX_WAIT_MS},
+        "input_sizes": MODEL_INPUT_SIZES,
+        "default_input_size": MODEL_INPUT_SIZE,
+        "fixed_input_shape": model_fixed_input_shape(model) if model is not None else None,
+        "worker_pool": WORKER_POOL.stats() if WORKER_POOL is not None else None,
+        "models": MODELS.stats(),
+        "detection_log": DETECTION_LOG.stats(),
+        "database": DB.stats(),
+        "admission": ADMISSION.stats() if ADMISSION_MAX_IN_FLIGHT > 0 else None,
+    }
+
+@app.get("/api/models")
+async def list_models():
+    """Every servable model id with its version, load time, resident size and request counters."""
+    return {"success": True, "default": DEFAULT_MODEL_ID, **MODELS.stats()}
+
+@app.post("/api/models/{model_id}/reload")
+async def reload_model(model_id: str, x_admin_token: str = Header(None)):
+    """
+    Hot-swap a model to the current version of its source.
+
+    Registered models re-read MODEL_REGISTRY (which may also add new ids);
+    the default model re-reads its model file. The new version is loaded
+    next to the old one and replaces it in one step, so requests in flight
+    finish on the version they started with. A registered model that is not
+    loaded only picks up its new source. Requires MODEL_ADMIN_TOKEN.
+    """
+    if not MODEL_ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", MODEL_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Model reloads need a valid X-Admin-Token")
+
+    try:
+        if model_id == DEFAULT_MODEL_ID:
+            await _ensure_ready()
+            version = await asyncio.to_thread(_reload_default_model)
+        else:
+            sources = _read_model_registry()
+            if model_id not in sources:
+                raise HTTPException(status_code=404, detail=f"Unknown model '{model_id}'")
+            for registered_id, source in sources.items():
+                if registered_id not in MODELS:
+                    MODELS.register(registered_id, source)
+            version = await asyncio.to_thread(MODELS.swap, model_id, sources[model_id])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Reload of model {model_id} failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Reload failed: {str(e)}")
+    return {"success": True, "model": model_id, "version": version, "loaded": version is not None}
+
+@app.get("/api/infer/batching")
+async def batching_stats():
+    """Micro-batching configuration with batch-size and wait-time histograms."""
+    if BATCHER is None:
+        return {
+            "success": True,
+            "batching": {"max_batch_size": BATCH_MAX_SIZE, "max_wait_ms": BATCH_MAX_WAIT_MS, "batches_run": 0}
+        }
+    return {"success": True, "batching": BATCHER.stats()}
+
+async def _class_source(model_id):
+    """The model whose class table a request for ``model_id`` reads; only registered models are loaded."""
+    if not model_id or model_id == DEFAULT_MODEL_ID:
+        return _default_serving_model(SESSION)
+    with await _acquire_model(model_id) as lease:
+        return lease.model
+
+@app.get("/api/infer/classes")
+async def class_table(model: str = None):
+    """Class table of a model that ``class_id`` values index into, with its id from binary responses."""
+    served = await _class_source(model)
+    return {"success": True, "classes": list(served.class_names), "class_table_id": served.table_id}
+
+@app.get("/api/infer/profiles")
+async def class_profiles(model: str = None):
+    """Class names of every named profile accepted by ``profile`` for a model."""
+    served = await _class_source(model)
+    return {
+        "success": True,
+        "profiles": {name: served.class_array[indices].tolist() for name, indices in served.profiles.items()}
+    }
+
+@app.get("/api/infer/streams")
+async def stream_stats():
+    """FPS and dropped-frame counters of every open streaming session."""
+    return {"success": True, "streams": [session.stats() for session in STREAM_SESSIONS.values()]}
+
+@app.websocket("/api/infer/stream")
+async def infer_stream(websocket: WebSocket, imgsz: int = None, rect: bool = False,
+                       temporal: bool = None, keyframe_interval: int = None,
+                       profile: str = None, classes: str = None, log: bool = False,
+                       user_mode: str = "kid", session_id: str = None, model: str = None):
+    """
+    Streaming object detection for webcam sessions.
     
-    # Filter by confidence again
-    conf_mask = conf > conf_thres
-    prediction = prediction[conf_mask]
-    class_pred = class_pred[conf_mask]
-    conf = conf[conf_mask]
+    The client sends each frame as a binary message holding an encoded image
+    and receives one JSON message per processed frame with its detections and
+    the session's frame counters. When frames arrive faster than they can be
+    processed, only the newest pending frame is kept; skipped frames are
+    counted in ``frames_dropped`` and never answered.
     
-    if not len(prediction):
-        return []
+    With temporal reuse, frames that barely differ from the last keyframe are
+    answered without running the model: boxes are reused or shifted by the
+    estimated camera motion and carry a ``track_id``. Each reply's ``mode``
+    is ``detect``, ``track`` or ``reuse``.
     
-    # Convert xywh to xyxy
-    box = prediction[:, :4].copy()
-    box[:, 0] = prediction[:, 0] - prediction[:, 2] / 2  # x1
-    box[:, 1] = prediction[:, 1] - prediction[:, 3] / 2  # y1
-    box[:, 2] = prediction[:, 0] + prediction[:, 2] / 2  # x2
-    box[:, 3] = prediction[:, 1] + prediction[:, 3] / 2  # y2
+    Query parameters:
+        imgsz: Model input size, one of MODEL_INPUT_SIZES (default: MODEL_INPUT_SIZE)
+        rect: Pad only to the stride multiple instead of a full square
+        temporal: Enable temporal reuse (default: STREAM_TEMPORAL_REUSE)
+        keyframe_interval: Frames per full detection (default: STREAM_KEYFRAME_INTERVAL)
+        profile: Only detect the classes of this named profile (food, safety, toys)
+        classes: Only detect these comma-separated class names or ids
+        log: Record the detections of every fully detected frame (not the
+            reused or tracked ones) in the detections table
+        user_mode: user_mode column of logged detections
+        session_id: session_id column of logged detections (default: stream id)
+        model: Id of the model to run (see /api/models; default: MODEL_ID)
+    """
+    await websocket.accept()
+    if imgsz is not None and imgsz not in MODEL_INPUT_SIZES:
+        await websocket.send_json({"success": False, "error": f"imgsz must be one of {MODEL_INPUT_SIZES}"})
+        await websocket.close(code=1008)
+        return
+    if keyframe_interval is not None and keyframe_interval < 1:
+        await websocket.send_json({"success": False, "error": "keyframe_interval must be at least 1"})
+        await websocket.close(code=1008)
+        return
+    try:
+        with await _acquire_model(model) as lease:
+            class_filter = _class_filter(profile, classes, _lease_model(lease))
+    except HTTPException as e:
+        await websocket.send_json({"success": False, "error": e.detail})
+        await websocket.close(code=1008)
+        return
     
-    # Apply NMS
-    indices = cv2.dnn.NMSBoxes(
-        box.tolist(),
-        conf.tolist(),
-        conf_thres,
-        iou_thres
-    )
+    client = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else None
+    session = StreamSession(imgsz or MODEL_INPUT_SIZE, rect, client)
+    if STREAM_TEMPORAL_REUSE if temporal is None else temporal:
+        session.tracker = TemporalTracker(keyframe_interval or STREAM_KEYFRAME_INTERVAL)
+    STREAM_SESSIONS[session.id] = session
+    send_lock = asyncio.Lock()
+    logger.info(f"Stream {session.id} opened from {client}")
     
-    if len(indices) == 0:
-        return []
+    async def send(message):
+        async with send_lock:
+            await websocket.send_text(dumps_json(message).decode())
     
-    # Format results
-    results = []
-    for i in indices.flatten():
-        results.append({
-            "bbox": box[i].tolist(),
-            "confidence": float(conf[i]),
-            "class_id": int(class_pred[i]),
-            "class_name": CLASS_NAMES[class_pred[i]] if class_pred[i] < len(CLASS_NAMES) else "unknown"
-        })
+    async def process_frames():
+        while True:
+            pending = await session.next_frame()
+            if pending is None:
+                return
+            index, frame, received_at = pending
+            mode, results, thumbnail = "detect", None, None
+            if session.tracker is not None:
+                # Decode and motion estimation run on the decode threads, so one
+                # busy stream does not hold up the others or any HTTP request
+                try:
+                    thumbnail, image_size = await _off_loop(_frame_thumbnail, frame)
+                    mode, results = await _off_loop(session.tracker.step, thumbnail, image_size)
+                except Exception:
+                    # Let the full decode below report the broken frame
+                    thumbnail = None
+            
+            if mode == "detect":
+                # Frames share the webcam lane with HTTP webcam uploads and
+                # are the first to be turned away under load
+                try:
+                    ticket = await _admit("webcam")
+                except Rejected as e:
+                    session.frame_done(received_at, ok=False)
+                    await send({"success": False, "frame": index, "error": str(e), "retry_after": e.retry_after,
+                                "stream": session.stats()})
+                    continue
+                try:
+                    # Frames are unique, so the result cache would only churn;
+                    # each frame leases the model so a hot swap applies mid-stream
+                    with await _acquire_model(model) as lease:
+                        payload = await _detect(frame, session.imgsz, session.rect, use_cache=False,
+                                                classes=class_filter, model=_lease_model(lease))
+                except HTTPException as e:
+                    session.frame_done(received_at, ok=False)
+                    await send({"success": False, "frame": index, "error": e.detail, "stream": session.stats()})
+                    continue
+                finally:
+                    if ticket is not None:
+                        ticket.release()
+                results = payload["results"]
+                if log:
+                    _log_detections(results, "webcam", user_mode, session_id or session.id)
+                if thumbnail is not None:
+                    results = session.tracker.keyframe(thumbnail, image_size, results)
+                image_size, input_size = payload["image_size"], payload["input_size"]
+            else:
+                image_size, input_size = list(image_size), None
+            
+            session.frame_done(received_at)
+            await send({
+                "success": True,
+                "frame": index,
+                "mode": mode,
+                "results": results,
+                "image_size": image_size,
+                "detections_count": len(results),
+                "input_size": input_size,
+                "stream": session.stats()
+            })
     
-    return results
+    processor = asyncio.create_task(process_frames())
+    try:
+        while not processor.done():
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                session.offer(message["bytes"])
+            else:
+                await send({"success": False, "error": "Frames must be sent as binary messages"})
+    except Exception as e:
+        logger.warning(f"Stream {session.id} receive failed: {str(e)}")
+    finally:
+        session.close()
+        try:
+            await processor
+        except Exception as e:
+            # The client is usually gone by now; sending the last result failed
+            logger.debug(f"Stream {session.id} processor stopped: {str(e)}")
+        STREAM_SESSIONS.pop(session.id, None)
+        logger.info(f"Stream {session.id} closed: {session.stats()}")
 
-def _preprocess_image(image: Image.Image):
-    """Preprocess image for YOLO inference."""
-    # Convert to RGB and then to BGR for OpenCV
-    img_rgb = np.array(image.convert("RGB"))
-    img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
-    
-    # Apply letterbox
-    img_resized, ratio, (dw, dh) = _letterbox(img_bgr, MODEL_INPUT)
-    
-    # Normalize and transpose
-    img_input = img_resized.astype(np.float32) / 255.0
-    img_input = np.transpose(img_input, (2, 0, 1))  # HWC to CHW
-    img_input = np.expand_dims(img_input, axis=0)   # Add batch dimension
+@app.post("/api/infer/batch")
+async def infer_batch(
+    images: list[UploadFile] = File(None),
+    archive: UploadFile = File(None),
+    image_urls: list[str] = Form(None),
+    imgsz: int = Form(None),
+    profile: str = Form(None),
+    classes: str = Form(None),
+    model: str = Form(None)
+):
+    """
+    Perform object detection on many images in one request.
     
-    return img_input, ratio, (dw, dh), img_bgr.shape[:2]
-
-def _postprocess_results(results, ratio, pad, original_shape):
-    """Post-process detection results to original image coordinates."""
-    if not results:
-        return results
+    Args:
+        images: Any number of uploaded image files (multipart/form-data)
+        archive: A zip or tar (optionally gzip/bz2/xz compressed) file of images
+        image_urls: Any number of image URLs, downloaded concurrently
+            (IMAGE_FETCH_BATCH_CONCURRENCY at a time); their lines carry the
+            URL as ``filename``
+        imgsz: Model input size, one of MODEL_INPUT_SIZES (default: MODEL_INPUT_SIZE)
+        profile: Only detect the classes of this named profile (food, safety, toys)
+        classes: Only detect these comma-separated class names or ids
+        model: Id of the model to run (see /api/models; default: MODEL_ID)
     
-    dw, dh = pad
-    r = ratio[0]
+    Returns:
+        NDJSON stream with one line per image, written as soon as its batch
+        finishes, followed by a ``summary`` line. Every image is letterboxed
+        to the same square input so they can share batches.
+    """
+    if not images and archive is None and not image_urls:
+        raise HTTPException(
+            status_code=400,
+            detail="Please provide image files, an archive or image URLs"
+        )
+    if imgsz is not None and imgsz not in MODEL_INPUT_SIZES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"imgsz must be one of {MODEL_INPUT_SIZES}"
+        )
+    lease = await _acquire_model(model)
+    try:
+        class_filter = _class_filter(profile, classes, _lease_model(lease))
+    except HTTPException:
+        lease.release()
+        raise
     
-    processed_results = []
-    for result in results:
-        bbox = result["bbox"]
-        
-        # Undo letterbox padding
-        bbox[0] = (bbox[0] - dw) / r  # x1
-        bbox[1] = (bbox[1] - dh) / r  # y1
-        bbox[2] = (bbox[2] - dw) / r  # x2
-        bbox[3] = (bbox[3] - dh) / r  # y2
-        
-        # Clip to original image bounds
-        bbox[0] = max(0, min(bbox[0], original_shape[1]))
-        bbox[1] = max(0, min(bbox[1], original_shape[0]))
-        bbox[2] = max(0, min(bbox[2], original_shape[1]))
-        bbox[3] = max(0, min(bbox[3], original_shape[0]))
-        
-        processed_results.append({
-            **result,
-            "bbox": bbox
-        })
+    files = [_detach_upload(image) for image in images or []]
+    opened = None
+    if archive is not None:
+        _, archive_file = _detach_upload(archive)
+        try:
+            opened = await asyncio.to_thread(ImageArchive, archive_file, BATCH_UPLOAD_MAX_IMAGE_BYTES)
+        except ArchiveError as e:
+            for _, file in files:
+                file.close()
+            lease.release()
+            raise HTTPException(status_code=400, detail=str(e))
+        logger.info(f"Processing image archive: {archive.filename}")
     
-    return processed_results
-
-@app.get("/")
-async def root():
-    """Health check endpoint."""
-    return {"message": "Kids B-Care Object Detection API", "status": "healthy"}
+    return StreamingResponse(
+        _stream_batch(_iter_batch_uploads(files, opened, image_urls or ()), imgsz or MODEL_INPUT_SIZE, files, opened,
+                      class_filter, lease),
+        media_type="application/x-ndjson"
+    )
 
 @app.post("/api/infer")
-async def infer(image: UploadFile = File(None), image_url: str = Form(None)):
+async def infer(
+    image: UploadFile = File(None),
+    image_url: str = Form(None),
+    imgsz: int = Form(None),
+    rect: bool = Form(False),
+    profile: str = Form(None),
+    classes: str = Form(None),
+    tiled: bool = Form(False),
+    log: bool = Form(False),
+    user_mode: str = Form("kid"),
+    session_id: str = Form(None),
+    model: str = Form(None),
+    accept: str = Header(None)
+):
     """
     Perform object detection on uploaded image or image URL.
     
     Args:
         image: Uploaded image file (multipart/form-data)
         image_url: URL to image (alternative to file upload)
+        imgsz: Model input size, one of MODEL_INPUT_SIZES (default: MODEL_INPUT_SIZE)
+        rect: Pad only to the stride multiple instead of a full square
+        profile: Only detect the classes of this named profile (food, safety, toys)
+        classes: Only detect these comma-separated class names or ids
+        tiled: Detect on overlapping full-resolution tiles plus the full view,
+            for small objects in large photos (slower; see TILE_* settings)
+        log: Record the detections in the detections table, replacing one
+            /api/log-detection call per object
+        user_mode: user_mode column of logged detections
+        session_id: session_id column of logged detections
+        model: Id of the model to run (see /api/models; default: MODEL_ID)
     
     Returns:
-        JSON response with detection results
+        Detection results as JSON, or in the packed binary layout of
+        ``_encoding`` when the Accept header prefers application/x-detections
+        (class ids index the model's table from /api/infer/classes)
     """
+    lease = None
     try:
         # Validate input
         if image is None and not image_url:
@@ -225,57 +1841,62 @@ async def infer(image: UploadFile = File(None), image_url: str = Form(None)):
                 status_code=400, 
                 detail="Please provide either an image file or image_url"
             )
+        if imgsz is not None and imgsz not in MODEL_INPUT_SIZES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"imgsz must be one of {MODEL_INPUT_SIZES}"
+            )
+        imgsz = imgsz or MODEL_INPUT_SIZE
+        lease = await _acquire_model(model)
+        served = _lease_model(lease)
+        class_filter = _class_filter(profile, classes, served)
         
         # Load image data
         if image is not None:
             # Read uploaded file
-            image_data = await image.read()
+            with stage("download"):
+                image_data = await image.read()
             logger.info(f"Processing uploaded image: {image.filename}")
         else:
             # Download from URL
             try:
-                with urllib.request.urlopen(image_url) as response:
-                    image_data = response.read()
+                with stage("download"):
+                    image_data = await FETCHER.fetch(image_url)
                 logger.info(f"Processing image from URL: {image_url}")
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Failed to download image: {str(e)}")
-        
-        # Open image with PIL
-        try:
-            pil_image = Image.open(io.BytesIO(image_data))
-            original_size = pil_image.size  # (width, height)
-            logger.info(f"Image loaded successfully: {original_size}")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid image format: {str(e)}")
-        
-        # Load ONNX session
-        session = _load_session()
-        
-        # Preprocess image
-        img_input, ratio, pad, original_shape = _preprocess_image(pil_image)
+            except FetchError as e:
+                raise HTTPException(status_code=e.status_code, detail=str(e))
         
-        # Run inference
-        input_name = session.get_inputs()[0].name
-        outputs = session.run(None, {input_name: img_input})
+        payload = await _detect(image_data, imgsz, rect, classes=class_filter, tiled=tiled, model=served)
+        if log:
+            _log_detections(payload["results"], "upload", user_mode, session_id)
         
-        # Post-process results
-        raw_results = _non_max_suppression(outputs[0])
-        final_results = _postprocess_results(raw_results, ratio, pad, original_shape)
-        
-        logger.info(f"Detection completed: {len(final_results)} objects found")
-        
-        return JSONResponse({
-            "success": True,
-            "results": final_results,
-            "image_size": original_size,
-            "detections_count": len(final_results)
-        })
+        with stage("serialize"):
+            media_type = negotiate(accept)
+            if media_type == BINARY_MEDIA_TYPE:
+                content = pack_detections(payload["results"], payload["image_size"], payload["input_size"],
+                                          payload["cached"], CLASS_TABLE_ID if served is None else served.table_id)
+                return Response(content, media_type=BINARY_MEDIA_TYPE, headers={"Vary": "Accept"})
+            
+            body = {
+                "success": True,
+                "results": payload["results"],
+                "image_size": payload["image_size"],
+                "detections_count": len(payload["results"]),
+                "input_size": payload["input_size"],
+                "cached": payload["cached"]
+            }
+            if "tiles" in payload:
+                body["tiles"] = payload["tiles"]
+            return ORJSONResponse(body, headers={"Vary": "Accept"})
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Inference error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        if lease is not None:
+            lease.release()
 
 # For Vercel deployment
 if __name__ == "__main__":
@@ -1,12 +1,17 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import io
+import csv
 import logging
 from datetime import datetime, timedelta
 
+import orjson
+
+from _db import Database, DatabaseUnavailable, PoolTimeout, create_detections_table
+from _metrics import Registry
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,76 +27,123 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database configuration
-DATABASE_URL = os.getenv("DATABASE_URL")
+# Database configuration: a pool of DATABASE_URL connections sized by the
+# DB_POOL_* settings; without DATABASE_URL the endpoints serve mock data
+DB = Database.from_env()
 
-def get_db_connection():
-    """Get database connection."""
-    if not DATABASE_URL:
-        # Return mock data if no database configured
-        return None
-    
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection error: {str(e)}")
-        return None
+# Pool metrics on /metrics
+METRICS = Registry()
+DB.register_metrics(METRICS)
+INGEST_ROWS = METRICS.counter(
+    "detection_ingest_rows_total", "Rows received by /api/log-detections, by outcome", ("outcome",))
+
+# Bulk ingest (/api/log-detections): rows per request, and the batch size
+# from which rows are loaded with COPY instead of one multi-row INSERT
+INGEST_MAX_ROWS = int(os.getenv("INGEST_MAX_ROWS", "10000"))
+INGEST_COPY_MIN_ROWS = int(os.getenv("INGEST_COPY_MIN_ROWS", "500"))
+INGEST_COLUMNS = ("class_name, confidence, source, user_mode, session_id, "
+                  "bbox_x1, bbox_y1, bbox_x2, bbox_y2, idempotency_key")
+
+PERIOD_FILTERS = {
+    "day": "AND timestamp >= NOW() - INTERVAL '1 day'",
+    "week": "AND timestamp >= NOW() - INTERVAL '1 week'",
+    "month": "AND timestamp >= NOW() - INTERVAL '1 month'",
+    "all": "",
+}
+
+# Prepared once per pooled connection; one leaderboard statement per period
+for _period, _time_filter in PERIOD_FILTERS.items():
+    DB.prepare(f"leaderboard_{_period}", f"""
+        SELECT 
+            class_name,
+            COUNT(*) as count,
+            ROW_NUMBER() OVER (ORDER BY COUNT(*) DESC) as rank
+        FROM detections 
+        WHERE 1=1 {_time_filter}
+        GROUP BY class_name 
+        ORDER BY count DESC 
+        LIMIT $1
+    """)
 
-def init_database():
+DB.prepare("insert_detection", """
+    INSERT INTO detections 
+    (class_name, confidence, source, user_mode, session_id, bbox_x1, bbox_y1, bbox_x2, bbox_y2)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+    RETURNING id, timestamp
+""")
+
+# Column arrays in, one row per element out; rows whose idempotency key is
+# already stored (a retried request) are skipped
+DB.prepare("ingest_detections", f"""
+    INSERT INTO detections ({INGEST_COLUMNS})
+    SELECT class_name, confidence, $1::varchar, $2::varchar, $3::varchar, x1, y1, x2, y2, idempotency_key
+    FROM unnest($4::varchar[], $5::float8[], $6::float8[], $7::float8[], $8::float8[], $9::float8[], $10::varchar[])
+        AS ingest (class_name, confidence, x1, y1, x2, y2, idempotency_key)
+    ON CONFLICT (idempotency_key) DO NOTHING
+""", ("varchar", "varchar", "varchar", "varchar[]", "float8[]", "float8[]", "float8[]", "float8[]", "float8[]",
+      "varchar[]"))
+
+def _copy_detections(conn, rows):
+    """COPY ``rows`` into a scratch table and move over the ones with new idempotency keys; returns rows inserted."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([r"\N" if value is None else value for value in row] for row in rows)
+    buffer.seek(0)
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE detections_ingest (
+                class_name VARCHAR(100),
+                confidence FLOAT,
+                source VARCHAR(20),
+                user_mode VARCHAR(20),
+                session_id VARCHAR(100),
+                bbox_x1 FLOAT,
+                bbox_y1 FLOAT,
+                bbox_x2 FLOAT,
+                bbox_y2 FLOAT,
+                idempotency_key VARCHAR(100)
+            ) ON COMMIT DROP
+        """)
+        # Only \N loads as NULL, so empty strings are stored as '' like on the unnest path
+        cur.copy_expert(f"COPY detections_ingest ({INGEST_COLUMNS}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+        cur.execute(f"""
+            INSERT INTO detections ({INGEST_COLUMNS})
+            SELECT {INGEST_COLUMNS} FROM detections_ingest
+            ON CONFLICT (idempotency_key) DO NOTHING
+        """)
+        return cur.rowcount
+
+async def init_database():
     """Initialize database tables if they don't exist."""
-    conn = get_db_connection()
-    if not conn:
-        return False
-    
     try:
-        with conn.cursor() as cur:
-            # Create detections table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS detections (
-                    id SERIAL PRIMARY KEY,
-                    class_name VARCHAR(100) NOT NULL,
-                    confidence FLOAT NOT NULL,
-                    source VARCHAR(20) DEFAULT 'upload',
-                    user_mode VARCHAR(20) DEFAULT 'kid',
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    session_id VARCHAR(100),
-                    bbox_x1 FLOAT,
-                    bbox_y1 FLOAT,
-                    bbox_x2 FLOAT,
-                    bbox_y2 FLOAT
-                );
-            """)
-            
-            # Create index for faster queries
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_detections_timestamp 
-                ON detections(timestamp);
-            """)
-            
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_detections_class_name 
-                ON detections(class_name);
-            """)
-            
-            conn.commit()
-            logger.info("Database tables initialized successfully")
-            return True
-            
+        async with DB.connection() as conn:
+            await conn.run(create_detections_table, transaction=True)
+        logger.info("Database tables initialized successfully")
+        return True
+    except DatabaseUnavailable:
+        return False
     except Exception as e:
         logger.error(f"Database initialization error: {str(e)}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
 
-# Initialize database on startup
-init_database()
+@app.on_event("startup")
+async def startup():
+    # Open the pool's first connections and create the tables
+    if await DB.open():
+        await init_database()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await DB.close()
 
 @app.get("/")
 async def root():
     """Health check endpoint."""
-    return {"message": "Kids B-Care Leaderboard API", "status": "healthy"}
+    return {"message": "Kids B-Care Leaderboard API", "status": "healthy", "database": DB.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/api/leaderboard")
 async def get_leaderboard(limit: int = 10, period: str = "week"):
@@ -106,73 +158,48 @@ async def get_leaderboard(limit: int = 10, period: str = "week"):
         JSON response with leaderboard data
     """
     try:
-        conn = get_db_connection()
-        
-        if not conn:
-            # Return mock data if no database
-            mock_data = [
-                {"class_name": "teddy bear", "count": 45, "rank": 1},
-                {"class_name": "book", "count": 38, "rank": 2},
-                {"class_name": "cup", "count": 32, "rank": 3},
-                {"class_name": "apple", "count": 28, "rank": 4},
-                {"class_name": "car", "count": 25, "rank": 5},
-                {"class_name": "cat", "count": 22, "rank": 6},
-                {"class_name": "dog", "count": 20, "rank": 7},
-                {"class_name": "ball", "count": 18, "rank": 8},
-                {"class_name": "bottle", "count": 15, "rank": 9},
-                {"class_name": "chair", "count": 12, "rank": 10}
-            ]
-            return JSONResponse({
-                "success": True,
-                "leaderboard": mock_data[:limit],
-                "period": period,
-                "total_entries": len(mock_data)
-            })
+        statement = f"leaderboard_{period if period in PERIOD_FILTERS else 'all'}"
+        results = await DB.fetch(statement, (limit,))
         
-        # Calculate time filter
-        time_filter = ""
-        if period == "day":
-            time_filter = "AND timestamp >= NOW() - INTERVAL '1 day'"
-        elif period == "week":
-            time_filter = "AND timestamp >= NOW() - INTERVAL '1 week'"
-        elif period == "month":
-            time_filter = "AND timestamp >= NOW() - INTERVAL '1 month'"
-        
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            query = f"""
-                SELECT 
-                    class_name,
-                    COUNT(*) as count,
-                    ROW_NUMBER() OVER (ORDER BY COUNT(*) DESC) as rank
-                FROM detections 
-                WHERE 1=1 {time_filter}
-                GROUP BY class_name 
-                ORDER BY count DESC 
-                LIMIT %s
-            """
-            
-            cur.execute(query, (limit,))
-            results = cur.fetchall()
-            
-            # Convert to list of dicts
-            leaderboard = [dict(row) for row in results]
-            
-            logger.info(f"Leaderboard query completed: {len(leaderboard)} entries")
-            
-            return JSONResponse({
-                "success": True,
-                "leaderboard": leaderboard,
-                "period": period,
-                "total_entries": len(leaderboard)
-            })
-            
+    except DatabaseUnavailable:
+        # Return mock data if no database
+        mock_data = [
+            {"class_name": "teddy bear", "count": 45, "rank": 1},
+            {"class_name": "book", "count": 38, "rank": 2},
+            {"class_name": "cup", "count": 32, "rank": 3},
+            {"class_name": "apple", "count": 28, "rank": 4},
+            {"class_name": "car", "count": 25, "rank": 5},
+            {"class_name": "cat", "count": 22, "rank": 6},
+            {"class_name": "dog", "count": 20, "rank": 7},
+            {"class_name": "ball", "count": 18, "rank": 8},
+            {"class_name": "bottle", "count": 15, "rank": 9},
+            {"class_name": "chair", "count": 12, "rank": 10}
+        ]
+        return JSONResponse({
+            "success": True,
+            "leaderboard": mock_data[:limit],
+            "period": period,
+            "total_entries": len(mock_data)
+        })
+    
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
     except Exception as e:
         logger.error(f"Leaderboard error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get leaderboard: {str(e)}")
     
-    finally:
-        if conn:
-            conn.close()
+    # Convert to list of dicts
+    leaderboard = [dict(row) for row in results]
+    
+    logger.info(f"Leaderboard query completed: {len(leaderboard)} entries")
+    
+    return JSONResponse({
+        "success": True,
+        "leaderboard": leaderboard,
+        "period": period,
+        "total_entries": len(leaderboard)
+    })
 
 @app.post("/api/log-detection")
 async def log_detection(
@@ -197,64 +224,185 @@ async def log_detection(
     Returns:
         JSON response confirming log entry
     """
+    # The bbox columns stay NULL unless all four coordinates are given
+    coords = tuple(bbox) if bbox and len(bbox) == 4 else (None, None, None, None)
+    
     try:
-        conn = get_db_connection()
-        
-        if not conn:
-            # Mock response if no database
-            return JSONResponse({
-                "success": True,
-                "message": "Detection logged (mock)",
-                "data": {
-                    "class_name": class_name,
-                    "confidence": confidence,
-                    "source": source,
-                    "user_mode": user_mode
-                }
-            })
+        result = await DB.fetchone("insert_detection", (class_name, confidence, source, user_mode, session_id,
+                                                        *coords))
         
-        with conn.cursor() as cur:
-            if bbox and len(bbox) == 4:
-                cur.execute("""
-                    INSERT INTO detections 
-                    (class_name, confidence, source, user_mode, session_id, bbox_x1, bbox_y1, bbox_x2, bbox_y2)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id, timestamp
-                """, (class_name, confidence, source, user_mode, session_id, 
-                      bbox[0], bbox[1], bbox[2], bbox[3]))
-            else:
-                cur.execute("""
-                    INSERT INTO detections 
-                    (class_name, confidence, source, user_mode, session_id)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id, timestamp
-                """, (class_name, confidence, source, user_mode, session_id))
-            
-            result = cur.fetchone()
-            conn.commit()
-            
-            logger.info(f"Detection logged: {class_name} (confidence: {confidence})")
-            
-            return JSONResponse({
-                "success": True,
-                "message": "Detection logged successfully",
-                "data": {
-                    "id": result[0],
-                    "timestamp": result[1].isoformat(),
-                    "class_name": class_name,
-                    "confidence": confidence
-                }
-            })
-            
+    except DatabaseUnavailable:
+        # Mock response if no database
+        return JSONResponse({
+            "success": True,
+            "message": "Detection logged (mock)",
+            "data": {
+                "class_name": class_name,
+                "confidence": confidence,
+                "source": source,
+                "user_mode": user_mode
+            }
+        })
+    
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
     except Exception as e:
         logger.error(f"Log detection error: {str(e)}")
-        if conn:
-            conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to log detection: {str(e)}")
     
-    finally:
-        if conn:
-            conn.close()
+    logger.info(f"Detection logged: {class_name} (confidence: {confidence})")
+    
+    return JSONResponse({
+        "success": True,
+        "message": "Detection logged successfully",
+        "data": {
+            "id": result["id"],
+            "timestamp": result["timestamp"].isoformat(),
+            "class_name": class_name,
+            "confidence": confidence
+        }
+    })
+
+def _parse_ingest_body(body, content_type):
+    """
+    Detections and shared fields of a bulk ingest body.
+
+    The body is a JSON array of detections, a JSON object holding them under
+    ``detections`` next to optional ``source``, ``user_mode`` and
+    ``session_id``, or NDJSON (one detection object per line). Raises
+    ValueError when it is none of these.
+    """
+    if "ndjson" in content_type:
+        return [orjson.loads(line) for line in body.splitlines() if line.strip()], {}
+    payload = orjson.loads(body)
+    if isinstance(payload, list):
+        return payload, {}
+    if isinstance(payload, dict) and isinstance(payload.get("detections"), list):
+        shared = {key: payload[key] for key in ("source", "user_mode", "session_id") if key in payload}
+        return payload["detections"], shared
+    raise ValueError("expected an array of detections or an object with a detections array")
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _ingest_row(index, detection, source, user_mode, session_id, request_key):
+    """Validate one detection into an INGEST_COLUMNS row; raises ValueError."""
+    if not isinstance(detection, dict):
+        raise ValueError("must be an object")
+    class_name = detection.get("class_name")
+    if not isinstance(class_name, str) or not class_name or len(class_name) > 100:
+        raise ValueError("class_name must be a non-empty string of at most 100 characters")
+    confidence = detection.get("confidence")
+    if not _is_number(confidence):
+        raise ValueError("confidence must be a number")
+    
+    bbox = detection.get("bbox")
+    if bbox is None:
+        coords = (None, None, None, None)
+    elif isinstance(bbox, list) and len(bbox) == 4 and all(_is_number(value) for value in bbox):
+        coords = tuple(float(value) for value in bbox)
+    else:
+        raise ValueError("bbox must be [x1, y1, x2, y2]")
+    
+    # An explicit per-detection key wins; otherwise the request key numbers its rows
+    key = detection.get("idempotency_key")
+    if key is None:
+        key = f"{request_key}:{index}" if request_key else None
+    elif not isinstance(key, str) or not key or len(key) > 100:
+        raise ValueError("idempotency_key must be a non-empty string of at most 100 characters")
+    
+    return (class_name, float(confidence), source, user_mode, session_id, *coords, key)
+
+@app.post("/api/log-detections")
+async def log_detections(
+    request: Request,
+    source: str = "upload",
+    user_mode: str = "kid",
+    session_id: str = None,
+    idempotency_key: str = Header(None)
+):
+    """
+    Log many detection events in one request and one transaction.
+    
+    Args:
+        body: JSON array of detections ({"class_name", "confidence", "bbox",
+            optional "idempotency_key"}), a JSON object with a "detections"
+            array and optional shared "source", "user_mode" and "session_id",
+            or NDJSON (Content-Type: application/x-ndjson), one detection per line
+        source: Source of every detection ('upload', 'webcam')
+        user_mode: User mode of every detection ('kid', 'parent', 'admin')
+        session_id: Optional session identifier of every detection
+        idempotency_key: Idempotency-Key header; a retry with the same key
+            (and the same detections in the same order) inserts nothing new
+    
+    Returns:
+        JSON response with the rows received, inserted and skipped as duplicates
+    """
+    body = await request.body()
+    try:
+        detections, shared = _parse_ingest_body(body, request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid detections body: {str(e)}")
+    
+    source = shared.get("source", source)
+    user_mode = shared.get("user_mode", user_mode)
+    session_id = shared.get("session_id", session_id)
+    if not isinstance(source, str) or len(source) > 20 or not isinstance(user_mode, str) or len(user_mode) > 20:
+        raise HTTPException(status_code=400, detail="source and user_mode must be strings of at most 20 characters")
+    if session_id is not None and (not isinstance(session_id, str) or len(session_id) > 100):
+        raise HTTPException(status_code=400, detail="session_id must be a string of at most 100 characters")
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= 64:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1 to 64 characters")
+    if len(detections) > INGEST_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {INGEST_MAX_ROWS} detections per request")
+    
+    rows = []
+    for index, detection in enumerate(detections):
+        try:
+            rows.append(_ingest_row(index, detection, source, user_mode, session_id, idempotency_key))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Detection {index}: {str(e)}")
+    
+    try:
+        if not rows:
+            inserted = 0
+        elif len(rows) >= INGEST_COPY_MIN_ROWS:
+            async with DB.connection() as conn:
+                inserted = await conn.run(_copy_detections, rows, transaction=True)
+        else:
+            columns = [list(column) for column in zip(*rows)]
+            inserted = await DB.execute("ingest_detections", (source, user_mode, session_id, columns[0], columns[1],
+                                                              *columns[5:]))
+        
+    except DatabaseUnavailable:
+        # Mock response if no database
+        return JSONResponse({
+            "success": True,
+            "message": "Detections logged (mock)",
+            "received": len(rows),
+            "inserted": len(rows),
+            "duplicates": 0
+        })
+    
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    except Exception as e:
+        logger.error(f"Log detections error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to log detections: {str(e)}")
+    
+    INGEST_ROWS.labels("inserted").inc(inserted)
+    INGEST_ROWS.labels("duplicate").inc(len(rows) - inserted)
+    logger.info(f"Detections logged: {inserted} of {len(rows)} new")
+    
+    return JSONResponse({
+        "success": True,
+        "message": "Detections logged successfully",
+        "received": len(rows),
+        "inserted": inserted,
+        "duplicates": len(rows) - inserted
+    })
 
 # For Vercel deployment
 if __name__ == "__main__":
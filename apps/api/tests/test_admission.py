@@ -0,0 +1,242 @@
+"""AdmissionController lanes, shedding and deadlines, and the HTTP middleware in front of it."""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from _admission import AdmissionController, AdmissionMiddleware, DeadlineExceeded, Lane, Rejected
+
+LANES = (Lane("upload", 0, 4), Lane("batch", 1, 2), Lane("webcam", 2, 2))
+
+
+def controller(max_in_flight=1, max_queue=4):
+    return AdmissionController(max_in_flight, max_queue, LANES)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_admits_up_to_max_in_flight_then_queues():
+    admission = controller(max_in_flight=2)
+
+    async def run():
+        first = await admission.acquire("upload")
+        await admission.acquire("upload")
+        waiting = asyncio.ensure_future(admission.acquire("upload"))
+        await settle()
+        queued = admission.queued
+        first.release()
+        third = await waiting
+        return queued, admission.in_flight, third
+
+    queued, in_flight, third = asyncio.run(run())
+
+    assert (queued, in_flight) == (1, 2)
+    assert third.lane.name == "upload"
+    assert admission.counters["upload"] == {"admitted": 3, "queued": 1, "rejected": 0, "shed": 0, "expired": 0}
+
+
+def test_release_serves_highest_priority_then_oldest():
+    admission = controller()
+    order = []
+
+    async def wait(lane):
+        ticket = await admission.acquire(lane)
+        order.append(lane)
+        ticket.release()
+
+    async def run():
+        holder = await admission.acquire("upload")
+        waiters = [asyncio.ensure_future(wait(lane)) for lane in ("webcam", "batch", "upload", "batch")]
+        await settle()
+        holder.release()
+        await asyncio.gather(*waiters)
+
+    asyncio.run(run())
+
+    assert order == ["upload", "batch", "batch", "webcam"]
+
+
+def test_release_is_idempotent():
+    admission = controller()
+
+    async def run():
+        ticket = await admission.acquire("upload")
+        ticket.release()
+        ticket.release()
+
+    asyncio.run(run())
+
+    assert admission.in_flight == 0
+
+
+def test_full_lane_queue_is_rejected_with_retry_after():
+    admission = controller(max_queue=10)
+
+    async def run():
+        await admission.acquire("upload")
+        waiters = [asyncio.ensure_future(admission.acquire("webcam")) for _ in range(2)]
+        await settle()
+        with pytest.raises(Rejected) as rejected:
+            await admission.acquire("webcam")
+        for waiter in waiters:
+            waiter.cancel()
+        return rejected.value
+
+    rejected = asyncio.run(run())
+
+    assert rejected.reason == "lane queue full"
+    assert rejected.retry_after >= 1
+    assert admission.counters["webcam"]["rejected"] == 1
+
+
+def test_full_queue_sheds_newest_lower_priority_waiter():
+    admission = controller(max_queue=3)
+
+    async def run():
+        await admission.acquire("upload")
+        old_webcam = asyncio.ensure_future(admission.acquire("webcam"))
+        await settle()
+        new_webcam = asyncio.ensure_future(admission.acquire("webcam"))
+        batch = asyncio.ensure_future(admission.acquire("batch"))
+        await settle()
+        upload = asyncio.ensure_future(admission.acquire("upload"))  # queue is full: sheds new_webcam
+        await settle()
+        shed = new_webcam.exception() if new_webcam.done() else None
+        waiting = old_webcam.done(), batch.done(), upload.done()
+        for task in (old_webcam, batch, upload):
+            task.cancel()
+        return shed, waiting
+
+    shed, waiting = asyncio.run(run())
+
+    assert isinstance(shed, Rejected) and shed.reason == "shed for higher priority work"
+    assert waiting == (False, False, False)
+    assert admission.counters["webcam"]["shed"] == 1
+
+
+def test_shed_below_never_sheds_equal_or_higher_priority():
+    admission = controller(max_queue=2)
+
+    async def run():
+        await admission.acquire("upload")
+        waiters = [asyncio.ensure_future(admission.acquire(lane)) for lane in ("upload", "batch")]
+        await settle()
+        shed_for_batch = admission._shed_below(admission.lanes["batch"])
+        with pytest.raises(Rejected) as rejected:
+            await admission.acquire("webcam")
+        for waiter in waiters:
+            waiter.cancel()
+        return shed_for_batch, rejected.value
+
+    shed_for_batch, rejected = asyncio.run(run())
+
+    assert shed_for_batch is False
+    assert rejected.reason == "queue full"
+
+
+def test_expired_deadline_is_refused_before_admission():
+    admission = controller()
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(admission.acquire("upload", deadline=time.monotonic() - 1))
+    assert admission.counters["upload"]["expired"] == 1
+    assert admission.in_flight == 0
+
+
+def test_deadline_expires_while_queued():
+    admission = controller()
+
+    async def run():
+        holder = await admission.acquire("upload")
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await admission.acquire("upload", deadline=started + 0.05)
+        elapsed = time.monotonic() - started
+        holder.release()
+        return elapsed
+
+    elapsed = asyncio.run(run())
+
+    assert 0.05 <= elapsed < 1.0
+    assert admission.queued == 0 and admission.in_flight == 0
+    assert admission.counters["upload"]["expired"] == 1
+
+
+async def _ok(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def post(admission, path="/infer", headers=None, hold=None):
+    app = AdmissionMiddleware(_ok, controller=admission, routes={"/infer": "upload", "/batch": "batch"})
+
+    async def send():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            ticket = await admission.acquire(hold) if hold else None
+            try:
+                return await client.post(path, headers=headers or {})
+            finally:
+                if ticket is not None:
+                    ticket.release()
+
+    return asyncio.run(send())
+
+
+def test_middleware_admits_and_releases():
+    admission = controller()
+
+    response = post(admission)
+
+    assert response.status_code == 200
+    assert admission.in_flight == 0
+    assert admission.counters["upload"]["admitted"] == 1
+
+
+def test_middleware_rejects_with_429_and_retry_after():
+    admission = AdmissionController(1, 0, (Lane("upload", 0, 0), Lane("batch", 1, 0)))
+
+    response = post(admission, hold="upload")
+
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+
+
+@pytest.mark.parametrize("path, lane, status_code", [
+    ("/infer", "webcam", 200),
+    ("/infer", "upload", 200),
+    ("/batch", "webcam", 200),
+    ("/batch", "upload", 400),
+    ("/infer", "express", 400),
+])
+def test_middleware_only_lets_clients_lower_their_lane(path, lane, status_code):
+    admission = controller()
+
+    response = post(admission, path, {"X-Request-Lane": lane})
+
+    assert response.status_code == status_code
+    if status_code == 200:
+        assert admission.counters[lane]["admitted"] == 1
+
+
+@pytest.mark.parametrize("value", ["soon", "nan", "inf", "-inf", "-5"])
+def test_middleware_rejects_invalid_deadlines(value):
+    admission = controller()
+
+    response = post(admission, headers={"X-Request-Deadline-Ms": value})
+
+    assert response.status_code == 400
+    assert admission.counters["upload"]["admitted"] == 0
+
+
+def test_middleware_answers_504_once_the_deadline_passes_in_the_queue():
+    admission = controller()
+
+    response = post(admission, headers={"X-Request-Deadline-Ms": "50"}, hold="upload")
+
+    assert response.status_code == 504
+    assert admission.counters["upload"]["expired"] == 1
@@ -0,0 +1,100 @@
+"""MicroBatcher batching window, shape separation, failures and histograms."""
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from _batching import MicroBatcher
+
+
+class RecordingModel:
+    """run_batch stand-in that records the batches it sees and doubles its input."""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+        self._lock = threading.Lock()
+
+    def __call__(self, stacked):
+        with self._lock:
+            self.batches.append(stacked.shape)
+        if self.error is not None:
+            raise self.error
+        return stacked * 2
+
+
+def tensor(value, size=4):
+    return np.full((1, 3, size, size), value, dtype=np.float32)
+
+
+def submit_all(batcher, tensors):
+    async def run():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(batcher.submit(t) for t in tensors), return_exceptions=True)
+        return results, time.perf_counter() - started
+
+    return asyncio.run(run())
+
+
+def test_batch_closes_when_full():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=5000)
+
+    results, elapsed = submit_all(batcher, [tensor(i) for i in range(4)])
+
+    assert model.batches == [(4, 3, 4, 4)]
+    assert elapsed < 1.0  # did not wait for the 5 s window
+    for i, result in enumerate(results):
+        assert result.shape == (1, 3, 4, 4) and np.all(result == 2 * i)
+
+
+def test_batch_closes_when_the_window_ends():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=8, max_wait_ms=50)
+
+    results, elapsed = submit_all(batcher, [tensor(1), tensor(2)])
+
+    assert model.batches == [(2, 3, 4, 4)]
+    assert 0.05 <= elapsed < 1.0
+    assert [float(result.max()) for result in results] == [2.0, 4.0]
+
+
+def test_shapes_are_never_stacked_together():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=8, max_wait_ms=20, max_concurrent_batches=2)
+    tensors = [tensor(1, 4), tensor(2, 8), tensor(3, 4), tensor(4, 8)]
+
+    results, _ = submit_all(batcher, tensors)
+
+    assert sorted(model.batches) == [(2, 3, 4, 4), (2, 3, 8, 8)]
+    for source, result in zip(tensors, results):
+        assert result.shape == source.shape and np.array_equal(result, source * 2)
+
+
+def test_failure_reaches_every_waiter():
+    error = RuntimeError("model exploded")
+    batcher = MicroBatcher(RecordingModel(error), max_batch_size=3, max_wait_ms=5000)
+
+    results, _ = submit_all(batcher, [tensor(i) for i in range(3)])
+
+    assert results == [error] * 3
+    assert batcher.batches_run == 0
+
+
+def test_histograms_count_batches_and_waits():
+    batcher = MicroBatcher(RecordingModel(), max_batch_size=4, max_wait_ms=10)
+
+    async def run():
+        await asyncio.gather(*(batcher.submit(tensor(i)) for i in range(4)))
+        await asyncio.gather(*(batcher.submit(tensor(i)) for i in range(2)))
+
+    asyncio.run(run())
+
+    sizes = batcher.batch_size_histogram.snapshot()
+    assert (sizes["count"], sizes["sum"]) == (2, 6)
+    assert [bucket["count"] for bucket in sizes["buckets"][:4]] == [0, 1, 2, 2]  # cumulative: le 1, 2, 4, 8
+    waits = batcher.wait_ms_histogram.snapshot()
+    assert waits["count"] == 6
+    assert batcher.stats()["avg_batch_size"] == pytest.approx(3.0)
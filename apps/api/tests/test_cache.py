@@ -0,0 +1,60 @@
+"""DetectionCache disk tier bounds."""
+import asyncio
+import os
+
+from _cache import DetectionCache
+
+
+def disk_usage(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def test_disk_tier_stays_under_its_budget(tmp_path):
+    cache = DetectionCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=20_000)
+    payload = {"results": [{"class_name": "cup", "bbox": [0, 0, 1, 1]}] * 20}
+
+    async def run():
+        for i in range(100):
+            await cache.put(f"{i:064x}", payload)
+            assert disk_usage(tmp_path) <= cache.disk_max_bytes
+
+    asyncio.run(run())
+
+    assert cache.counters["disk_evictions"] > 0
+    assert cache.stats()["disk_bytes"] == disk_usage(tmp_path)
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = DetectionCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=10_000)
+    payload = {"results": [{"class_name": "cup", "bbox": [0, 0, 1, 1]}] * 20}
+    keys = [f"{i:064x}" for i in range(20)]
+
+    async def run():
+        # Fill to just under the budget, with strictly increasing modification times
+        for i, key in enumerate(keys[:5]):
+            await cache.put(key, payload)
+            os.utime(cache._disk_path(key), (i + 1, i + 1))
+        assert await cache.get(keys[0]) == payload  # now used more recently than keys 1-4
+        # Roughly ten entries fit; the eleventh prunes the two least recently used
+        for key in keys[5:11]:
+            await cache.put(key, payload)
+        return await cache.get(keys[0]), await cache.get(keys[1])
+
+    kept, evicted = asyncio.run(run())
+
+    assert kept == payload
+    assert evicted is None
+
+
+def test_existing_files_count_towards_the_budget(tmp_path):
+    payload = {"results": [{"class_name": "cup", "bbox": [0, 0, 1, 1]}] * 20}
+
+    async def fill(cache, start, count):
+        for i in range(start, start + count):
+            await cache.put(f"{i:064x}", payload)
+
+    asyncio.run(fill(DetectionCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=1_000_000), 0, 30))
+    # A new process sharing the directory scans it before its first write
+    asyncio.run(fill(DetectionCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=10_000), 30, 1))
+
+    assert disk_usage(tmp_path) <= 10_000
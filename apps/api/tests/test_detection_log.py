@@ -0,0 +1,55 @@
+"""
+DetectionLog against a real Postgres; skipped unless TEST_DATABASE_URL is set.
+
+The tests create and drop their own scratch database, so they need a role
+allowed to CREATE DATABASE.
+"""
+import asyncio
+import os
+import uuid
+
+import psycopg2
+import pytest
+
+from _db import Database
+from _detection_log import DetectionLog
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+def _admin(sql):
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(sql)
+    conn.close()
+
+
+@pytest.fixture
+def empty_database():
+    name = f"test_detection_log_{uuid.uuid4().hex[:12]}"
+    _admin(f"CREATE DATABASE {name}")
+    yield psycopg2.extensions.make_dsn(TEST_DATABASE_URL, dbname=name)
+    _admin(f"DROP DATABASE {name}")
+
+
+def test_first_flush_creates_the_table(empty_database):
+    db = Database(empty_database)
+    log = DetectionLog(db, flush_interval_s=0.05, max_retries=0)
+
+    async def run():
+        log.start()
+        log.record([("cup", 0.9, "upload", "kid", "s1", None, None, None, None),
+                    ("book", 0.4, "upload", "kid", "s1", 1.0, 2.0, 3.0, 4.0)])
+        await log.close()
+        await db.close()
+
+    asyncio.run(run())
+
+    assert (log.counters["written"], log.counters["dropped_failed"]) == (2, 0)
+    with psycopg2.connect(empty_database) as conn, conn.cursor() as cur:
+        cur.execute("SELECT class_name, bbox_x1 FROM detections ORDER BY id")
+        assert cur.fetchall() == [("cup", None), ("book", 1.0)]
+    conn.close()
@@ -0,0 +1,171 @@
+"""ImageFetcher against a local stand-in HTTP server."""
+import asyncio
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from _fetch import FetchError, ImageFetcher
+
+
+def _png():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), (255, 0, 0)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+PNG = _png()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/image.png":
+            self._send(200, "image/png", PNG)
+        elif path == "/slow.png":
+            server = self.server
+            with server.lock:
+                server.active += 1
+                server.peak = max(server.peak, server.active)
+            time.sleep(0.2)
+            with server.lock:
+                server.active -= 1
+            self._send(200, "image/png", PNG)
+        elif path == "/stall.png":
+            time.sleep(2)
+            self._send(200, "image/png", PNG)
+        elif path == "/page.html":
+            self._send(200, "text/html", b"<html></html>")
+        elif path == "/fake.png":
+            self._send(200, "application/octet-stream", b"definitely not an image")
+        elif path == "/large.png":
+            self._send(200, "image/png", PNG + b"\0" * 4096)
+        elif path == "/chunked.png":
+            # No Content-Length: the size cap has to trip while streaming
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in (PNG, b"\0" * 4096):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        elif path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/image.png")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            self._send(404, "text/plain", b"not found")
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.lock = threading.Lock()
+    httpd.active = httpd.peak = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def fetch(coro_fn, **kwargs):
+    async def run():
+        fetcher = ImageFetcher(**{"max_bytes": 1024, "timeout": 1.0, **kwargs})
+        try:
+            return await coro_fn(fetcher)
+        finally:
+            await fetcher.aclose()
+
+    return asyncio.run(run())
+
+
+def test_fetch_image(server):
+    assert fetch(lambda f: f.fetch(url(server, "/image.png"))) == PNG
+
+
+def test_fetch_follows_redirects(server):
+    assert fetch(lambda f: f.fetch(url(server, "/redirect"))) == PNG
+
+
+@pytest.mark.parametrize("path, status_code", [
+    ("/missing.png", 502),
+    ("/page.html", 415),
+    ("/fake.png", 415),
+    ("/large.png", 413),
+    ("/chunked.png", 413),
+    ("/stall.png", 504),
+])
+def test_fetch_errors(server, path, status_code):
+    with pytest.raises(FetchError) as error:
+        fetch(lambda f: f.fetch(url(server, path)))
+    assert error.value.status_code == status_code
+
+
+def test_fetch_rejects_other_schemes():
+    with pytest.raises(FetchError) as error:
+        fetch(lambda f: f.fetch("file:///etc/passwd"))
+    assert error.value.status_code == 400
+
+
+def test_fetch_many_keeps_order_and_reports_failures(server):
+    urls = [url(server, "/slow.png"), url(server, "/missing.png"), url(server, "/image.png")]
+
+    async def run(fetcher):
+        return [entry async for entry in fetcher.fetch_many(urls, concurrency=3)]
+
+    results = fetch(run)
+
+    assert [entry_url for entry_url, _ in results] == urls
+    assert results[0][1] == PNG and results[2][1] == PNG
+    assert isinstance(results[1][1], FetchError)
+
+
+def test_fetch_many_limits_concurrency_per_host(server):
+    server.peak = 0
+    urls = [url(server, f"/slow.png?{i}") for i in range(6)]
+
+    async def run(fetcher):
+        started = time.perf_counter()
+        bodies = [body async for _, body in fetcher.fetch_many(urls, concurrency=6)]
+        return bodies, time.perf_counter() - started, fetcher.stats()["active_hosts"]
+
+    bodies, elapsed, active_hosts = fetch(run, max_per_host=2)
+
+    assert bodies == [PNG] * 6
+    assert server.peak == 2
+    assert elapsed >= 0.6  # three rounds of two 0.2 s downloads
+    assert active_hosts == 0  # idle hosts are not kept
+
+
+def test_fetch_many_cancels_pending_downloads(server):
+    urls = [url(server, "/stall.png") for _ in range(3)]
+
+    async def run(fetcher):
+        downloads = fetcher.fetch_many([url(server, "/image.png"), *urls], concurrency=4)
+        first = await downloads.__anext__()
+        await downloads.aclose()
+        return first, fetcher.stats()["active_hosts"]
+
+    (first_url, body), active_hosts = fetch(run)
+
+    assert body == PNG
+    assert active_hosts == 0
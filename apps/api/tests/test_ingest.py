@@ -0,0 +1,117 @@
+"""
+/api/log-detections against a real Postgres.
+
+Set TEST_DATABASE_URL to a database the tests may create the detections
+table in, e.g. TEST_DATABASE_URL=postgresql://postgres@localhost/test;
+they are skipped otherwise. Each test writes under its own session_id and
+deletes its rows afterwards.
+"""
+import asyncio
+import os
+import uuid
+
+import httpx
+import psycopg2
+import pytest
+
+import leaderboard
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+@pytest.fixture
+def session_id(monkeypatch):
+    monkeypatch.setattr(leaderboard.DB, "dsn", TEST_DATABASE_URL)
+    assert asyncio.run(leaderboard.init_database())
+    session_id = f"test-{uuid.uuid4().hex}"
+    yield session_id
+    asyncio.run(leaderboard.DB.close())
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM detections WHERE session_id = %s", (session_id,))
+    conn.close()
+
+
+def post(detections, session_id, key=None):
+    async def send():
+        transport = httpx.ASGITransport(app=leaderboard.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/log-detections", params={"session_id": session_id}, json=detections,
+                                     headers={"Idempotency-Key": key} if key else {})
+
+    response = asyncio.run(send())
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def stored(session_id):
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT class_name, confidence, bbox_x1, bbox_y1, bbox_x2, bbox_y2, idempotency_key
+            FROM detections WHERE session_id = %s ORDER BY id
+        """, (session_id,))
+        rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def test_batch_without_bbox(session_id):
+    detections = [{"class_name": "cup", "confidence": 0.9}, {"class_name": "book", "confidence": 0.4}]
+
+    result = post(detections, session_id)
+
+    assert result["inserted"] == 2
+    assert stored(session_id) == [("cup", 0.9, None, None, None, None, None),
+                                  ("book", 0.4, None, None, None, None, None)]
+
+
+def test_batch_with_mixed_bbox(session_id):
+    detections = [{"class_name": "cup", "confidence": 0.9},
+                  {"class_name": "book", "confidence": 1, "bbox": [1, 2, 30, 40]}]
+
+    result = post(detections, session_id, key=f"{session_id}-mixed")
+
+    assert result["inserted"] == 2
+    assert stored(session_id) == [("cup", 0.9, None, None, None, None, f"{session_id}-mixed:0"),
+                                  ("book", 1.0, 1.0, 2.0, 30.0, 40.0, f"{session_id}-mixed:1")]
+
+
+def test_retry_inserts_nothing(session_id):
+    detections = [{"class_name": "cup", "confidence": 0.9}, {"class_name": "book", "confidence": 0.4}]
+
+    first = post(detections, session_id, key="retry")
+    retry = post(detections, session_id, key="retry")
+
+    assert (first["inserted"], retry["inserted"], retry["duplicates"]) == (2, 0, 2)
+    assert len(stored(session_id)) == 2
+
+
+def test_copy_path(session_id, monkeypatch):
+    monkeypatch.setattr(leaderboard, "INGEST_COPY_MIN_ROWS", 3)
+    detections = [{"class_name": "cup", "confidence": 0.5, "bbox": [0, 0, i + 1, i + 1]} if i % 2 else
+                  {"class_name": "car", "confidence": 0.5} for i in range(5)]
+
+    first = post(detections, session_id, key="copy")
+    retry = post(detections, session_id, key="copy")
+
+    assert (first["inserted"], retry["inserted"], retry["duplicates"]) == (5, 0, 5)
+    rows = stored(session_id)
+    assert [row[0] for row in rows] == ["car", "cup", "car", "cup", "car"]
+    assert rows[0][2:6] == (None, None, None, None)
+    assert rows[1][2:6] == (0.0, 0.0, 2.0, 2.0)
+
+
+@pytest.mark.parametrize("copy_min_rows", [3, 10000])
+def test_empty_strings_are_kept_on_both_paths(session_id, monkeypatch, copy_min_rows):
+    monkeypatch.setattr(leaderboard, "INGEST_COPY_MIN_ROWS", copy_min_rows)
+    body = {"source": "", "user_mode": "", "session_id": session_id,
+            "detections": [{"class_name": "cup", "confidence": 0.5}] * 3}
+
+    post(body, session_id)
+
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cur:
+        cur.execute("SELECT source, user_mode, bbox_x1 FROM detections WHERE session_id = %s", (session_id,))
+        rows = cur.fetchall()
+    conn.close()
+    assert rows == [("", "", None)] * 3
@@ -57,7 +57,8 @@ export const apiEndpoints = {
   getRecentDetections: '/api/recent-detections',
   
   // Logging
-  logDetection: '/api/log-detection'
+  logDetection: '/api/log-detection',
+  logDetections: '/api/log-detections'
 }
 
 // API functions
@@ -107,6 +108,13 @@ export const logDetection = async (detectionData) => {
   return response.data
 }
 
+export const logDetections = async (batch, idempotencyKey) => {
+  const response = await api.post(apiEndpoints.logDetections, batch, {
+    headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {}
+  })
+  return response.data
+}
+
 // Utility functions
 export const blobToFile = (blob, filename) => {
   return new File([blob], filename, { type: blob.type })
@@ -90,7 +90,11 @@ const DetectPage = () => {
       // Call the API
       const apiResponse = await axios.post('/api/infer', formData, {
         headers: {
-          'Content-Type': 'multipart/form-data'
+          'Content-Type': 'multipart/form-data',
+          // Webcam captures are shed before uploads when the server is busy,
+          // and queued work is dropped once the client has stopped waiting
+          'X-Request-Lane': activeTab === 'webcam' ? 'webcam' : 'upload',
+          'X-Request-Deadline-Ms': '30000'
         },
         timeout: 30000 // 30 second timeout
       })
@@ -110,19 +114,27 @@ const DetectPage = () => {
         }
         setDetections(prev => [newDetection, ...prev])
 
-        // Log each detection to the backend
-        for (const result of results) {
+        // Log all detections of this image in one request; the
+        // Idempotency-Key keeps a retried request from counting them twice.
+        // The server keys rows by it across all clients, so it must be unique
+        // to this submission, not just to this client
+        if (results.length > 0) {
+          const idempotencyKey = crypto.randomUUID()
           try {
-            await axios.post('/api/log-detection', {
-              class_name: result.class_name,
-              confidence: result.confidence,
+            await axios.post('/api/log-detections', {
               source: activeTab,
               user_mode: userMode,
-              session_id: `session_${Date.now()}`,
-              bbox: result.bbox
+              session_id: `session_${newDetection.id}`,
+              detections: results.map(result => ({
+                class_name: result.class_name,
+                confidence: result.confidence,
+                bbox: result.bbox
+              }))
+            }, {
+              headers: { 'Idempotency-Key': idempotencyKey }
             })
           } catch (logError) {
-            console.warn('Failed to log detection:', logError)
+            console.warn('Failed to log detections:', logError)
           }
         }
 
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Model Quantization Script for Kids B-Care Object Explorer
+
+Produces a reduced-precision copy of the YOLO ONNX model for CPU serving:
+1. dynamic - INT8 weights, activations quantized on the fly (no calibration)
+2. static  - INT8 weights and activations, calibrated on a local image folder
+3. fp16    - FP16 weights with FP32 inputs/outputs (needs onnxconverter-common)
+
+Calibration images go through the same decode and letterbox code as the
+inference API, so the activation ranges match what the served model sees.
+
+Both INT8 modes write <model stem>.int8.onnx and fp16 writes
+<model stem>.fp16.onnx by default, the paths the API loads with
+MODEL_PRECISION=int8 (or fp16); pass MODEL_QUANTIZED_PATH=<output> for any
+other --output. Compare the result against the FP32 model with
+apps/api/benchmarks/bench_quantized.py.
+
+Usage:
+    python quantize_model.py --model /tmp/yolov8n.onnx --mode static --calibration-dir ./images --output /tmp/yolov8n.int8.onnx
+
+Requires: onnx (pip install onnx)
+"""
+
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "apps" / "api"))
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def list_images(folder, limit=None):
+    """Return sorted image paths under folder (recursively)."""
+    paths = sorted(p for p in Path(folder).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    return paths[:limit] if limit else paths
+
+
+def make_calibration_reader(folder, input_name, imgsz, limit):
+    """Build a CalibrationDataReader that yields letterboxed images from folder."""
+    from onnxruntime.quantization import CalibrationDataReader
+
+    import infer
+
+    class ImageFolderCalibrationReader(CalibrationDataReader):
+        """Feed calibration images preprocessed exactly like /api/infer does."""
+
+        def __init__(self):
+            self.paths = list_images(folder, limit)
+            if not self.paths:
+                raise ValueError(f"No calibration images found in {folder}")
+            self._iter = iter(self.paths)
+            logger.info(f"Calibrating on {len(self.paths)} images from {folder}")
+
+        def get_next(self):
+            path = next(self._iter, None)
+            if path is None:
+                return None
+            decoded = infer._decode_image(path.read_bytes(), (imgsz, imgsz))
+            buffers = (np.full((imgsz, imgsz, 3), 114, dtype=np.uint8),
+                       np.empty((1, 3, imgsz, imgsz), dtype=np.float32))
+            tensor, _, _, _ = infer._preprocess_image(decoded, buffers)
+            return {input_name: tensor}
+
+        def rewind(self):
+            self._iter = iter(self.paths)
+
+    return ImageFolderCalibrationReader()
+
+
+def quantize_dynamic(model_path, output_path, per_channel):
+    """INT8 weights; activation ranges are computed per batch at runtime."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic as ort_quantize_dynamic
+
+    ort_quantize_dynamic(
+        model_path,
+        output_path,
+        weight_type=QuantType.QUInt8,
+        per_channel=per_channel,
+    )
+
+
+def quantize_static(model_path, output_path, calibration_dir, imgsz, limit, per_channel, nodes_to_exclude):
+    """INT8 weights and activations (QDQ format) calibrated on local images."""
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType
+    from onnxruntime.quantization import quantize_static as ort_quantize_static
+
+    input_name = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    reader = make_calibration_reader(calibration_dir, input_name, imgsz, limit)
+
+    ort_quantize_static(
+        model_path,
+        output_path,
+        reader,
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=per_channel,
+        calibrate_method=CalibrationMethod.MinMax,
+        nodes_to_exclude=nodes_to_exclude or [],
+    )
+
+
+def convert_fp16(model_path, output_path):
+    """FP16 weights, keeping FP32 inputs and outputs for the API."""
+    import onnx
+    try:
+        from onnxconverter_common import float16
+    except ImportError:
+        raise RuntimeError("fp16 mode needs onnxconverter-common (pip install onnxconverter-common)")
+
+    model = onnx.load(model_path)
+    onnx.save(float16.convert_float_to_float16(model, keep_io_types=True), output_path)
+
+
+def main():
+    """Main function to run the quantizer"""
+    parser = argparse.ArgumentParser(description='Quantize the Kids B-Care YOLO ONNX model')
+    parser.add_argument('--model', '-m', default=os.getenv("MODEL_PATH", "/tmp/yolov8n.onnx"), help='FP32 ONNX model')
+    parser.add_argument('--output', '-o', help='Output path (default: <model>.int8.onnx, or <model>.fp16.onnx for fp16)')
+    parser.add_argument('--mode', choices=['dynamic', 'static', 'fp16'], default='static', help='Quantization mode')
+    parser.add_argument('--calibration-dir', '-c', help='Image folder for static calibration')
+    parser.add_argument('--calibration-limit', type=int, default=200, help='Maximum calibration images')
+    parser.add_argument('--imgsz', type=int, default=640, help='Calibration input size')
+    parser.add_argument('--per-channel', action='store_true', help='Per-channel weight quantization')
+    parser.add_argument('--exclude-nodes', nargs='*', help='Node names kept in FP32 (e.g. the detection head)')
+    parser.add_argument('--no-preprocess', action='store_true', help='Skip ONNX Runtime quantization pre-processing')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Verbose logging')
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    if args.mode == 'static' and not args.calibration_dir:
+        parser.error("--calibration-dir is required for static quantization")
+
+    # The default is where the API looks for MODEL_PRECISION=<precision>
+    precision = 'fp16' if args.mode == 'fp16' else 'int8'
+    default_path = str(Path(args.model).with_suffix(f".{precision}.onnx"))
+    output_path = args.output or default_path
+    model_path = args.model
+
+    try:
+        # Shape inference and graph cleanup make the quantizer pick up more nodes
+        if args.mode != 'fp16' and not args.no_preprocess:
+            from onnxruntime.quantization.shape_inference import quant_pre_process
+            prepared_path = str(Path(output_path).with_suffix(".prep.onnx"))
+            quant_pre_process(model_path, prepared_path)
+            model_path = prepared_path
+
+        if args.mode == 'dynamic':
+            quantize_dynamic(model_path, output_path, args.per_channel)
+        elif args.mode == 'static':
+            quantize_static(model_path, output_path, args.calibration_dir, args.imgsz,
+                            args.calibration_limit, args.per_channel, args.exclude_nodes)
+        else:
+            convert_fp16(model_path, output_path)
+
+    except Exception as e:
+        logger.error(f"Quantization failed: {str(e)}")
+        print("❌ Quantization failed!")
+        return 1
+
+    finally:
+        if model_path != args.model and os.path.exists(model_path):
+            os.remove(model_path)
+
+    before = os.path.getsize(args.model) / 2**20
+    after = os.path.getsize(output_path) / 2**20
+    print(f"✅ {args.mode} model written to {output_path} ({before:.1f} MiB -> {after:.1f} MiB)")
+    if os.path.abspath(output_path) == os.path.abspath(default_path):
+        print(f"   Serve it with MODEL_PRECISION={precision}")
+    else:
+        print(f"   Serve it with MODEL_PRECISION={precision} MODEL_QUANTIZED_PATH={output_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())